@@ -20,7 +20,10 @@ from mangum import Mangum
 from main import app as fastapi_app
 
 # Create the handler for Vercel
-# lifespan="off" prevents startup/shutdown events that don't work in serverless
+# lifespan="off" prevents startup/shutdown events that don't work in serverless.
+# The shared EIA client (eia.get_eia_client), DB engine (database.get_engine),
+# CryptContext and Stripe module are created lazily on first use and reused by
+# warm invocations; see benchmarks/bench_cold_start.py for the import cost.
 handler = Mangum(fastapi_app, lifespan="off", api_gateway_base_path="/api")
 
 
@@ -355,11 +355,20 @@ const Dashboard: React.FC = () => {
   const fetchOrders = useCallback(async () => {
     if (!user || user.role !== 'owner') return;
     try {
-      const res = await fetch('/api/orders', {
-        headers: { Authorization: `Bearer ${localStorage.getItem('auth_token')}` }
-      });
-      const data = await res.json();
-      setOrders(Array.isArray(data) ? data : []);
+      // The API pages its list; follow X-Next-Cursor until the last page
+      const all: any[] = [];
+      let cursor: string | null = null;
+      do {
+        const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const res: Response = await fetch(`/api/orders${query}`, {
+          headers: { Authorization: `Bearer ${localStorage.getItem('auth_token')}` }
+        });
+        const data = await res.json();
+        if (!Array.isArray(data)) break;
+        all.push(...data);
+        cursor = res.headers.get('X-Next-Cursor');
+      } while (cursor);
+      setOrders(all);
     } catch (err) {
       setOrders([]);
     }
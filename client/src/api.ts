@@ -139,6 +139,14 @@ export async function getPrices(timePeriod?: 'hour' | 'day' | 'week', productTyp
       useSimulation = true;
     }
     
+    // Let the server filter by product and region so only matching rows are sent
+    const params = new URLSearchParams();
+    if (productType) params.set('product', productType);
+    if (region && region !== 'National') params.set('region', region);
+    if (params.toString()) {
+      endpoint = `${endpoint}?${params.toString()}`;
+    }
+    
     console.log(`Fetching data from: ${endpoint} for timePeriod: ${timePeriod}, productType: ${productType}, region: ${region}, simulation: ${useSimulation}`);
     
     const json = await apiRequest(endpoint);
@@ -284,3 +292,66 @@ export async function createOrder(orderData: any) {
     body: JSON.stringify(orderData),
   });
 }
+
+// Live price/alert push (Server-Sent Events). EventSource cannot send an
+// Authorization header, so each connection first trades the session for a
+// short-lived stream token, which is the only token /stream takes in the
+// query string. Cached /prices responses are dropped when a new observation
+// arrives. Call the returned function to unsubscribe.
+export function subscribePrices(
+  handlers: { onPrice?: (row: any) => void; onAlert?: (alert: any) => void },
+  productType?: 'Gasoline' | 'Diesel',
+  region?: string
+) {
+  let source: EventSource | null = null;
+  let timer: ReturnType<typeof setTimeout> | null = null;
+  let closed = false;
+
+  const reconnect = () => {
+    source?.close();
+    source = null;
+    if (!closed && timer === null) {
+      timer = setTimeout(() => {
+        timer = null;
+        connect();
+      }, 5000);
+    }
+  };
+
+  const connect = async () => {
+    let token: string;
+    try {
+      token = (await apiRequest('/stream/token', { method: 'POST' })).token;
+    } catch {
+      reconnect();
+      return;
+    }
+    if (closed) return;
+    const params = new URLSearchParams({ token });
+    if (productType) params.set('product', productType);
+    if (region) params.set('region', region);
+
+    source = new EventSource(`${API_BASE}/stream?${params}`);
+    source.addEventListener('price', (event) => {
+      cache.clear();
+      handlers.onPrice?.(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('alert', (event) => {
+      handlers.onAlert?.(JSON.parse((event as MessageEvent).data));
+    });
+    // Dropped as a slow consumer: reconnect and let the caller re-fetch
+    source.addEventListener('dropped', reconnect);
+    // The browser retries a lost connection with the same URL, whose token
+    // has expired by then; start over with a fresh token instead
+    source.onerror = reconnect;
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    if (timer !== null) clearTimeout(timer);
+    timer = null;
+    source?.close();
+    source = null;
+  };
+}
@@ -0,0 +1,210 @@
+"""
+Vectorized evaluation of PriceAlert thresholds against new price observations.
+
+An alert fires on a price period when the price is at or below its threshold
+and either the price was above the threshold at the previous period of the
+same series, or the alert has never fired. Holding below the threshold for
+several weeks therefore fires once; the alert re-arms when the price goes
+back above it. Firings are stored in alert_firings, unique per (alert,
+period), so re-evaluating the same batch never fires twice.
+
+Active alerts are loaded grouped by (product, area) into NumPy arrays and each
+price point is compared against a whole group at once.
+"""
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AlertFiring, PriceAlert, PriceObservation
+from price_store import PRODUCT_CODES
+
+# Alerts evaluate against the weekly series, using one EIA product per alert product
+ALERT_FREQUENCY = "weekly"
+# Rows fetched per round trip when loading alerts
+ALERT_LOAD_CHUNK = 50000
+FIRING_INSERT_CHUNK = 1000
+
+
+class FiredAlert(NamedTuple):
+    alert_id: int
+    user_id: int
+    product: str
+    area: str
+    threshold: float
+    period: date
+    price: float
+
+
+class AlertGroup:
+    """Active alerts for one (product, area), column-wise."""
+
+    __slots__ = ("product", "area", "ids", "user_ids", "thresholds", "has_fired")
+
+    def __init__(self, product: str, area: str, ids, user_ids, thresholds, has_fired):
+        self.product = product
+        self.area = area
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.has_fired = np.asarray(has_fired, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class PriceSeries:
+    """New points of one (product, area) series plus the point just before them."""
+
+    __slots__ = ("periods", "values", "prev_value")
+
+    def __init__(self, periods, values, prev_value: Optional[float] = None):
+        order = np.argsort(periods)
+        self.periods = np.asarray(periods, dtype=np.int64)[order]
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.prev_value = prev_value
+
+
+def crossings(group: AlertGroup, series: PriceSeries) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (alert_index, point_index) for every firing of `group` over `series`.
+
+    Loops over the (few) price points and compares each against every alert
+    in the group at once, so memory stays O(alerts) regardless of batch size.
+    """
+    n = len(series.values)
+    prev_values = np.empty(n, dtype=np.float64)
+    prev_values[0] = np.nan if series.prev_value is None else series.prev_value
+    prev_values[1:] = series.values[:-1]
+    has_fired = group.has_fired.copy()
+
+    alert_hits = []
+    point_hits = []
+    for k in range(n):
+        below = group.thresholds >= series.values[k]
+        # NaN (no previous price) compares False, i.e. counts as "was above"
+        was_above = ~(group.thresholds >= prev_values[k])
+        mask = below & (was_above | ~has_fired)
+        has_fired |= mask
+        hits = np.flatnonzero(mask)
+        if hits.size:
+            alert_hits.append(hits)
+            point_hits.append(np.full(hits.size, k, dtype=np.int64))
+    if not alert_hits:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(alert_hits), np.concatenate(point_hits)
+
+
+async def load_series(db: AsyncSession, since: date) -> Dict[str, Dict[str, PriceSeries]]:
+    """New weekly points from `since` on, keyed by alert product then lower-cased area alias."""
+    codes = {code: product for product, code in PRODUCT_CODES.items()}
+    stmt = select(
+        PriceObservation.product, PriceObservation.area_code, PriceObservation.area_name,
+        PriceObservation.period, PriceObservation.value,
+    ).where(
+        PriceObservation.frequency == ALERT_FREQUENCY,
+        PriceObservation.product.in_(list(codes)),
+        PriceObservation.period >= since,
+    )
+    points: Dict[Tuple[str, str], list] = {}
+    names: Dict[Tuple[str, str], str] = {}
+    for product_code, area_code, area_name, period, value in (await db.execute(stmt)).all():
+        key = (product_code, area_code)
+        points.setdefault(key, []).append((period.toordinal(), value))
+        names[key] = area_name
+
+    series: Dict[str, Dict[str, PriceSeries]] = {}
+    for (product_code, area_code), rows in points.items():
+        prev_stmt = select(PriceObservation.period, PriceObservation.value).where(
+            PriceObservation.frequency == ALERT_FREQUENCY,
+            PriceObservation.product == product_code,
+            PriceObservation.area_code == area_code,
+            PriceObservation.period < since,
+        ).order_by(PriceObservation.period.desc()).limit(1)
+        prev = (await db.execute(prev_stmt)).first()
+        periods, values = zip(*rows)
+        s = PriceSeries(periods, values, prev.value if prev else None)
+        by_area = series.setdefault(codes[product_code], {})
+        by_area[area_code.lower()] = s
+        by_area[names[(product_code, area_code)].lower()] = s
+    return series
+
+
+async def load_alert_groups(db: AsyncSession, product: str) -> Dict[str, AlertGroup]:
+    """All active alerts for `product`, grouped by lower-cased area."""
+    fired = select(AlertFiring.alert_id).distinct().subquery()
+    stmt = select(
+        PriceAlert.id, PriceAlert.user_id, PriceAlert.area, PriceAlert.threshold,
+        fired.c.alert_id.is_not(None),
+    ).outerjoin(fired, fired.c.alert_id == PriceAlert.id).where(
+        PriceAlert.product == product, PriceAlert.active == true()
+    )
+    columns: Dict[str, Tuple[list, list, list, list, str]] = {}
+    result = await db.stream(stmt.execution_options(yield_per=ALERT_LOAD_CHUNK))
+    async for alert_id, user_id, area, threshold, has_fired in result:
+        key = area.strip().lower()
+        cols = columns.get(key)
+        if cols is None:
+            cols = columns[key] = ([], [], [], [], area)
+        cols[0].append(alert_id)
+        cols[1].append(user_id)
+        cols[2].append(threshold)
+        cols[3].append(bool(has_fired))
+    return {key: AlertGroup(product, cols[4], *cols[:4]) for key, cols in columns.items()}
+
+
+async def record_firings(db: AsyncSession, fired: List[FiredAlert]) -> List[FiredAlert]:
+    """Insert firings, skipping (alert, period) pairs already recorded. Returns the new ones."""
+    if not fired:
+        return []
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    new_keys = set()
+    for i in range(0, len(fired), FIRING_INSERT_CHUNK):
+        chunk = fired[i:i + FIRING_INSERT_CHUNK]
+        stmt = insert(AlertFiring).values([
+            {"alert_id": f.alert_id, "user_id": f.user_id, "period": f.period, "price": f.price} for f in chunk
+        ]).on_conflict_do_nothing(index_elements=["alert_id", "period"])
+        result = await db.execute(stmt.returning(AlertFiring.alert_id, AlertFiring.period))
+        new_keys.update((row.alert_id, row.period) for row in result)
+    await db.commit()
+    return [f for f in fired if (f.alert_id, f.period) in new_keys]
+
+
+async def evaluate_alerts(db: AsyncSession, since: date) -> List[FiredAlert]:
+    """Evaluate all active alerts against weekly prices from `since` on; returns new firings."""
+    series_by_product = await load_series(db, since)
+    fired: List[FiredAlert] = []
+    for product, series_by_area in series_by_product.items():
+        for area_key, group in (await load_alert_groups(db, product)).items():
+            series = series_by_area.get(area_key)
+            if series is None:
+                continue
+            alert_idx, point_idx = crossings(group, series)
+            for a, k in zip(alert_idx.tolist(), point_idx.tolist()):
+                fired.append(FiredAlert(
+                    int(group.ids[a]), int(group.user_ids[a]), product, group.area,
+                    float(group.thresholds[a]), date.fromordinal(int(series.periods[k])),
+                    float(series.values[k]),
+                ))
+    return await record_firings(db, fired)
+
+
+async def evaluate_after_ingest(db: AsyncSession, frequency: str, result) -> List[FiredAlert]:
+    """IngestScheduler listener: evaluate alerts against the periods just ingested.
+
+    The first sync backfills years of history, so only its latest period is
+    evaluated; later syncs start at the previous watermark.
+    """
+    if frequency != ALERT_FREQUENCY:
+        return []
+    since = result.watermark or result.upstream_latest
+    if since is None:
+        return []
+    fired = await evaluate_alerts(db, since)
+    if fired:
+        print(f"{len(fired)} price alert(s) fired for periods since {since.isoformat()}")
+    return fired
@@ -0,0 +1,106 @@
+"""
+Server-side price aggregation: OHLC candles, rolling statistics and summary stats.
+
+Everything is computed with NumPy over a single price series so the browser
+receives a few dozen buckets instead of every raw EIA row.
+"""
+from datetime import date, timedelta
+from typing import List, Tuple
+
+import numpy as np
+
+from cache import TTLCache
+
+BUCKETS = ("week", "month", "quarter")
+# Results are keyed by the series' latest period too, so new data is never
+# masked by a cached aggregate; the TTL only bounds how long unused keys stay
+aggregate_cache = TTLCache(maxsize=256, ttl=3600.0)
+
+_EPOCH = date(1970, 1, 1)
+
+
+def bucket_keys(days: np.ndarray, bucket: str) -> np.ndarray:
+    """Integer bucket id for each day-since-epoch."""
+    if bucket == "week":
+        # 1970-01-05 was a Monday; weeks run Monday..Sunday like EIA's weekly periods
+        return (days - 4) // 7
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return months if bucket == "month" else months // 3
+
+
+def bucket_label(key: int, bucket: str) -> str:
+    if bucket == "week":
+        return (_EPOCH + timedelta(days=int(key) * 7 + 4)).isoformat()
+    if bucket == "month":
+        return f"{1970 + int(key) // 12}-{int(key) % 12 + 1:02d}"
+    return f"{1970 + int(key) // 4}-Q{int(key) % 4 + 1}"
+
+
+def ohlc(days: np.ndarray, values: np.ndarray, bucket: str) -> List[dict]:
+    """Open/high/low/close/mean per bucket. `days` must be sorted ascending."""
+    if not len(values):
+        return []
+    keys = bucket_keys(days, bucket)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.concatenate((starts[1:], [len(values)]))
+    counts = ends - starts
+    opens = values[starts]
+    closes = values[ends - 1]
+    highs = np.maximum.reduceat(values, starts)
+    lows = np.minimum.reduceat(values, starts)
+    means = np.add.reduceat(values, starts) / counts
+    return [
+        {"period": bucket_label(k, bucket), "open": round(o, 4), "high": round(h, 4), "low": round(lo, 4),
+         "close": round(c, 4), "mean": round(m, 4), "count": int(n)}
+        for k, o, h, lo, c, m, n in zip(keys[starts].tolist(), opens.tolist(), highs.tolist(),
+                                         lows.tolist(), closes.tolist(), means.tolist(), counts.tolist())
+    ]
+
+
+def rolling(values: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Rolling mean of prices and rolling std-dev of period-over-period returns.
+
+    Both are NaN until the window is full. Uses cumulative sums, so the cost
+    is O(n) regardless of window size.
+    """
+    n = len(values)
+    mean = np.full(n, np.nan)
+    vol = np.full(n, np.nan)
+    if window < 1 or n < window:
+        return mean, vol
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    mean[window - 1:] = (csum[window:] - csum[:-window]) / window
+    if window >= 2 and n > window:
+        returns = np.diff(values) / values[:-1]
+        r1 = np.concatenate(([0.0], np.cumsum(returns)))
+        r2 = np.concatenate(([0.0], np.cumsum(returns * returns)))
+        s1 = r1[window:] - r1[:-window]
+        s2 = r2[window:] - r2[:-window]
+        var = np.maximum(s2 / window - (s1 / window) ** 2, 0.0) * window / (window - 1)
+        vol[window:] = np.sqrt(var)
+    return mean, vol
+
+
+def summarize(periods: List[date], values: List[float], bucket: str, window: int) -> dict:
+    """Candles, rolling series and summary stats for one oldest-first price series."""
+    days = np.fromiter((p.toordinal() - _EPOCH.toordinal() for p in periods), dtype=np.int64, count=len(periods))
+    vals = np.asarray(values, dtype=np.float64)
+    mean, vol = rolling(vals, window)
+    rolling_rows = [
+        {"period": p.isoformat(), "value": v, "mean": round(m, 4), "volatility": None if np.isnan(s) else round(s, 6)}
+        for p, v, m, s in zip(periods, values, mean.tolist(), vol.tolist())
+        if not np.isnan(m)
+    ]
+    stats = None
+    if len(vals):
+        stats = {
+            "min": float(vals.min()),
+            "max": float(vals.max()),
+            "avg": round(float(vals.mean()), 4),
+            "latest": float(vals[-1]),
+            "change": round(float(vals[-1] - vals[0]), 4),
+            "points": int(len(vals)),
+            "first_period": periods[0].isoformat(),
+            "last_period": periods[-1].isoformat(),
+        }
+    return {"candles": ohlc(days, vals, bucket), "rolling": rolling_rows, "stats": stats}
@@ -0,0 +1,65 @@
+"""
+Benchmark the vectorized alert evaluation core: M alerts x N price points.
+
+Usage (from python_backend/):
+    python benchmarks/bench_alert_engine.py --alerts 1000000 --points 52 --groups 20
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from alert_engine import AlertGroup, PriceSeries, crossings  # noqa: E402
+
+
+def build(args, rng):
+    sizes = np.full(args.groups, args.alerts // args.groups)
+    sizes[: args.alerts % args.groups] += 1
+    groups = []
+    next_id = 0
+    for size in sizes:
+        ids = np.arange(next_id, next_id + size)
+        next_id += size
+        groups.append(AlertGroup(
+            "Diesel", "bench", ids, ids % 10000,
+            rng.uniform(3.0, 4.5, size), rng.random(size) < 0.3,
+        ))
+    start_day = 738000
+    series = []
+    for _ in range(args.groups):
+        walk = 3.8 + np.cumsum(rng.normal(0, 0.05, args.points))
+        series.append(PriceSeries(np.arange(start_day, start_day + 7 * args.points, 7), walk, 3.8))
+    return groups, series
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    groups, series = build(args, rng)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    fired = 0
+    for group, s in zip(groups, series):
+        alert_idx, _ = crossings(group, s)
+        fired += alert_idx.size
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    comparisons = args.alerts * args.points
+    print(f"{args.alerts:,} alerts x {args.points} points in {args.groups} groups: "
+          f"{elapsed * 1000:.1f} ms, {comparisons / elapsed / 1e6:.0f}M alert-points/s, "
+          f"peak {peak / 2**20:.1f} MiB, {fired:,} firings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alerts", type=int, default=1_000_000)
+    parser.add_argument("--points", type=int, default=52)
+    parser.add_argument("--groups", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,169 @@
+"""
+Load test: fan-out of price events to thousands of /stream subscribers.
+
+Hub mode attaches --subscribers simulated clients straight to a BroadcastHub,
+each draining its stream the way the SSE endpoint does, with random
+product/region filters and a --slow fraction that never reads. It checks
+every live client received exactly the events matching its filters, that
+slow clients were dropped, and reports publish CPU and delivery latency.
+
+SSE mode (--sse-clients > 0) runs the app under uvicorn and connects real
+HTTP clients to /stream, measuring publish-to-receive latency end to end.
+
+Usage (from python_backend/):
+    python benchmarks/bench_broadcast.py --subscribers 5000 --events 400 --sse-clients 200
+"""
+import argparse
+import asyncio
+import random
+import socket
+import time
+
+import orjson
+
+from harness import app_environment, summarize
+from stub_eia import make_rows
+
+PRODUCTS = (None, "Diesel", "Gasoline")
+
+
+def matches(product, region, row):
+    from regions import area_regions, product_keys
+
+    if product and product not in product_keys(row):
+        return False
+    return region is None or region in area_regions(row.get("duoarea", ""), row.get("area-name", ""))
+
+
+async def hub_mode(args):
+    from realtime import BroadcastHub, stream_events
+    from regions import REGIONS
+
+    hub = BroadcastHub()
+    rng = random.Random(7)
+    rows = make_rows(args.events)
+    latencies = []
+    clients = []
+
+    async def consume(sub, slow, received):
+        if slow:
+            await asyncio.Event().wait()  # never reads
+        async for message in stream_events(sub, heartbeat=3600):
+            if message.startswith(b"event: price"):
+                row = orjson.loads(message.split(b"data: ", 1)[1])
+                latencies.append(time.perf_counter() - row["sent_at"])
+                received.append(row["period"] + row["duoarea"] + row["product"])
+
+    tasks = []
+    for i in range(args.subscribers):
+        product = rng.choice(PRODUCTS)
+        region = rng.choice((None,) + REGIONS)
+        slow = rng.random() < args.slow
+        sub = hub.subscribe(product, region, user_id=i)
+        received = []
+        clients.append((product, region, slow, received, sub))
+        tasks.append(asyncio.create_task(consume(sub, slow, received)))
+    await asyncio.sleep(0)
+
+    publish_cpu = 0.0
+    started = time.perf_counter()
+    for offset in range(0, len(rows), args.burst):
+        cpu = time.process_time()
+        for row in rows[offset:offset + args.burst]:
+            hub.publish_price({**row, "sent_at": time.perf_counter()})
+        publish_cpu += time.process_time() - cpu
+        await asyncio.sleep(0)  # let subscribers drain between bursts
+    # Slow clients never drain; wait only on live ones still holding a backlog
+    while any(not c[4].queue.empty() for c in clients if not c[2]):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    wrong = 0
+    for product, region, slow, received, _ in clients:
+        if slow:
+            continue
+        expected = [r["period"] + r["duoarea"] + r["product"] for r in rows if matches(product, region, r)]
+        wrong += received != expected
+    slow_total = sum(1 for c in clients if c[2])
+    slow_dropped = sum(1 for c in clients if c[2] and c[4].dropped)
+    stats = summarize(latencies, elapsed)
+    print(f"hub: {args.subscribers} subscribers ({slow_total} slow), {args.events} events")
+    print(f"  delivered {hub.delivered} messages in {elapsed:.2f}s  "
+          f"({hub.delivered / elapsed:,.0f} msg/s, publish CPU {publish_cpu / args.events * 1000:.3f} ms/event)")
+    print(f"  latency p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms")
+    print(f"  dropped {hub.dropped} (slow clients dropped: {slow_dropped}/{slow_total}), live clients with wrong events: {wrong}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def sse_mode(args):
+    import httpx
+    import uvicorn
+
+    import main
+    from harness import login
+    from realtime import hub
+
+    main.limiter.enabled = False
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=args.sse_clients + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+        headers = await login(client)
+        token = (await client.post("/stream/token", headers=headers)).json()["token"]
+        latencies = []
+        ready = 0
+
+        async def listen():
+            nonlocal ready
+            async with client.stream("GET", "/stream", params={"token": token}) as resp:
+                ready += 1
+                async for line in resp.aiter_lines():
+                    if line.startswith("data: "):
+                        row = orjson.loads(line[6:])
+                        latencies.append(time.perf_counter() - row["sent_at"])
+                        if row.get("last"):
+                            return
+
+        listeners = [asyncio.create_task(listen()) for _ in range(args.sse_clients)]
+        while hub.subscribers < args.sse_clients:
+            await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        rows = make_rows(args.sse_events)
+        for i, row in enumerate(rows):
+            hub.publish_price({**row, "sent_at": time.perf_counter(), "last": i == len(rows) - 1})
+            await asyncio.sleep(0)
+        await asyncio.wait_for(asyncio.gather(*listeners), timeout=120)
+        elapsed = time.perf_counter() - started
+
+    stats = summarize(latencies, elapsed)
+    print(f"sse: {args.sse_clients} HTTP clients, {args.sse_events} events, {len(latencies)} received in {elapsed:.2f}s")
+    print(f"  latency p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms")
+    server.should_exit = True
+    await serve
+
+
+async def main_async(args):
+    await hub_mode(args)
+    if args.sse_clients:
+        await sse_mode(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=400)
+    parser.add_argument("--burst", type=int, default=24, help="events published per loop iteration")
+    parser.add_argument("--slow", type=float, default=0.01, help="fraction of subscribers that never read")
+    parser.add_argument("--sse-clients", type=int, default=200)
+    parser.add_argument("--sse-events", type=int, default=50)
+    cli_args = parser.parse_args()
+    with app_environment():
+        asyncio.run(main_async(cli_args))
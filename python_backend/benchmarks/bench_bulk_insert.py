@@ -0,0 +1,60 @@
+"""
+Benchmark: rows/sec for single-row vs bulk order and alert creation.
+
+Creates the same number of orders (and alerts) through the single-row
+endpoints, one request per row, and through the bulk endpoints in batches.
+
+Usage (from python_backend/):
+    python benchmarks/bench_bulk_insert.py --rows 2000 --batch-size 500
+"""
+import argparse
+import asyncio
+import time
+
+from harness import app_client, app_environment, login
+
+ORDER = {"product": "Diesel", "area": "PADD 1", "quantity": 500, "target_price": 3.25, "location": "Depot 7"}
+ALERT = {"product": "Gasoline", "area": "U.S.", "threshold": 2.99}
+
+
+async def single_rows(client, headers, path, item, rows, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            resp = await client.post(path, json=item, headers=headers)
+            resp.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(rows)))
+    return time.perf_counter() - start
+
+
+async def bulk_rows(client, headers, path, item, rows, batch_size):
+    start = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        batch = [item] * min(batch_size, rows - offset)
+        resp = await client.post(path, json={"items": batch}, headers=headers)
+        resp.raise_for_status()
+        assert resp.json()["created"] == len(batch)
+    return time.perf_counter() - start
+
+
+async def main(args):
+    async with app_client() as client:
+        headers = await login(client)
+        for label, path, item in (("orders", "/orders", ORDER), ("alerts", "/alerts", ALERT)):
+            single = await single_rows(client, headers, path, item, args.rows, args.concurrency)
+            bulk = await bulk_rows(client, headers, f"{path}/bulk", item, args.rows, args.batch_size)
+            print(f"{label:<7} single-row {args.rows / single:9.1f} rows/s   "
+                  f"bulk x{args.batch_size} {args.rows / bulk:9.1f} rows/s   ({single / bulk:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    cli_args = parser.parse_args()
+    with app_environment():
+        asyncio.run(main(cli_args))
@@ -0,0 +1,111 @@
+"""
+Cold-start import cost of the serverless entry point, per module.
+
+Imports the app in fresh interpreters under `python -X importtime` (with
+SERVERLESS=true, as api/index.py runs it), takes the median of --runs, and
+reports total import time plus the most expensive packages by self time
+summed over their submodules. With --record the result is appended as a JSON
+line to a history file, and the previous record is printed alongside, so
+cold-start regressions show up per package.
+
+Usage (from python_backend/):
+    python benchmarks/bench_cold_start.py --runs 5
+    python benchmarks/bench_cold_start.py --record benchmarks/cold_start_history.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND = Path(__file__).parent.parent
+ENTRIES = {
+    # Module imported in the fresh interpreter, and extra sys.path entries
+    "main": ("main", [BACKEND]),
+    "api": ("index", [BACKEND.parent / "api", BACKEND]),
+}
+
+
+def import_profile(entry: str) -> dict:
+    """One cold import: total microseconds and self microseconds per top-level package."""
+    module, paths = ENTRIES[entry]
+    env = {**os.environ, "SERVERLESS": "true", "PYTHONPATH": os.pathsep.join(map(str, paths))}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr[-2000:])
+    per_package = defaultdict(int)
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        per_package[name.split(".")[0]] += int(self_us)
+        if name == module:
+            total = int(cumulative_us)
+    return {"total_us": total, "packages": dict(per_package)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def last_record(path: Path, entry: str):
+    if not path.exists():
+        return None
+    records = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+    records = [r for r in records if r.get("entry") == entry]
+    return records[-1] if records else None
+
+
+def main(args):
+    runs = [import_profile(args.entry) for _ in range(args.runs)]
+    packages = {name for run in runs for name in run["packages"]}
+    median = {
+        name: statistics.median(run["packages"].get(name, 0) for run in runs)
+        for name in packages
+    }
+    result = {
+        "entry": args.entry,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": git_revision(),
+        "runs": args.runs,
+        "total_ms": round(statistics.median(run["total_us"] for run in runs) / 1000, 1),
+        "packages_ms": {name: round(us / 1000, 1) for name, us in sorted(median.items(), key=lambda kv: -kv[1])},
+    }
+
+    previous = last_record(Path(args.record), args.entry) if args.record else None
+    before = previous["packages_ms"] if previous else {}
+    print(f"{args.entry}: cold import {result['total_ms']} ms (median of {args.runs})"
+          + (f", was {previous['total_ms']} ms at {previous['revision']}" if previous else ""))
+    for name, ms in list(result["packages_ms"].items())[:args.top]:
+        delta = f"  ({ms - before[name]:+.1f})" if name in before else ""
+        print(f"  {name:<24} {ms:>8.1f} ms{delta}")
+    gone = [name for name in before if name not in result["packages_ms"]]
+    if gone:
+        print(f"  no longer imported: {', '.join(sorted(gone))}")
+
+    if args.record:
+        with open(args.record, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entry", choices=list(ENTRIES), default="main",
+                        help="'main' imports the app, 'api' the Vercel handler (needs mangum)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--record", help="JSONL history file to compare against and append to")
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+"""
+Benchmark: per-request database overhead under each engine pool mode.
+
+Each simulated request opens a session, loads one user by primary key and
+closes the session, the way an authenticated endpoint does. Modes compared:
+  queue         pooled connections with pre-ping (long-running server default)
+  queue-noping  pooled connections without the pre-ping round trip
+  null          a new connection per request (serverless default)
+
+Defaults to a throwaway SQLite file; pass --url to point at Postgres (use the
+pooler URL with DB_PGBOUNCER=true to exercise the statement-cache settings).
+
+Usage (from python_backend/):
+    python benchmarks/bench_db_overhead.py --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from harness import summarize  # noqa: E402
+
+MODES = {
+    "queue": ("queue", True),
+    "queue-noping": ("queue", False),
+    "null": ("null", False),
+}
+
+
+async def run_mode(url, mode, requests, concurrency):
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    from database import Base, User, engine_options
+
+    pool_mode, pre_ping = MODES[mode]
+    options = engine_options(url, pool_mode)
+    if "pool_pre_ping" in options:
+        options["pool_pre_ping"] = pre_ping
+    engine = create_async_engine(url, **options)
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with sessions() as db:
+        user = (await db.execute(select(User).where(User.email == "bench-db@example.com"))).scalar_one_or_none()
+        if user is None:
+            user = User(name="Bench", email="bench-db@example.com", password="x", role="trucker")
+            db.add(user)
+            await db.commit()
+        user_id = user.id
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            async with sessions() as db:
+                await db.get(User, user_id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return summarize(latencies, elapsed)
+
+
+async def main(args):
+    url = args.url
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="oil-bench-db-")
+        url = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    print(f"{'mode':<14} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for mode in args.modes:
+        stats = await run_mode(url, mode, args.requests, args.concurrency)
+        print(f"{mode:<14} {stats['throughput_rps']:9.1f} {stats['p50_ms']:9.2f} "
+              f"{stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=None, help="async SQLAlchemy URL (default: temp SQLite)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""
+Benchmark: fresh httpx.AsyncClient per request vs the shared pooled EIA client.
+
+Usage (from python_backend/):
+    python benchmarks/bench_eia_client.py --requests 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from stub_eia import running_stub  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(label, fetch, requests, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            await fetch()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {requests / elapsed:8.1f} req/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+          f"p95 {percentile(latencies, 95) * 1000:7.2f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:7.2f} ms")
+
+
+async def main(args):
+    import httpx
+    import eia
+
+    params = eia.price_params("weekly", args.rows)
+
+    async def fresh():
+        async with httpx.AsyncClient(base_url=eia.EIA_BASE_URL, timeout=eia.EIA_TIMEOUT) as client:
+            resp = await client.get(eia.EIA_PRICES_PATH, params=params)
+            resp.raise_for_status()
+            resp.json()
+
+    async def pooled():
+        await eia.fetch_prices("weekly", args.rows)
+
+    await pooled()  # warm the pool
+    await run("fresh client", fresh, args.requests, args.concurrency)
+    await run("shared client", pooled, args.requests, args.concurrency)
+    await eia.close_eia_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub latency in seconds")
+    cli_args = parser.parse_args()
+    with running_stub(rows=cli_args.rows, latency=cli_args.latency) as (base_url, _):
+        os.environ["EIA_BASE_URL"] = base_url
+        asyncio.run(main(cli_args))
@@ -0,0 +1,120 @@
+"""
+Benchmark forecasting: full fit, one-week incremental refit, and serving, across all series.
+
+Builds --series synthetic weekly series (half diesel, half gasoline) of
+--weeks periods: a random walk with a yearly cycle and a few injected
+jumps. It times a full fit, applying one new week to every series, and looking
+up each series' precomputed output. It reports how many injected jumps were
+flagged.
+
+With --requests it also stores the series in a temp SQLite database and
+times /api/owner/forecast through the app. The first request fits the model
+and the rest are served from the outputs (or the rendered-response cache).
+
+Usage (from python_backend/):
+    python benchmarks/bench_forecast.py --series 200 --weeks 1600 --requests 200
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from harness import app_environment, login, percentile
+
+OWNER = {"email": "owner@example.com", "password": "bench-password", "role": "owner"}
+
+
+def make_observations(args, rng):
+    from price_store import PRODUCT_CODES
+
+    codes = list(PRODUCT_CODES.items())
+    start = date(1994, 1, 3)
+    weeks = np.arange(args.weeks)
+    observations = []
+    jumps = set()
+    for i in range(args.series):
+        product, code = codes[i % 2]
+        walk = 3.0 + np.cumsum(rng.normal(0, 0.02, args.weeks)) + 0.15 * np.sin(2 * np.pi * weeks / 52)
+        for week in rng.choice(np.arange(args.weeks // 4, args.weeks), args.jumps, replace=False).tolist():
+            walk[week:] += rng.choice((-1, 1)) * 0.5
+            jumps.add((code, f"A{i}", week))
+        observations.extend(
+            {"product": code, "product_name": product, "area_code": f"A{i}", "area_name": f"Area {i}",
+             "period": start + timedelta(weeks=week), "value": round(value, 3)}
+            for week, value in enumerate(walk.tolist())
+        )
+    return observations, jumps, start
+
+
+def in_memory(args, observations, jumps, start):
+    from forecast import Forecaster
+
+    last = start + timedelta(weeks=args.weeks - 1)
+    history = [obs for obs in observations if obs["period"] < last]
+    newest = [obs for obs in observations if obs["period"] == last]
+
+    model = Forecaster()
+    t = time.perf_counter()
+    points = model.update(history)
+    fit = time.perf_counter() - t
+    t = time.perf_counter()
+    model.update(newest)
+    step = time.perf_counter() - t
+    t = time.perf_counter()
+    model.publish()
+    publish = time.perf_counter() - t
+
+    latencies = []
+    for code, area_code in model.keys:
+        t = time.perf_counter()
+        model.series(code, area_code)
+        latencies.append(time.perf_counter() - t)
+    flagged = {(code, area_code, (date.fromisoformat(a["period"]) - start).days // 7)
+               for code, area_code in model.keys for a in model.series(code, area_code)[0]["anomalies"]}
+    print(f"fit:   {len(model)} series, {points:,} points in {fit * 1000:.0f} ms "
+          f"({points / fit / 1e6:.2f}M points/s)")
+    print(f"step:  one new week for every series {step * 1000:.2f} ms; publish {publish * 1000:.2f} ms")
+    print(f"serve: p50 {percentile(latencies, 50) * 1e6:.1f} us, p99 {percentile(latencies, 99) * 1e6:.1f} us per series")
+    print(f"flags: {len(flagged & jumps)}/{len(jumps)} injected jumps among the kept flags, "
+          f"{len(flagged - jumps)} other flags")
+
+
+async def through_app(args, observations):
+    from harness import app_client
+    from database import AsyncSessionLocal
+    from price_store import upsert_observations
+
+    async with app_client() as client:
+        async with AsyncSessionLocal() as db:
+            await upsert_observations(db, [{**obs, "series": f"{obs['product']}_{obs['area_code']}",
+                                            "frequency": "weekly"} for obs in observations])
+            await db.commit()
+        headers = await login(client, OWNER["email"], OWNER["password"], OWNER["role"])
+        latencies = []
+        for i in range(args.requests):
+            params = {"product": ("Diesel", "Gasoline")[i % 2]}
+            if i % 4 >= 2:
+                params["area"] = f"Area {i % args.series}"
+            t = time.perf_counter()
+            resp = await client.get("/api/owner/forecast", headers=headers, params=params)
+            latencies.append(time.perf_counter() - t)
+            assert resp.status_code == 200, resp.text
+    print(f"app:   first request (fit) {latencies[0] * 1000:.0f} ms; then p50 "
+          f"{percentile(latencies[1:], 50) * 1000:.2f} ms, p95 {percentile(latencies[1:], 95) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--weeks", type=int, default=1600)
+    parser.add_argument("--jumps", type=int, default=3, help="injected jumps per series")
+    parser.add_argument("--requests", type=int, default=0, help="also time this many /api/owner/forecast calls")
+    cli_args = parser.parse_args()
+
+    with app_environment():
+        data, injected, first_period = make_observations(cli_args, np.random.default_rng(42))
+        in_memory(cli_args, data, injected, first_period)
+        if cli_args.requests:
+            asyncio.run(through_app(cli_args, data))
@@ -0,0 +1,80 @@
+"""
+Load test: /prices latency while a storm of logins hashes passwords.
+
+Compares /prices p50/p99 with no logins, with a login storm using the hash
+worker pool, and with the same storm hashing inline on the event loop (the
+old behaviour).
+
+Usage (from python_backend/):
+    python benchmarks/bench_login_storm.py --logins 40 --price-requests 200
+"""
+import argparse
+import asyncio
+import time
+
+from harness import app_client, app_environment, login, summarize
+
+
+async def measure_prices(client, headers, requests, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            resp = await client.get("/prices", headers=headers)
+            latencies.append(time.perf_counter() - start)
+            resp.raise_for_status()
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies
+
+
+async def storm(client, logins):
+    body = {"email": "storm@example.com", "password": "storm-password"}
+    results = await asyncio.gather(*(client.post("/auth/login/json", json=body) for _ in range(logins)))
+    return sum(1 for r in results if r.status_code == 200)
+
+
+async def scenario(label, client, headers, args, with_storm):
+    storm_task = asyncio.create_task(storm(client, args.logins)) if with_storm else None
+    await asyncio.sleep(0)
+    latencies = await measure_prices(client, headers, args.price_requests, args.concurrency)
+    ok = await storm_task if storm_task else 0
+    stats = summarize(latencies)
+    print(f"{label:<22} /prices p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms"
+          + (f"  ({ok}/{args.logins} logins ok)" if with_storm else ""))
+
+
+async def main(args):
+    import passwords
+
+    async with app_client() as client:
+        headers = await login(client)
+        await client.post("/auth/register", json={
+            "name": "Storm", "email": "storm@example.com", "password": "storm-password", "role": "trucker",
+        })
+        await client.get("/prices", headers=headers)  # warm the EIA cache
+
+        await scenario("no logins", client, headers, args, with_storm=False)
+        await scenario("storm, hash pool", client, headers, args, with_storm=True)
+
+        async def inline(fn, *fn_args):
+            return fn(*fn_args)
+
+        pooled = passwords.run_in_hash_pool
+        passwords.run_in_hash_pool = inline
+        try:
+            await scenario("storm, inline hashing", client, headers, args, with_storm=True)
+        finally:
+            passwords.run_in_hash_pool = pooled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--price-requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    cli_args = parser.parse_args()
+    with app_environment():
+        asyncio.run(main(cli_args))
@@ -0,0 +1,147 @@
+"""
+Benchmark order matching: the in-memory order books, and a full match against a database.
+
+In memory: build books for --orders pending orders over --groups
+(product, area) pairs, then time incremental placement and cancellation,
+and matching a falling weekly price walk against every group. A linear scan
+of one book is timed for comparison.
+
+With --db-orders it also loads that many orders into a temp SQLite database
+(or --database-url), ingests one week of observations that crosses about a
+--cross fraction of them, and times the book load plus match_orders,
+including the batched UPDATE. It checks that the completed count matches a
+direct SQL count.
+
+Usage (from python_backend/):
+    python benchmarks/bench_matching.py --orders 1000000 --groups 20
+    python benchmarks/bench_matching.py --orders 1000000 --db-orders 200000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from harness import app_environment, percentile
+
+PRODUCTS = ("Diesel", "Gasoline")
+
+
+def areas(groups):
+    return [f"Area {i}" for i in range((groups + 1) // 2)]
+
+
+def make_orders(n, groups, rng):
+    """(order id, product, area, target) rows, spread evenly over the groups."""
+    names = areas(groups)
+    return [(i + 1, PRODUCTS[i % 2], names[(i // 2) % len(names)], round(rng.uniform(3.0, 4.5), 3))
+            for i in range(n)]
+
+
+def in_memory(args, rng):
+    from order_book import OrderBook, OrderBooks, book_key
+
+    orders = make_orders(args.orders, args.groups, rng)
+    start = time.perf_counter()
+    pairs = {}
+    for order_id, product, area, target in orders:
+        pairs.setdefault(book_key(product, area), []).append((target, order_id))
+    books = OrderBooks()
+    books.books = {key: OrderBook.build(rows) for key, rows in pairs.items()}
+    books.loaded = True
+    books.max_id = args.orders
+    print(f"build: {args.orders:,} orders in {len(books.books)} books in {time.perf_counter() - start:.2f} s")
+
+    # Place and cancel: each op is a bisect plus a list insert/delete
+    placed = []
+    start = time.perf_counter()
+    for i in range(args.ops):
+        order = (args.orders + i + 1, PRODUCTS[i % 2], f"Area {rng.randrange(len(pairs) // 2 or 1)}",
+                 round(rng.uniform(3.0, 4.5), 3))
+        books.add(*order)
+        placed.append(order)
+    add_rate = args.ops / (time.perf_counter() - start)
+    start = time.perf_counter()
+    removed = sum(books.remove(*order) for order in placed)
+    remove_rate = args.ops / (time.perf_counter() - start)
+    print(f"place: {add_rate:,.0f} orders/s   cancel: {remove_rate:,.0f} orders/s ({removed:,} removed)")
+
+    # A weekly walk drifting down through the targets; each week checks every group
+    latencies = []
+    filled = 0
+    price = 4.6
+    for _ in range(args.points):
+        price -= rng.uniform(0, 0.04)
+        for product, area in pairs:
+            start = time.perf_counter()
+            filled += len(books.match(product, (area,), price))
+            latencies.append(time.perf_counter() - start)
+    print(f"match: {len(latencies):,} observations, {filled:,} fills, "
+          f"p50 {percentile(latencies, 50) * 1e6:.1f} us, p99 {percentile(latencies, 99) * 1e6:.1f} us, "
+          f"{len(books):,} still pending")
+
+    # For comparison: scanning one book's orders for a price
+    book = max(pairs.values(), key=len)
+    start = time.perf_counter()
+    crossed = [order_id for target, order_id in book if target >= price]
+    scan = time.perf_counter() - start
+    print(f"scan:  one book of {len(book):,} orders takes {scan * 1e6:.0f} us ({len(crossed):,} crossed)")
+
+
+async def in_database(args, rng):
+    from sqlalchemy import func, insert, select
+
+    from database import AsyncSessionLocal, Base, Order, PriceObservation, dispose_engine, get_engine
+    from order_book import OrderBooks, match_orders
+    from price_store import PRODUCT_CODES
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    orders = make_orders(args.db_orders, args.groups, rng)
+    period = date(2024, 1, 1)
+    price = round(4.5 - 1.5 * args.cross, 3)
+    async with AsyncSessionLocal() as db:
+        for i in range(0, len(orders), 10000):
+            await db.execute(insert(Order), [
+                {"id": order_id, "user_id": 1, "product": product, "area": area, "quantity": 100,
+                 "target_price": target, "status": "pending"}
+                for order_id, product, area, target in orders[i:i + 10000]
+            ])
+        await db.execute(insert(PriceObservation), [
+            {"series": f"{code}_{j}", "frequency": "weekly", "area_code": f"A{j}", "area_name": area,
+             "product": code, "product_name": product, "period": period, "value": price}
+            for product, code in PRODUCT_CODES.items() for j, area in enumerate(areas(args.groups))
+        ])
+        await db.commit()
+
+        books = OrderBooks()
+        start = time.perf_counter()
+        await books.refresh(db)
+        load = time.perf_counter() - start
+        books.loaded = False
+        start = time.perf_counter()
+        fills = await match_orders(db, period - timedelta(days=1), books)
+        elapsed = time.perf_counter() - start
+        completed = await db.scalar(select(func.count()).where(Order.status == "completed"))
+    await dispose_engine()
+    expected = sum(target >= price for *_, target in orders)
+    print(f"db:    {args.db_orders:,} orders, book load {load:.2f} s; load + match + UPDATE of "
+          f"{len(fills):,} fills {elapsed:.2f} s; completed in DB {completed:,} (expected {expected:,})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--groups", type=int, default=20, help="(product, area) books")
+    parser.add_argument("--ops", type=int, default=20000, help="orders placed and then cancelled")
+    parser.add_argument("--points", type=int, default=52, help="weeks of prices to match")
+    parser.add_argument("--db-orders", type=int, default=0, help="also match this many orders in a database")
+    parser.add_argument("--cross", type=float, default=0.1, help="fraction of DB orders the new price crosses")
+    parser.add_argument("--database-url", help="default: a temp SQLite database")
+    cli_args = parser.parse_args()
+
+    with app_environment(cli_args.database_url):
+        in_memory(cli_args, random.Random(42))
+        if cli_args.db_orders:
+            asyncio.run(in_database(cli_args, random.Random(7)))
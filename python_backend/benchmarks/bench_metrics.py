@@ -0,0 +1,71 @@
+"""
+Per-request cost of the metrics layer.
+
+Times a trivial ASGI endpoint called directly and through MetricsMiddleware
+(request id, route label, histogram, timing context; the log line is off),
+plus raw Histogram.observe and a /metrics render with the series that creates.
+
+Usage (from python_backend/):
+    python benchmarks/bench_metrics.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["TIMING_LOG"] = "false"
+
+
+async def endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+class App:
+    routes = ()
+
+    async def __call__(self, scope, receive, send):
+        scope["endpoint"] = endpoint
+        await endpoint(scope, receive, send)
+
+
+async def drive(app, n):
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/prices", "headers": [(b"x-request-id", b"bench")]}
+    started = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / n
+
+
+async def main(args):
+    from metrics import Histogram, MetricsMiddleware, registry
+
+    bare = await drive(App(), args.requests)
+    wrapped = await drive(MetricsMiddleware(App()), args.requests)
+    print(f"request: bare {bare * 1e6:.2f} us, instrumented {wrapped * 1e6:.2f} us "
+          f"(+{(wrapped - bare) * 1e6:.2f} us)")
+
+    histogram = Histogram("bench_seconds", "bench", ("route",))
+    started = time.perf_counter()
+    for i in range(args.requests):
+        histogram.observe("/prices", value=(i % 1000) / 1000)
+    print(f"observe: {(time.perf_counter() - started) / args.requests * 1e9:.0f} ns")
+
+    started = time.perf_counter()
+    body = registry.render()
+    print(f"render:  {(time.perf_counter() - started) * 1000:.2f} ms for {len(body)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,166 @@
+"""
+Benchmark alert notification delivery through the outbox and dispatcher.
+
+Creates --users users in a temp SQLite database (or --database-url) and
+enqueues --notifications fired alerts spread over them, for each channel in
+--channels. Delivery goes to the local stand-ins in stub_notify.py, which
+add --latency per delivery and reject an --error-rate fraction with a
+temporary error, so retries are exercised. Backoff is shortened for the run.
+
+The rows are enqueued before the dispatcher starts, as after a restart. The
+benchmark times draining them into per-user digests, and reports
+notifications/min, retries and final outbox status. It then times
+enqueue-to-delivery for a --live wave while the dispatcher is running. For
+comparison, it also sends --baseline notifications one by one with no
+batching or concurrency.
+
+Usage (from python_backend/):
+    python benchmarks/bench_notifications.py --notifications 10000 --users 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import date
+
+from harness import app_environment, percentile
+from stub_notify import running_smtp, running_webhook
+
+
+def fired_alerts(n, users, start_id, rng):
+    from alert_engine import FiredAlert
+
+    return [FiredAlert(alert_id=start_id + i, user_id=rng.randrange(users) + 1, product=("Diesel", "Gasoline")[i % 2],
+                       area=f"Area {i % 20}", threshold=3.5, period=date(2024, 1, 1), price=round(rng.uniform(3, 3.5), 3))
+            for i in range(n)]
+
+
+async def outbox_status():
+    from sqlalchemy import func, select
+
+    from database import AsyncSessionLocal, NotificationOutbox
+
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(select(NotificationOutbox.status, func.count()).group_by(NotificationOutbox.status))
+        return dict(rows.all())
+
+
+async def wait_until_done(expected):
+    while True:
+        status = await outbox_status()
+        if status.get("sent", 0) + status.get("failed", 0) >= expected:
+            return status
+        await asyncio.sleep(0.1)
+
+
+async def run(args, channels, stand_ins):
+    from sqlalchemy import insert
+
+    from database import AsyncSessionLocal, Base, User, dispose_engine, get_engine
+    from notifications import Digest, NotificationDispatcher, alert_notification, enqueue_alerts, register_channel
+    import notifications
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"id": i + 1, "name": f"User {i}", "email": f"user{i}@example.com",
+                                         "password": "x", "role": "trucker"} for i in range(args.users)])
+        await db.commit()
+    for channel in channels.values():
+        register_channel(channel)
+    rng = random.Random(42)
+    total = args.notifications * len(channels)
+
+    # Backlog left from before a restart
+    fired = fired_alerts(args.notifications, args.users, 1, rng)
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        added = await enqueue_alerts(db, fired)
+        enqueue = time.perf_counter() - start
+        again = await enqueue_alerts(db, fired)
+    print(f"enqueue: {added:,} outbox rows in {enqueue * 1000:.0f} ms ({added / enqueue:,.0f} rows/s); "
+          f"enqueueing the same alerts again added {again}")
+
+    dispatcher = NotificationDispatcher(concurrency=args.concurrency)
+    notifications.dispatcher = dispatcher  # so enqueue() wakes this instance
+    start = time.perf_counter()
+    dispatcher.start()
+    status = await wait_until_done(total)
+    elapsed = time.perf_counter() - start
+    failures = sum(notifications.notification_failures._values.values())
+    print(f"drain:   {total:,} notifications in {elapsed:.2f} s = {total / elapsed * 60:,.0f}/min "
+          f"(concurrency {args.concurrency}); {failures:.0f} failed deliveries retried; outbox {status}")
+    for name, config in stand_ins.items():
+        duplicates = sum(count - 1 for count in config.ids.values() if count > 1)
+        extra = f", {len(config.ids):,} distinct ids, {duplicates} duplicates" if config.ids else ""
+        print(f"         {name}: {config.accepted:,} digests accepted, {config.rejected:,} rejected{extra}")
+
+    # Live: enqueue while the dispatcher is running, and time until delivered
+    latencies = []
+    for wave in range(args.live):
+        batch = fired_alerts(args.live_size, args.users, 10_000_000 + wave * args.live_size, rng)
+        status = await outbox_status()
+        done = status.get("sent", 0) + status.get("failed", 0) + args.live_size * len(channels)
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await enqueue_alerts(db, batch)
+        await wait_until_done(done)
+        latencies.append(time.perf_counter() - start)
+    if latencies:
+        print(f"live:    {args.live} waves of {args.live_size} alerts, enqueue to delivered "
+              f"p50 {percentile(latencies, 50) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+    await dispatcher.stop()
+
+    # Baseline: one message per notification, one at a time
+    if args.baseline:
+        name, channel = next(iter(channels.items()))
+        sample = [alert_notification(alert) for alert in fired[:args.baseline]]
+        start = time.perf_counter()
+        for i, (user_id, _, payload) in enumerate(sample):
+            try:
+                await channel.send(Digest(name, user_id, f"user{user_id}@example.com", None, [i], 0, [payload]))
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"serial:  {name}, one message per notification: {len(sample) / elapsed * 60:,.0f}/min")
+        await channel.close()
+    await dispose_engine()
+
+
+async def main(args):
+    from notifications import EmailChannel, WebhookChannel
+
+    names = args.channels.split(",")
+    stand_in = {"latency": args.latency, "error_rate": args.error_rate}
+    with running_smtp(**stand_in) as (host, port, smtp), running_webhook(**stand_in) as (url, webhook):
+        channels = {}
+        stand_ins = {}
+        if "email" in names:
+            channels["email"] = EmailChannel(host=host, port=port, threads=args.concurrency)
+            stand_ins["smtp"] = smtp
+        if "webhook" in names:
+            channels["webhook"] = WebhookChannel(url=url, secret="bench-secret", connections=args.concurrency)
+            stand_ins["webhook"] = webhook
+        await run(args, channels, stand_ins)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--notifications", type=int, default=10000, help="fired alerts in the backlog")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--channels", default="email,webhook")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per delivery at the stand-ins")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--live", type=int, default=5, help="waves enqueued while the dispatcher runs")
+    parser.add_argument("--live-size", type=int, default=100)
+    parser.add_argument("--baseline", type=int, default=200, help="notifications sent serially for comparison")
+    parser.add_argument("--database-url", help="default: a temp SQLite database")
+    cli_args = parser.parse_args()
+
+    # Short backoff and polling so retries happen within the run
+    os.environ.update({"NOTIFY_RETRY_BASE": "0.2", "NOTIFY_RETRY_MAX": "1", "NOTIFY_POLL_INTERVAL": "0.2"})
+    with app_environment(cli_args.database_url):
+        asyncio.run(main(cli_args))
@@ -0,0 +1,118 @@
+"""
+Benchmark /payments/create-intent against a local Stripe stub.
+
+Runs the app in-process against stub_stripe.py, which adds --latency per
+Stripe call.
+
+- loop: sends --requests create-intent calls, --concurrency at a time, while
+  a probe task measures event-loop stalls. For comparison, the same calls go
+  to stripe.PaymentIntent.create directly on the loop, as the handler used to.
+- retries: requests an intent for each of --orders orders three times, two at
+  once and one after. It counts the upstream calls and checks every retry got
+  the same intent. It then clears the in-process cache, as on another worker,
+  and repeats the requests: Stripe replays the intents instead of creating
+  new ones.
+
+Usage (from python_backend/):
+    python benchmarks/bench_payments.py --requests 200 --concurrency 20 --latency 0.1
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from harness import app_environment, login, percentile
+from stub_stripe import running_stripe
+
+TRUCKER = {"email": "payer@example.com", "password": "bench-password", "role": "trucker"}
+
+
+async def probe_loop(stop: asyncio.Event, stalls: list, interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - start - interval)
+
+
+async def measure(label, args, call):
+    stop = asyncio.Event()
+    stalls = []
+    probe = asyncio.create_task(probe_loop(stop, stalls))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            t = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    print(f"{label}: {args.requests / elapsed:,.0f} req/s, p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.0f} ms; loop stall p99 "
+          f"{percentile(stalls, 99) * 1000:.1f} ms, max {max(stalls) * 1000:.0f} ms")
+
+
+async def run(args, stub):
+    from harness import app_client
+    from payments import get_stripe, intent_cache
+
+    async with app_client() as client:
+        headers = await login(client, TRUCKER["email"], TRUCKER["password"], TRUCKER["role"])
+
+        async def offloaded(i):
+            resp = await client.post("/payments/create-intent", json={"amount": 1000 + i},
+                                     headers={**headers, "Idempotency-Key": f"bench-{i}"})
+            assert resp.status_code == 200, resp.text
+
+        async def blocking(i):
+            get_stripe().PaymentIntent.create(amount=1000 + i, currency="usd", idempotency_key=f"blocking-{i}")
+
+        await measure("blocking  ", args, blocking)
+        await measure("offloaded ", args, offloaded)
+
+        order_ids = []
+        for _ in range(args.orders):
+            resp = await client.post("/orders", headers=headers, json={
+                "product": "Diesel", "area": "U.S.", "quantity": 100, "target_price": 3.5})
+            order_ids.append(int(resp.json()["id"]))
+
+        async def pay(order_id):
+            resp = await client.post("/payments/create-intent", headers=headers,
+                                     json={"amount": 35000, "order_id": order_id})
+            assert resp.status_code == 200, resp.text
+            return resp.json()["client_secret"]
+
+        async def three_times(order_id):
+            first = await asyncio.gather(pay(order_id), pay(order_id))
+            return {*first, await pay(order_id)}
+
+        before = (stub.requests, stub.created)
+        secrets = await asyncio.gather(*(three_times(order_id) for order_id in order_ids))
+        print(f"retries:   {3 * args.orders} requests for {args.orders} orders -> "
+              f"{stub.requests - before[0]} Stripe calls, {stub.created - before[1]} intents created, "
+              f"{sum(len(s) == 1 for s in secrets)}/{args.orders} orders got one intent")
+
+        intent_cache.clear()
+        before = (stub.requests, stub.created, stub.replayed)
+        again = await asyncio.gather(*(pay(order_id) for order_id in order_ids))
+        same = sum(secret in s for secret, s in zip(again, secrets))
+        print(f"no cache:  {stub.requests - before[0]} Stripe calls, {stub.created - before[1]} created, "
+              f"{stub.replayed - before[2]} replayed by idempotency key; {same}/{args.orders} same intent")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per Stripe call at the stub")
+    parser.add_argument("--orders", type=int, default=50)
+    cli_args = parser.parse_args()
+
+    with app_environment(), running_stripe(latency=cli_args.latency) as (stripe_url, stripe_stub):
+        os.environ["STRIPE_API_BASE"] = stripe_url
+        asyncio.run(run(cli_args, stripe_stub))
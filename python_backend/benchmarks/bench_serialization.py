@@ -0,0 +1,101 @@
+"""
+Micro-benchmark: per-request CPU to serialize price and order/alert responses.
+
+Price payloads (1000 EIA rows) compare the old per-request path -- FastAPI's
+jsonable_encoder + json.dumps of the decoded dict -- with orjson and with
+sending the cached upstream bytes untouched. Order pages compare FastAPI's
+response_model serialization with the pydantic-core TypeAdapter path used
+by /orders and /alerts. Upstream decoding (json vs orjson) is shown too,
+since it runs on every EIA cache fill.
+
+Usage (from python_backend/):
+    python benchmarks/bench_serialization.py --rows 1000 --orders 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("USE_LOCAL_DB", "true")
+
+from stub_eia import make_rows  # noqa: E402
+
+
+def cpu_per_call(fn, repeat):
+    fn()  # warm up
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+async def acpu_per_call(fn, repeat):
+    await fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        await fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+def report(label, before, after):
+    print(f"  {label:<34} {before:9.3f} ms -> {after:9.3f} ms  ({before / max(after, 1e-6):6.1f}x)")
+
+
+async def main(args):
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from pydantic import TypeAdapter
+
+    from main import OrderOut
+
+    payload = {"response": {"total": args.rows, "frequency": "weekly", "data": make_rows(args.rows)}}
+    raw = json.dumps(payload).encode()
+
+    print(f"price payload ({args.rows} rows, {len(raw) / 1024:.0f} KiB)")
+    report("decode upstream (json -> orjson)",
+           cpu_per_call(lambda: json.loads(raw), args.repeat),
+           cpu_per_call(lambda: orjson.loads(raw), args.repeat))
+    old = cpu_per_call(lambda: JSONResponse(jsonable_encoder(payload)).body, args.repeat)
+    report("encode response (fastapi -> orjson)", old,
+           cpu_per_call(lambda: orjson.dumps(payload), args.repeat))
+    report("encode response (fastapi -> raw)", old,
+           cpu_per_call(lambda: bytes(raw), args.repeat))
+
+    now = datetime.now(timezone.utc)
+    orders = [
+        OrderOut(id=str(i), product="Diesel", area="PADD 1", quantity=500, target_price=3.25,
+                 location="Depot 7", status="pending", created_at=now)
+        for i in range(args.orders)
+    ]
+    field = create_response_field(name="Response_get_orders", type_=List[OrderOut])
+    adapter = TypeAdapter(List[OrderOut])
+
+    async def fastapi_path():
+        content = await serialize_response(field=field, response_content=orders, is_coroutine=True)
+        return JSONResponse(content).body
+
+    async def adapter_path():
+        return adapter.dump_json(orders)
+
+    print(f"order page ({args.orders} OrderOut)")
+    report("response_model -> TypeAdapter",
+           await acpu_per_call(fastapi_path, args.repeat),
+           await acpu_per_call(adapter_path, args.repeat))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
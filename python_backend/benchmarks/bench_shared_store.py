@@ -0,0 +1,116 @@
+"""
+Multi-worker rate limiting and EIA caching on the shared store.
+
+Simulates --workers workers in one process, each with its own store client
+and RateLimiter, all talking to one fakeredis server (pip install fakeredis
+lupa) or to a real one via --redis-url. It checks:
+
+- a burst spread over every worker is held to one limit in total, where
+  per-process memory buckets would allow workers x limit;
+- after one worker fetches from the stub EIA server, the other (cold) workers
+  are served from the shared tier without calling EIA.
+
+It also reports the cost of a bucket check for each backend.
+
+Usage (from python_backend/):
+    python benchmarks/bench_shared_store.py --workers 8 --requests 400
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from stub_eia import running_stub  # noqa: E402
+
+RATE = "30/minute"
+
+
+class FakeRequest:
+    client = None
+    headers = {}
+
+
+def redis_client(args, server):
+    if args.redis_url:
+        import redis.asyncio as redis
+
+        return redis.from_url(args.redis_url)
+    import fakeredis
+
+    return fakeredis.FakeAsyncRedis(server=server)
+
+
+async def burst(limiters, requests):
+    """Send `requests` calls round-robin across the workers' limiters; count the allowed ones."""
+    from fastapi import HTTPException
+
+    allowed = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        try:
+            await limiters[i % len(limiters)].hit(FakeRequest(), "bench", RATE, 30, 60)
+            allowed += 1
+        except HTTPException:
+            pass
+    return allowed, (time.perf_counter() - started) / requests
+
+
+async def rate_limit(args, make_store):
+    from ratelimit import RateLimiter
+
+    limiters = [
+        RateLimiter(key_func=lambda request: f"user:bench-{args.run}", store=make_store())
+        for _ in range(args.workers)
+    ]
+    return await burst(limiters, args.requests)
+
+
+async def eia_cache(args, make_store, stub):
+    import eia
+    import shared_store
+
+    upstream = []
+    for _ in range(args.workers):
+        # A fresh worker: empty local cache, its own store client
+        eia.price_cache.clear()
+        shared_store.set_store(make_store())
+        before = stub.hits
+        await eia.get_cached_prices("weekly", 1000)
+        upstream.append(stub.hits - before)
+    return upstream
+
+
+async def main(args, stub):
+    import fakeredis
+    import shared_store
+
+    server = fakeredis.FakeServer()
+    backends = {
+        "memory": shared_store.MemoryStore,
+        "redis" if args.redis_url else "fakeredis": lambda: shared_store.RedisStore(
+            redis_client(args, server), prefix=f"bench:{args.run}:"),
+    }
+    for name, make_store in backends.items():
+        allowed, per_check = await rate_limit(args, make_store)
+        print(f"{name:>9}: {args.workers} workers, {args.requests} requests at {RATE} -> "
+              f"{allowed} allowed (limit 30), {per_check * 1e6:.0f} us per check")
+        upstream = await eia_cache(args, make_store, stub)
+        print(f"{'':>9}  EIA calls per cold worker: {upstream}")
+    shared_store.set_store(None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--redis-url", help="use a real Redis server instead of fakeredis")
+    cli_args = parser.parse_args()
+    cli_args.run = os.getpid()
+    with running_stub() as (base_url, stub):
+        os.environ["EIA_BASE_URL"] = base_url
+        asyncio.run(main(cli_args, stub))
@@ -0,0 +1,60 @@
+"""
+Hammer the EIA price path with concurrent identical requests and check that
+single-flight coalescing turns them into exactly one upstream call.
+
+Usage (from python_backend/):
+    python benchmarks/bench_singleflight.py --callers 500 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from stub_eia import running_stub  # noqa: E402
+
+
+async def burst(eia, stub, callers):
+    eia.price_cache.clear()
+    hits_before = stub.hits
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(eia.get_cached_prices("weekly", 1000) for _ in range(callers)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    return results, stub.hits - hits_before, elapsed
+
+
+async def main(args, stub):
+    import eia
+
+    # Successful upstream: every caller gets the same payload from one EIA hit
+    results, upstream, elapsed = await burst(eia, stub, args.callers)
+    assert all(r is results[0] for r in results), "callers did not share the result"
+    assert upstream == 1, f"expected 1 upstream hit, got {upstream}"
+    print(f"ok:    {args.callers} callers -> {upstream} upstream hit in {elapsed * 1000:.1f} ms")
+
+    # Failing upstream: every caller shares the same error from one EIA hit
+    stub.error_rate = 1.0
+    results, upstream, elapsed = await burst(eia, stub, args.callers)
+    assert all(isinstance(r, Exception) for r in results), "expected every caller to see the error"
+    assert upstream == 1, f"expected 1 upstream hit, got {upstream}"
+    print(f"error: {args.callers} callers -> {upstream} upstream hit in {elapsed * 1000:.1f} ms")
+
+    print(f"upstream calls saved: {eia.price_flight.saved}")
+    await eia.close_eia_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--callers", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub latency in seconds")
+    cli_args = parser.parse_args()
+    with running_stub(latency=cli_args.latency) as (base_url, stub_config):
+        os.environ["EIA_BASE_URL"] = base_url
+        asyncio.run(main(cli_args, stub_config))
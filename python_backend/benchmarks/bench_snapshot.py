@@ -0,0 +1,107 @@
+"""
+Benchmark the columnar price snapshot against EIA JSON rows.
+
+Builds --years of --frequency rows for the stub's 24 series. --copies
+multiplies the product codes, to stand in for more series. It compares
+parsing the JSON payload with memory-mapping the snapshot file, and the
+memory of row dicts with the snapshot's arrays. It also times building, merging
+one new period, exporting to CSV and the snapshot format, and a forecast cold
+fit from the snapshot.
+
+Usage (from python_backend/):
+    python benchmarks/bench_snapshot.py --frequency daily --years 10 --copies 4
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import orjson
+
+from harness import app_environment
+from stub_eia import ROWS_PER_PERIOD, make_rows
+
+
+def payload_bytes(args) -> bytes:
+    periods = args.years * (52 if args.frequency == "weekly" else 365)
+    base = make_rows(periods * ROWS_PER_PERIOD, args.frequency)
+    rows = []
+    for copy in range(args.copies):
+        suffix = str(copy) if copy else ""
+        rows.extend({**row, "product": row["product"] + suffix, "series": row["series"] + suffix} for row in base)
+    return orjson.dumps({"response": {"total": len(rows), "data": rows}})
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    from price_store import parse_observations
+    from snapshot import PriceSnapshot
+
+    raw = payload_bytes(args)
+    gc.collect()
+    tracemalloc.start()
+    payload, parse = timed(orjson.loads, raw)
+    dict_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rows = payload["response"]["data"]
+    print(f"json:   {len(rows):,} rows, {len(raw) / 2**20:.1f} MiB payload, parse {parse * 1000:.0f} ms, "
+          f"{dict_memory / 2**20:.1f} MiB of row dicts")
+
+    observations = parse_observations(rows, args.frequency)
+    snapshot, build = timed(PriceSnapshot.from_observations, observations, args.frequency)
+    path = os.path.join(tempfile.mkdtemp(prefix="oil-snapshot-"), f"prices-{args.frequency}.snap")
+    _, save = timed(snapshot.save, path)
+    print(f"build:  {len(snapshot.series_ids)} series in {build * 1000:.0f} ms; save {save * 1000:.1f} ms, "
+          f"{os.path.getsize(path) / 2**20:.2f} MiB file")
+
+    loaded, load = timed(PriceSnapshot.load, path)
+    _, touch = timed(lambda: float(loaded.value.sum()) + int(loaded.period.max()))
+    print(f"load:   mmap {load * 1000:.2f} ms, first full scan {touch * 1000:.2f} ms, "
+          f"{loaded.nbytes / 2**20:.2f} MiB of arrays ({loaded.nbytes / dict_memory:.1%} of the dicts), "
+          f"through {loaded.latest}")
+    assert len(loaded) == len(snapshot) and loaded.latest == snapshot.latest
+
+    one, select = timed(loaded.subset, "EPD2D", "NUS", date(2020, 1, 1))
+    print(f"query:  one series since 2020, {len(one):,} rows in {select * 1e6:.0f} us")
+
+    newest = [obs for obs in observations if obs["period"] == snapshot.latest]
+    merged, merge = timed(loaded.merge, [{**obs, "value": obs["value"] + 0.01} for obs in newest])
+    assert len(merged) == len(loaded)
+    print(f"merge:  revise the latest period ({len(newest)} rows) in {merge * 1000:.1f} ms")
+
+    body, csv_time = timed(lambda: b"".join(loaded.iter_csv()))
+    snap_bytes, bytes_time = timed(loaded.to_bytes)
+    print(f"export: CSV {len(body) / 2**20:.1f} MiB in {csv_time * 1000:.0f} ms "
+          f"({len(body) / 2**20 / csv_time:.0f} MiB/s); snapshot {len(snap_bytes) / 2**20:.2f} MiB "
+          f"in {bytes_time * 1000:.1f} ms")
+    try:
+        parquet, parquet_time = timed(loaded.to_parquet)
+        print(f"        Parquet {len(parquet) / 2**20:.2f} MiB in {parquet_time * 1000:.0f} ms")
+    except ImportError:
+        print("        Parquet skipped (pyarrow not installed)")
+
+    if args.frequency == "weekly":
+        from forecast import Forecaster
+
+        _, from_dicts = timed(Forecaster().update, observations)
+        _, from_snapshot = timed(Forecaster().update_snapshot, loaded)
+        print(f"fit:    forecast cold fit from row dicts {from_dicts * 1000:.0f} ms, "
+              f"from the snapshot {from_snapshot * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frequency", choices=("weekly", "daily"), default="daily")
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--copies", type=int, default=4, help="copies of the stub's products (more series)")
+    cli_args = parser.parse_args()
+    with app_environment():
+        main(cli_args)
@@ -0,0 +1,113 @@
+"""
+Shared setup for benchmarks that drive the FastAPI app in-process.
+
+The app runs against a throwaway SQLite database (USE_LOCAL_DB), or a local
+Postgres given as a database URL, and the stub EIA server, with the ingest
+scheduler and rate limits turned off so the numbers measure the code path
+rather than the limiter.
+"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from stub_eia import running_stub  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, elapsed=None) -> dict:
+    result = {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if elapsed:
+        result["throughput_rps"] = round(len(latencies) / elapsed, 1)
+    return result
+
+
+@contextmanager
+def app_environment(database_url: Optional[str] = None, **stub_kwargs):
+    """Point the backend at a temp SQLite DB (or `database_url`) and a running
+    stub EIA server.
+
+    Must be entered before `main` is imported, since config is read at import.
+    """
+    workdir = tempfile.mkdtemp(prefix="oil-bench-")
+    previous_cwd = os.getcwd()
+    with running_stub(**stub_kwargs) as (base_url, stub):
+        if database_url:
+            os.environ["DATABASE_URL"] = database_url
+        os.environ.update({
+            "USE_LOCAL_DB": "false" if database_url else "true",
+            "EIA_BASE_URL": base_url,
+            "INGEST_SCHEDULER": "false",
+            "TIMING_LOG": "false",
+        })
+        os.chdir(workdir)
+        try:
+            yield stub
+        finally:
+            os.chdir(previous_cwd)
+
+
+@asynccontextmanager
+async def app_client():
+    """Start the app and yield an httpx client bound to it in-process.
+
+    httpx.ASGITransport sends no lifespan events, so the app's own lifespan
+    is entered here, as uvicorn would.
+    """
+    import httpx
+    import main
+
+    main.limiter.enabled = False
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+@asynccontextmanager
+async def app_server():
+    """Serve the app with uvicorn, lifespan included, on a free localhost port;
+    yields its base URL. Unlike app_client, responses really stream."""
+    import uvicorn
+    import main
+
+    main.limiter.enabled = False
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        if serve.done():
+            serve.result()  # startup failed; raise its error
+            raise RuntimeError("uvicorn exited during startup")
+        await asyncio.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await serve
+
+
+async def login(client, email="bench@example.com", password="bench-password", role="owner") -> dict:
+    """Register (if needed) and log in; returns auth headers."""
+    await client.post("/auth/register", json={"name": "Bench", "email": email, "password": password, "role": role})
+    resp = await client.post("/auth/login/json", json={"email": email, "password": password})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
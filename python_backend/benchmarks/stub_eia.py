@@ -0,0 +1,132 @@
+"""
+Local stand-in for api.eia.gov used by the benchmarks.
+
+Serves /v2/petroleum/pri/gnd/data/ with a synthetic payload shaped like the
+real EIA response. Payload size, added latency and error rate are configurable
+so the backend can be exercised without touching the real API or its quota.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+AREAS = [
+    ("NUS", "U.S."), ("R10", "PADD 1"), ("R1X", "PADD 1A"), ("R1Y", "PADD 1B"),
+    ("R1Z", "PADD 1C"), ("R20", "PADD 2"), ("R30", "PADD 3"), ("R40", "PADD 4"),
+    ("R50", "PADD 5"), ("SCA", "CALIFORNIA"), ("STX", "TEXAS"), ("SNY", "NEW YORK"),
+]
+PRODUCTS = [("EPD2D", "No 2 Diesel"), ("EPMR", "Regular Gasoline")]
+ROWS_PER_PERIOD = len(AREAS) * len(PRODUCTS)
+END_PERIOD = date(2025, 1, 6)
+
+
+def period_step(frequency: str) -> timedelta:
+    return timedelta(days=7 if frequency == "weekly" else 1)
+
+
+def make_rows(count: int, frequency: str = "weekly", offset: int = 0, end: date = END_PERIOD):
+    """Build `count` EIA-shaped rows, newest period first."""
+    step = period_step(frequency)
+    rows = []
+    for i in range(offset, offset + count):
+        period_index, combo = divmod(i, ROWS_PER_PERIOD)
+        area_code, area_name = AREAS[combo % len(AREAS)]
+        product, product_name = PRODUCTS[combo // len(AREAS)]
+        period = end - step * period_index
+        base = 3.9 if product == "EPD2D" else 3.3
+        rows.append({
+            "period": period.isoformat(),
+            "duoarea": area_code,
+            "area-name": area_name,
+            "product": product,
+            "product-name": product_name,
+            "process": "PTE",
+            "process-name": "Retail Sales",
+            "series": f"EMM_{product}_PTE_{area_code}_DPG",
+            "series-description": f"{area_name} {product_name} Retail Prices (Dollars per Gallon)",
+            "value": f"{base + 0.4 * ((period.toordinal() * 7 + combo) % 17) / 17:.3f}",
+            "units": "$/GAL",
+        })
+    return rows
+
+
+class StubConfig:
+    def __init__(self, rows: int = 1000, latency: float = 0.0, error_rate: float = 0.0, total: int = 100000):
+        self.rows = rows
+        self.latency = latency
+        self.error_rate = error_rate
+        self.total = total
+        self.hits = 0
+
+
+def create_app(config: StubConfig) -> Starlette:
+    async def prices(request: Request):
+        config.hits += 1
+        if config.latency:
+            await asyncio.sleep(config.latency)
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse({"error": "stub failure"}, status_code=503)
+        frequency = request.query_params.get("frequency", "weekly")
+        length = min(int(request.query_params.get("length", config.rows)), config.rows)
+        offset = int(request.query_params.get("offset", 0))
+        total = config.total
+        start = request.query_params.get("start")
+        if start:
+            periods = (END_PERIOD - date.fromisoformat(start)).days // period_step(frequency).days + 1
+            total = min(total, max(0, periods) * ROWS_PER_PERIOD)
+        length = max(0, min(length, total - offset))
+        return JSONResponse({
+            "response": {
+                "total": total,
+                "dateFormat": "YYYY-MM-DD",
+                "frequency": frequency,
+                "data": make_rows(length, frequency, offset),
+            }
+        })
+
+    return Starlette(routes=[Route("/v2/petroleum/pri/gnd/data/", prices)])
+
+
+@contextmanager
+def running_stub(**kwargs):
+    """Run the stub on a free localhost port in a background thread.
+
+    Yields (base_url, config); config.hits counts upstream requests served.
+    """
+    config = StubConfig(**kwargs)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(config), log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}", config
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        sock.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the stub EIA server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    stub_config = StubConfig(rows=args.rows, latency=args.latency, error_rate=args.error_rate)
+    uvicorn.run(create_app(stub_config), host="127.0.0.1", port=args.port, log_level="warning")
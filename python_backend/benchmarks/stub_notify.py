@@ -0,0 +1,127 @@
+"""
+Local stand-ins for the notification channels used by the benchmarks.
+
+A minimal SMTP server (asyncio, just enough protocol for smtplib) and a
+webhook receiver (Starlette). Both can add latency and fail a fraction of
+deliveries with a temporary error, and both record what they accepted, so
+retries and duplicates can be checked without sending real mail.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+
+class StandInConfig:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.accepted = 0  # messages / requests accepted
+        self.rejected = 0
+        self.ids = Counter()  # webhook: notification ids accepted
+
+    def fail(self) -> bool:
+        if random.random() < self.error_rate:
+            self.rejected += 1
+            return True
+        return False
+
+
+def free_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def create_webhook_app(config: StandInConfig) -> Starlette:
+    async def hook(request: Request):
+        body = orjson.loads(await request.body())
+        if config.latency:
+            await asyncio.sleep(config.latency)
+        if config.fail():
+            return Response(status_code=503)
+        config.accepted += 1
+        config.ids.update(body["ids"])
+        return Response(status_code=204)
+
+    return Starlette(routes=[Route("/hook", hook, methods=["POST"])])
+
+
+@contextmanager
+def running_webhook(**kwargs):
+    """Run the webhook receiver in a background thread; yields (url, config)."""
+    config = StandInConfig(**kwargs)
+    sock = free_socket()
+    server = uvicorn.Server(uvicorn.Config(create_webhook_app(config), log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}/hook", config
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        sock.close()
+
+
+async def smtp_session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, config: StandInConfig):
+    writer.write(b"220 stand-in ESMTP\r\n")
+    while line := await reader.readline():
+        command = line[:4].upper()
+        if command in (b"EHLO", b"HELO"):
+            writer.write(b"250 stand-in\r\n")
+        elif command == b"DATA":
+            writer.write(b"354 end with <CRLF>.<CRLF>\r\n")
+            await writer.drain()
+            while (await reader.readline()) not in (b".\r\n", b""):
+                pass
+            if config.latency:
+                await asyncio.sleep(config.latency)
+            if config.fail():
+                writer.write(b"451 temporary failure\r\n")
+            else:
+                config.accepted += 1
+                writer.write(b"250 queued\r\n")
+        elif command == b"QUIT":
+            writer.write(b"221 bye\r\n")
+            break
+        else:  # MAIL, RCPT, RSET, NOOP
+            writer.write(b"250 ok\r\n")
+        await writer.drain()
+    writer.close()
+
+
+@contextmanager
+def running_smtp(**kwargs):
+    """Run the SMTP stand-in on its own event loop thread; yields (host, port, config)."""
+    config = StandInConfig(**kwargs)
+    sock = free_socket()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    stop = asyncio.Event()
+
+    async def serve():
+        server = await asyncio.start_server(lambda r, w: smtp_session(r, w, config), sock=sock)
+        started.set()
+        async with server:
+            await stop.wait()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    started.wait()
+    try:
+        yield "127.0.0.1", sock.getsockname()[1], config
+    finally:
+        loop.call_soon_threadsafe(stop.set)
+        thread.join(timeout=5)
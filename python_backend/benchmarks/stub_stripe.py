@@ -0,0 +1,77 @@
+"""
+Local stand-in for the Stripe API used by the benchmarks.
+
+Serves POST /v1/payment_intents the way Stripe does for the fields the
+backend uses. A repeated Idempotency-Key replays the first response instead
+of creating another intent. Added latency is configurable. The stub counts
+requests and created intents, so blocking and duplicate creation can be
+measured without a Stripe account.
+"""
+import asyncio
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class StripeStubConfig:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.created = 0
+        self.replayed = 0
+        self.responses = {}  # idempotency key -> intent
+
+
+def create_app(config: StripeStubConfig) -> Starlette:
+    async def payment_intents(request: Request):
+        config.requests += 1
+        form = await request.form()
+        if config.latency:
+            await asyncio.sleep(config.latency)
+        key = request.headers.get("idempotency-key")
+        if key in config.responses:
+            config.replayed += 1
+            return JSONResponse(config.responses[key], headers={"idempotent-replayed": "true"})
+        config.created += 1
+        intent_id = f"pi_{uuid4().hex[:24]}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(form["amount"]),
+            "currency": form["currency"],
+            "client_secret": f"{intent_id}_secret_{uuid4().hex[:24]}",
+            "metadata": {k[9:-1]: v for k, v in form.items() if k.startswith("metadata[")},
+            "status": "requires_payment_method",
+        }
+        if key:
+            config.responses[key] = intent
+        return JSONResponse(intent)
+
+    return Starlette(routes=[Route("/v1/payment_intents", payment_intents, methods=["POST"])])
+
+
+@contextmanager
+def running_stripe(**kwargs):
+    """Run the stub on a free localhost port in a background thread; yields (base_url, config)."""
+    config = StripeStubConfig(**kwargs)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(create_app(config), log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}", config
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        sock.close()
@@ -0,0 +1,59 @@
+"""
+Batch creation helpers for the bulk order and alert endpoints.
+
+Items are validated one by one so a bad item is reported back without
+failing the rest of the batch. The valid items are then written with a
+single ORM bulk INSERT ... RETURNING in one transaction (SQLAlchemy sends it
+as multi-row statements), instead of an insert, commit and refresh round
+trip per row.
+"""
+import os
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '1000'))
+
+
+def validate_items(items: List[Any], schema: Type[BaseModel]) -> Tuple[List[Tuple[int, BaseModel]], Dict[int, list]]:
+    """Split raw items into (index, parsed) pairs and per-index validation errors."""
+    valid: List[Tuple[int, BaseModel]] = []
+    errors: Dict[int, list] = {}
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema.model_validate(item)))
+        except ValidationError as e:
+            errors[index] = e.errors(include_url=False, include_context=False)
+    return valid, errors
+
+
+async def insert_returning(db: AsyncSession, model, rows: List[dict]) -> list:
+    """Insert `rows` in one statement batch and return the new ORM objects in order."""
+    if not rows:
+        return []
+    stmt = insert(model).returning(model, sort_by_parameter_order=True)
+    result = await db.scalars(stmt, rows)
+    created = result.all()
+    await db.commit()
+    return created
+
+
+async def create_batch(
+    db: AsyncSession,
+    items: List[Any],
+    schema: Type[BaseModel],
+    model,
+    to_row: Callable[[BaseModel], dict],
+    to_out: Callable[[object], BaseModel],
+) -> dict:
+    """Validate, insert and report per-item results for one bulk request."""
+    valid, errors = validate_items(items, schema)
+    created = await insert_returning(db, model, [to_row(parsed) for _, parsed in valid])
+    results: List[dict] = [None] * len(items)
+    for (index, _), obj in zip(valid, created):
+        results[index] = {"index": index, "ok": True, "item": to_out(obj)}
+    for index, item_errors in errors.items():
+        results[index] = {"index": index, "ok": False, "errors": item_errors}
+    return {"created": len(created), "failed": len(errors), "results": results}
@@ -0,0 +1,183 @@
+"""
+In-process response cache with TTL, LRU eviction and stale-while-revalidate.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple, Optional
+
+
+class Aged(NamedTuple):
+    """A fetched value that was already `age` seconds old, e.g. one read from
+    a shared cache tier. TTLCache stores it with that age, so it goes stale when
+    the original would have rather than a full TTL later."""
+
+    value: Any
+    age: float
+
+
+class CacheEntry:
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value: Any, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries are fresh for `ttl` seconds.
+
+    For a further `stale_ttl` seconds an entry is still served while a
+    background task refreshes it. Entries are never dropped just for being
+    old, so the last good value stays available as a fallback when the
+    upstream fails; only LRU eviction removes them.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 300.0, stale_ttl: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._refreshing: set = set()
+        self._tasks: set = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for `key` if it is still fresh, else `default`."""
+        entry = self.get_entry(key)
+        if entry is not None and time.monotonic() - entry.stored_at < self.ttl:
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, age: float = 0.0):
+        self._data[key] = CacheEntry(value, time.monotonic() - age)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_matching(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def get_or_fetch(
+        self,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[Any]],
+        fallback_on: Optional[Callable[[Exception], bool]] = None,
+    ) -> Any:
+        """Return the cached value for `key`, calling `fetch` when needed
+        (`fetch` may return an Aged value).
+
+        If `fetch` raises and `fallback_on(exc)` is true, the last stored
+        value (however old) is returned instead of propagating the error.
+        """
+        entry = self.get_entry(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age < self.ttl:
+                self.hits += 1
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return entry.value
+
+        self.misses += 1
+        try:
+            value = await fetch()
+        except Exception as e:
+            if entry is not None and fallback_on is not None and fallback_on(e):
+                self.fallbacks += 1
+                return entry.value
+            raise
+        return self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any) -> Any:
+        if isinstance(value, Aged):
+            self.set(key, value.value, value.age)
+            return value.value
+        self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                self._store(key, await fetch())
+            except Exception as e:
+                print(f"Background cache refresh failed for {key}: {e}")
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(refresh())
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight call.
+
+    The first caller starts `fn()` as its own task; callers arriving while it
+    runs await the same task and share its result or exception. The task is
+    shielded, so a cancelled caller (e.g. a disconnected client) does not
+    cancel the upstream call for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight: dict = {}
+        self.calls = 0
+        self.saved = 0
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "saved": self.saved, "inflight": len(self._inflight)}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.saved += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: "asyncio.Future"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,206 @@
+"""
+Shared EIA API client.
+
+One long-lived httpx.AsyncClient is reused by /prices and the owner endpoints
+so keep-alive connections (and HTTP/2 when h2 is installed) survive between
+requests instead of paying a fresh TCP+TLS handshake on every call and retry.
+With SHARED_STORE_URL set, fetched payloads are also shared between workers.
+"""
+import asyncio
+import hashlib
+import os
+import struct
+import time
+from typing import Optional
+
+import httpx
+import orjson
+from dotenv import load_dotenv
+
+from cache import Aged, TTLCache, SingleFlight
+from metrics import eia_retries, observe_eia
+from shared_store import get_store
+
+load_dotenv()
+
+# --- Config ---
+EIA_API_KEY = os.getenv('EIA_API_KEY', 'G19nzdqrKjjAkYvnZt4KuKesf5eti3AhoHE7NSyR')
+EIA_BASE_URL = os.getenv('EIA_BASE_URL', 'https://api.eia.gov')
+EIA_PRICES_PATH = '/v2/petroleum/pri/gnd/data/'
+EIA_MAX_CONNECTIONS = int(os.getenv('EIA_MAX_CONNECTIONS', '20'))
+EIA_MAX_KEEPALIVE = int(os.getenv('EIA_MAX_KEEPALIVE', '10'))
+EIA_KEEPALIVE_EXPIRY = float(os.getenv('EIA_KEEPALIVE_EXPIRY', '30'))
+EIA_HTTP2 = os.getenv('EIA_HTTP2', 'true').lower() in ['true', '1', 'yes']
+# EIA weekly data changes once a week; serve from memory for an hour, then
+# stale-while-revalidate for up to a day
+EIA_CACHE_TTL = float(os.getenv('EIA_CACHE_TTL', '3600'))
+EIA_CACHE_STALE_TTL = float(os.getenv('EIA_CACHE_STALE_TTL', '86400'))
+EIA_CACHE_MAX_ENTRIES = int(os.getenv('EIA_CACHE_MAX_ENTRIES', '128'))
+
+EIA_TIMEOUT = httpx.Timeout(connect=5.0, read=15.0, write=5.0, pool=5.0)
+
+# HTTP/2 needs the optional h2 package (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+price_cache = TTLCache(maxsize=EIA_CACHE_MAX_ENTRIES, ttl=EIA_CACHE_TTL, stale_ttl=EIA_CACHE_STALE_TTL)
+# Concurrent identical EIA queries share one upstream call (and its retries)
+price_flight = SingleFlight()
+
+
+class PricePayload(dict):
+    """Decoded EIA response that also keeps the upstream bytes, so an unfiltered
+    /prices response can be sent without re-serializing it."""
+
+    __slots__ = ("raw",)
+
+
+def decode_payload(raw: bytes) -> PricePayload:
+    payload = PricePayload(orjson.loads(raw))
+    payload.raw = raw
+    return payload
+
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_eia_client() -> httpx.AsyncClient:
+    """Return the app-wide EIA client, creating it on first use.
+
+    The client is bound to the running event loop. Under Mangum a warm
+    container can be handed a new loop, in which case the old pool is
+    dropped and a fresh one is built.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        limits = httpx.Limits(
+            max_connections=EIA_MAX_CONNECTIONS,
+            max_keepalive_connections=EIA_MAX_KEEPALIVE,
+            keepalive_expiry=EIA_KEEPALIVE_EXPIRY,
+        )
+        _client = httpx.AsyncClient(
+            base_url=EIA_BASE_URL,
+            timeout=EIA_TIMEOUT,
+            limits=limits,
+            http2=EIA_HTTP2 and HTTP2_AVAILABLE,
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_eia_client():
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def price_params(frequency: str, length: int, offset: int = 0, start: Optional[str] = None) -> dict:
+    params = {
+        "api_key": EIA_API_KEY,
+        "frequency": frequency,
+        "data[0]": "value",
+        "sort[0][column]": "period",
+        "sort[0][direction]": "desc",
+        "length": length,
+    }
+    if offset:
+        params["offset"] = offset
+    if start:
+        params["start"] = start
+    return params
+
+
+async def fetch_prices(frequency: str, length: int, offset: int = 0, max_retries: int = 1,
+                       start: Optional[str] = None) -> PricePayload:
+    """Fetch a page of EIA gasoline/diesel prices, retrying with exponential backoff."""
+    client = get_eia_client()
+    params = price_params(frequency, length, offset, start)
+    for attempt in range(max_retries):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            resp = await client.get(EIA_PRICES_PATH, params=params)
+            status = str(resp.status_code)
+            resp.raise_for_status()
+            return decode_payload(resp.content)
+        except (httpx.HTTPStatusError, httpx.RequestError):
+            if attempt == max_retries - 1:
+                raise
+            eia_retries.inc()
+            await asyncio.sleep(2 ** attempt)  # Exponential backoff
+        finally:
+            observe_eia(status, time.perf_counter() - started)
+
+
+def is_upstream_failure(exc: Exception) -> bool:
+    """True for EIA errors where serving the last good payload beats failing (429, 5xx, network)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(exc, httpx.RequestError)
+
+
+def price_cache_key(frequency: str, length: int, offset: int = 0) -> tuple:
+    params = price_params(frequency, length, offset)
+    params.pop("api_key")
+    return tuple(sorted(params.items()))
+
+
+def shared_key(key: tuple) -> str:
+    return "eia:" + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+async def load_prices(key: tuple, frequency: str, length: int, offset: int, max_retries: int):
+    """fetch_prices through the shared store's cache tier, when the store is shared.
+
+    Another worker's fresh payload is used instead of calling EIA, and a stale
+    one is the fallback when EIA fails. Shared entries are the upstream bytes
+    prefixed with their wall-clock fetch time, and come back as Aged values so
+    the local cache keeps the original age.
+    """
+    store = get_store()
+    if not store.shared:
+        return await fetch_prices(frequency, length, offset, max_retries)
+    name = shared_key(key)
+    cached = None
+    blob = await store.get(name)
+    if blob:
+        age = max(0.0, time.time() - struct.unpack("!d", blob[:8])[0])
+        cached = Aged(decode_payload(blob[8:]), age)
+        if age < EIA_CACHE_TTL:
+            return cached
+    try:
+        payload = await fetch_prices(frequency, length, offset, max_retries)
+    except Exception as e:
+        if cached is not None and is_upstream_failure(e):
+            return cached
+        raise
+    await store.set(name, struct.pack("!d", time.time()) + payload.raw, EIA_CACHE_TTL + EIA_CACHE_STALE_TTL)
+    return payload
+
+
+async def get_cached_prices(frequency: str, length: int, offset: int = 0, max_retries: int = 1) -> dict:
+    """fetch_prices behind the shared TTL/stale-while-revalidate cache.
+
+    Cache misses and background refreshes go through price_flight, so a burst
+    of identical requests results in a single EIA call; with a shared store
+    (see load_prices) that call is usually another worker's cached result.
+    """
+    key = price_cache_key(frequency, length, offset)
+    return await price_cache.get_or_fetch(
+        key,
+        lambda: price_flight.do(key, lambda: load_prices(key, frequency, length, offset, max_retries)),
+        fallback_on=is_upstream_failure,
+    )
+
+
+def cache_stats() -> dict:
+    """Price cache and singleflight counters, as reported by /health."""
+    return {"cache": price_cache.stats(), "singleflight": price_flight.stats()}
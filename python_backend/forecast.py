@@ -0,0 +1,321 @@
+"""
+Next-week price projections and abnormal-move flags for every weekly series.
+
+Three lightweight models run over each (product, area) series:
+
+- EWMA of the price, a flat baseline projection;
+- additive Holt-Winters (level, trend and a 52-week seasonal profile), which
+  gives the FORECAST_HORIZON-week projection;
+- a rolling z-score of the week-over-week change against the previous
+  ANOMALY_WINDOW changes. |z| > ANOMALY_Z flags the move as abnormal.
+
+Model state is kept column-wise, one array row per series. Periods are
+applied in order, and each period updates every series at once with NumPy.
+Fitting is incremental: only periods after a series' last fitted period are
+applied, so a new week costs one step rather than a refit of the history.
+
+Outputs are precomputed after every fit and served from memory. Requests never
+run the models. In the long-running server, new weeks are applied by the
+ingest listener. Otherwise the next request notices them: a newer latest
+period in the store, or a new EIA payload.
+"""
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import SingleFlight
+from database import AsyncSessionLocal, PriceObservation
+from eia import get_cached_prices
+from price_store import PRODUCT_CODES, latest_period, parse_observations
+from snapshot import get_snapshot
+
+FORECAST_FREQUENCY = "weekly"
+FORECAST_HORIZON = int(os.getenv('FORECAST_HORIZON', '4'))
+# Smoothing factors; higher reacts faster to recent weeks
+EWMA_ALPHA = float(os.getenv('FORECAST_EWMA_ALPHA', '0.3'))
+HW_ALPHA = float(os.getenv('FORECAST_HW_ALPHA', '0.5'))
+HW_BETA = float(os.getenv('FORECAST_HW_BETA', '0.1'))
+HW_GAMMA = float(os.getenv('FORECAST_HW_GAMMA', '0.1'))
+SEASON_LENGTH = 52
+ANOMALY_WINDOW = int(os.getenv('ANOMALY_WINDOW', '26'))
+ANOMALY_Z = float(os.getenv('ANOMALY_Z', '3.0'))
+# Floor for the std-dev of changes: EIA prices have three decimals, and a
+# perfectly smooth series would otherwise turn rounding noise into huge z-scores
+ANOMALY_MIN_STD = 0.001
+# Flagged moves kept per series
+ANOMALY_KEEP = 20
+# Series this many weeks behind the newest one no longer hold back the
+# incremental store reads (see Forecaster.resume_from)
+FORECAST_STALE_WEEKS = int(os.getenv('FORECAST_STALE_WEEKS', '8'))
+# Rows requested from EIA when the local store is not in use
+FORECAST_EIA_ROWS = 5000
+# Seconds between request-time checks for new periods; the ingest listener
+# applies new weeks straight away regardless
+FORECAST_CHECK_INTERVAL = float(os.getenv('FORECAST_CHECK_INTERVAL', '60'))
+
+_EPOCH = date(1970, 1, 1)
+
+SeriesKey = Tuple[str, str]
+
+
+def day_date(day: int) -> date:
+    return _EPOCH + timedelta(days=int(day))
+
+
+class Forecaster:
+    """Model state for every series, column-wise: row i is series keys[i]."""
+
+    def __init__(self, horizon: int = FORECAST_HORIZON):
+        self.horizon = horizon
+        self.keys: List[SeriesKey] = []
+        self.area_names: List[str] = []
+        self.rows: Dict[SeriesKey, int] = {}
+        self.last_day = np.empty(0, dtype=np.int64)
+        self.last_value = np.empty(0)
+        self.count = np.empty(0, dtype=np.int64)
+        self.ewma = np.empty(0)
+        self.level = np.empty(0)
+        self.trend = np.empty(0)
+        self.seasonal = np.empty((0, SEASON_LENGTH))
+        self.changes = np.empty((0, ANOMALY_WINDOW))
+        self.n_changes = np.empty(0, dtype=np.int64)
+        self.zscore = np.empty(0)
+        self.anomalies: List[List[dict]] = []
+        # (product code, area code or name, lower-cased) -> precomputed output
+        self.outputs: Dict[SeriesKey, dict] = {}
+        self.fitted_through: Optional[date] = None
+        # The EIA payload last applied, when fitting from EIA rather than the store
+        self.source = None
+        self.checked_at = 0.0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _grow(self, n: int):
+        """Extend the state arrays for n series just appended to keys."""
+        self.last_day = np.concatenate((self.last_day, np.full(n, -1, dtype=np.int64)))
+        self.count = np.concatenate((self.count, np.zeros(n, dtype=np.int64)))
+        self.n_changes = np.concatenate((self.n_changes, np.zeros(n, dtype=np.int64)))
+        for name in ("last_value", "ewma", "level", "trend"):
+            setattr(self, name, np.concatenate((getattr(self, name), np.zeros(n))))
+        self.zscore = np.concatenate((self.zscore, np.full(n, np.nan)))
+        self.seasonal = np.vstack((self.seasonal, np.zeros((n, SEASON_LENGTH))))
+        self.changes = np.vstack((self.changes, np.zeros((n, ANOMALY_WINDOW))))
+
+    def _row(self, key: SeriesKey, area_name: str) -> int:
+        """Row of a series, appending it to keys if new; call _grow afterwards."""
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            self.area_names.append(area_name)
+            self.anomalies.append([])
+        return row
+
+    def update(self, observations: Iterable[dict]) -> int:
+        """Apply observations newer than each series' last fitted period; returns points applied."""
+        known = len(self.keys)
+        rows, days, values = [], [], []
+        for obs in observations:
+            if obs["product"] not in _LABELS:
+                continue
+            rows.append(self._row((obs["product"], obs["area_code"]), obs["area_name"]))
+            days.append(obs["period"].toordinal())
+            values.append(obs["value"])
+        if len(self.keys) > known:
+            self._grow(len(self.keys) - known)
+        return self._apply(np.array(rows, dtype=np.int64), np.array(days, dtype=np.int64) - _EPOCH.toordinal(),
+                           np.array(values, dtype=np.float64))
+
+    def update_snapshot(self, snapshot) -> int:
+        """update() from a snapshot.PriceSnapshot's columns, without a dict per row."""
+        known = len(self.keys)
+        series_rows = np.full(len(snapshot.series_ids), -1, dtype=np.int64)
+        for i, (p, a) in enumerate(zip(snapshot.series_product.tolist(), snapshot.series_area.tolist())):
+            code = snapshot.products[p][0]
+            if code not in _LABELS:
+                continue
+            area_code, area_name = snapshot.areas[a]
+            series_rows[i] = self._row((code, area_code), area_name)
+        if len(self.keys) > known:
+            self._grow(len(self.keys) - known)
+        rows = series_rows[snapshot.series_rows()]
+        wanted = rows >= 0
+        return self._apply(rows[wanted], np.asarray(snapshot.period, dtype=np.int64)[wanted],
+                           np.asarray(snapshot.value)[wanted])
+
+    def resume_from(self) -> Optional[date]:
+        """First period some series may still be missing: the day after the
+        least recently fitted series' last period (None before any fit).
+
+        Series more than FORECAST_STALE_WEEKS behind the newest are left out,
+        so one discontinued series does not force a re-read of its whole gap on
+        every refit. Should it publish again, only rows from here on apply.
+        """
+        if not len(self) or self.last_day.min() < 0:
+            return None
+        live = self.last_day[self.last_day >= self.last_day.max() - 7 * FORECAST_STALE_WEEKS]
+        return day_date(int(live.min())) + timedelta(days=1)
+
+    def _apply(self, rows: np.ndarray, days: np.ndarray, values: np.ndarray) -> int:
+        fresh = days > self.last_day[rows]
+        rows, days, values = rows[fresh], days[fresh], values[fresh]
+        if not len(rows):
+            return 0
+        # One column per period, NaN where a series has no value for it
+        periods, columns = np.unique(days, return_inverse=True)
+        grid = np.full((len(periods), len(self)), np.nan)
+        grid[columns, rows] = values
+        for day, column in zip(periods.tolist(), grid):
+            self._step(day, column)
+        self.fitted_through = day_date(self.last_day.max())
+        self.publish()
+        return int(len(rows))
+
+    def _step(self, day: int, v: np.ndarray):
+        seen = ~np.isnan(v)
+        first = seen & (self.count == 0)
+        known = seen & (self.count > 0)
+        x = np.where(seen, v, 0.0)
+        slot = (day // 7) % SEASON_LENGTH
+        s = self.seasonal[:, slot]
+
+        level = HW_ALPHA * (x - s) + (1 - HW_ALPHA) * (self.level + self.trend)
+        trend = HW_BETA * (level - self.level) + (1 - HW_BETA) * self.trend
+        self.seasonal[:, slot] = np.where(known, HW_GAMMA * (x - level) + (1 - HW_GAMMA) * s, s)
+        self.trend = np.where(known, trend, self.trend)
+        self.level = np.where(known, level, np.where(first, x, self.level))
+        self.ewma = np.where(known, EWMA_ALPHA * x + (1 - EWMA_ALPHA) * self.ewma,
+                             np.where(first, x, self.ewma))
+
+        # z-score of this week's change against the previous window of changes
+        change = x - self.last_value
+        full = known & (self.n_changes >= ANOMALY_WINDOW)
+        std = np.maximum(self.changes.std(axis=1, ddof=1), ANOMALY_MIN_STD)
+        z = np.where(full, (change - self.changes.mean(axis=1)) / std, np.nan)
+        self.zscore = np.where(known, z, self.zscore)
+        period = None
+        for i in np.flatnonzero(np.abs(np.nan_to_num(z)) > ANOMALY_Z).tolist():
+            period = period or day_date(day).isoformat()
+            flags = self.anomalies[i]
+            flags.append({"period": period, "value": float(x[i]), "change": round(float(change[i]), 4),
+                          "zscore": round(float(z[i]), 2)})
+            del flags[:-ANOMALY_KEEP]
+        moved = np.flatnonzero(known)
+        self.changes[moved, self.n_changes[moved] % ANOMALY_WINDOW] = change[moved]
+        self.n_changes += known
+
+        self.last_value = np.where(seen, x, self.last_value)
+        self.last_day = np.where(seen, day, self.last_day)
+        self.count += seen
+
+    def projections(self) -> np.ndarray:
+        """Holt-Winters projection per series (rows) for 1..horizon weeks ahead (columns)."""
+        steps = np.arange(1, self.horizon + 1)
+        slots = ((self.last_day[:, None] + 7 * steps) // 7) % SEASON_LENGTH
+        seasonal = np.take_along_axis(self.seasonal, slots, axis=1)
+        return self.level[:, None] + steps * self.trend[:, None] + seasonal
+
+    def publish(self):
+        """Rebuild the served outputs from the current model state."""
+        projected = np.round(self.projections(), 4).tolist()
+        ewma = np.round(self.ewma, 4).tolist()
+        zscore = self.zscore.tolist()
+        outputs = {}
+        for i, (code, area_code) in enumerate(self.keys):
+            last = day_date(self.last_day[i])
+            output = {
+                "product": _LABELS[code],
+                "area_code": area_code,
+                "area": self.area_names[i],
+                "last_period": last.isoformat(),
+                "last_value": float(self.last_value[i]),
+                "ewma": ewma[i],
+                "forecast": [
+                    {"period": (last + timedelta(weeks=h + 1)).isoformat(), "value": value}
+                    for h, value in enumerate(projected[i])
+                ],
+                "zscore": None if np.isnan(zscore[i]) else round(zscore[i], 2),
+                "anomaly": bool(abs(np.nan_to_num(zscore[i])) > ANOMALY_Z),
+                "anomalies": list(self.anomalies[i]),
+            }
+            outputs[(code, area_code.lower())] = output
+            outputs.setdefault((code, self.area_names[i].strip().lower()), output)
+        self.outputs = outputs
+
+    def series(self, product_code: str, area: Optional[str] = None) -> List[dict]:
+        """Precomputed outputs for one area (code or name), or every area of the product."""
+        if area is not None:
+            output = self.outputs.get((product_code, area.strip().lower()))
+            return [output] if output else []
+        return [self.outputs[(code, area_code.lower())] for code, area_code in self.keys if code == product_code]
+
+
+_LABELS = {code: product for product, code in PRODUCT_CODES.items()}
+
+forecaster = Forecaster()
+forecast_flight = SingleFlight()
+
+
+async def load_observations(db: AsyncSession, since: Optional[date] = None) -> List[dict]:
+    """Stored weekly observations of the app's products, oldest first."""
+    stmt = select(
+        PriceObservation.product, PriceObservation.area_code, PriceObservation.area_name,
+        PriceObservation.period, PriceObservation.value,
+    ).where(PriceObservation.frequency == FORECAST_FREQUENCY, PriceObservation.product.in_(list(_LABELS)))
+    if since:
+        stmt = stmt.where(PriceObservation.period >= since)
+    rows = (await db.execute(stmt.order_by(PriceObservation.period))).all()
+    return [row._asdict() for row in rows]
+
+
+async def refresh(use_store: bool, model: Forecaster = forecaster, force: bool = False) -> Forecaster:
+    """Apply any periods the model has not seen yet, from the store or EIA.
+
+    A fitted model is only checked for new periods every FORECAST_CHECK_INTERVAL
+    seconds unless `force` is set. The shared refresh reads the store through a
+    session of its own, so it does not depend on whichever caller started it.
+    """
+    if not force and model.fitted_through and time.monotonic() - model.checked_at < FORECAST_CHECK_INTERVAL:
+        return model
+
+    async def apply():
+        if use_store:
+            if model.fitted_through is None:
+                # A cold fit reads the memory-mapped snapshot, then catches up from the store
+                snapshot = get_snapshot(FORECAST_FREQUENCY)
+                if snapshot is not None:
+                    model.update_snapshot(snapshot)
+            async with AsyncSessionLocal() as db:
+                latest = await latest_period(db, FORECAST_FREQUENCY)
+                if latest is not None and (model.fitted_through is None or latest > model.fitted_through):
+                    # From the series furthest behind; rows a series has already seen are skipped
+                    model.update(await load_observations(db, model.resume_from()))
+        else:
+            payload = await get_cached_prices(FORECAST_FREQUENCY, FORECAST_EIA_ROWS, max_retries=3)
+            if payload is not model.source:
+                model.update(parse_observations(payload.get("response", {}).get("data", []), FORECAST_FREQUENCY))
+                model.source = payload
+        model.checked_at = time.monotonic()
+        return model
+
+    # Concurrent requests and the ingest listener share one refresh
+    return await forecast_flight.do(id(model), apply)
+
+
+async def refit_after_ingest(db: AsyncSession, frequency: str, result) -> None:
+    """IngestScheduler listener: apply the new weeks to an already fitted model.
+
+    A model nobody has asked for yet is left alone; the first request fits it.
+    """
+    if frequency != FORECAST_FREQUENCY or forecaster.fitted_through is None:
+        return
+    before = forecaster.fitted_through
+    await refresh(use_store=True, force=True)
+    if forecaster.fitted_through != before:
+        print(f"Forecasts updated through {forecaster.fitted_through.isoformat()}")
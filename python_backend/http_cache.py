@@ -0,0 +1,158 @@
+"""
+Conditional GET and pre-compressed bodies for the price endpoints.
+
+Each distinct price response is serialized once into a RenderedBody holding
+the JSON bytes, a strong ETag (latest period plus a content hash) and a
+Last-Modified time. Gzip and brotli variants are compressed on first request
+and kept on the same object, so repeat hits cost a dict lookup. While the
+rendered entry is fresh, requests are answered from it directly -- a 304 when
+the client's validators match -- before any EIA or database work.
+"""
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Hashable, Iterable, Optional
+
+import orjson
+from fastapi import Request, Response
+
+from cache import TTLCache
+from eia import EIA_CACHE_TTL
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9  # 11 is ~300x slower for ~7% smaller bodies
+
+# Rendered bodies live as long as a fresh EIA cache entry; ingest clears them
+rendered_cache = TTLCache(maxsize=256, ttl=EIA_CACHE_TTL)
+
+
+class RenderedBody:
+    """Serialized JSON body with validators and lazily built compressed variants."""
+
+    __slots__ = ("body", "etag", "last_modified", "_encoded")
+
+    def __init__(self, body: bytes, etag: str, last_modified: datetime):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self._encoded: Dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+            self._encoded[encoding] = data
+        return data
+
+
+def latest_period(rows: Iterable[dict]) -> str:
+    return max((row.get("period", "") for row in rows), default="")
+
+
+def render(key: Hashable, content: dict, latest: str, body: Optional[bytes] = None) -> RenderedBody:
+    """Serialize `content` (whose newest period is `latest`) and cache it under `key`.
+
+    `body`, when given, is already-serialized JSON for `content` (the upstream
+    EIA bytes) and is sent as-is. Last-Modified only moves when the ETag
+    changes, so re-rendering identical data after the entry expires does not
+    invalidate clients' copies.
+    """
+    if body is None:
+        body = orjson.dumps(content)
+    etag = f'"{latest or "none"}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    previous = rendered_cache.get_entry(key)
+    if previous is not None and previous.value.etag == etag:
+        last_modified = previous.value.last_modified
+    else:
+        last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+    rendered = RenderedBody(body, etag, last_modified)
+    rendered_cache.set(key, rendered)
+    return rendered
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison per RFC 9110; encoding suffixes refer to the same representation
+    base = etag.strip('"')
+    for token in header.split(","):
+        token = token.strip()
+        if token == "*":
+            return True
+        token = token.removeprefix("W/").strip('"')
+        if token == base or (token.endswith(("-gzip", "-br")) and token.rsplit("-", 1)[0] == base):
+            return True
+    return False
+
+
+def not_modified(request: Request, rendered: RenderedBody) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, rendered.etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return rendered.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def choose_encoding(request: Request) -> Optional[str]:
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if BROTLI_AVAILABLE and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def respond(request: Request, rendered: RenderedBody) -> Response:
+    """200 with the best cached encoding, or 304 if the client's copy is current."""
+    headers = {
+        "ETag": rendered.etag,
+        "Last-Modified": format_datetime(rendered.last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding, Authorization",
+    }
+    if not_modified(request, rendered):
+        return Response(status_code=304, headers=headers)
+    body = rendered.body
+    encoding = choose_encoding(request) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = rendered.encoded(encoding)
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'{rendered.etag[:-1]}-{encoding}"'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def cached_response(request: Request, key: Hashable) -> Optional[Response]:
+    """Response straight from a fresh rendered body, or None to build one."""
+    rendered = rendered_cache.get(key)
+    return respond(request, rendered) if rendered is not None else None
+
+
+async def invalidate_after_ingest(db, frequency: str, result) -> None:
+    """IngestScheduler listener: new observations make every rendered body stale."""
+    rendered_cache.clear()
@@ -0,0 +1,57 @@
+"""
+Incremental ingest of EIA price series into the local price store.
+
+Only periods at or after the latest stored period (the watermark) are
+requested from EIA; the watermark period itself is re-fetched so a partially
+published week is completed and any EIA revision is picked up. Only rows that
+are new or changed count towards the result, so a poll that finds nothing
+new reports zero rows. Results are paged through with EIA's offset/length
+parameters.
+
+Scheduling lives in scheduler.py, which is also the cron entry point.
+"""
+import os
+from datetime import date
+from typing import NamedTuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eia import fetch_prices
+from price_store import latest_period, parse_observations, upsert_observations
+
+# EIA API v2 caps `length` at 5000 rows per request
+INGEST_PAGE_SIZE = 5000
+# How far back the first sync reaches when the store is empty
+INGEST_BACKFILL_START = os.getenv('INGEST_BACKFILL_START', '2015-01-01')
+
+
+class IngestResult(NamedTuple):
+    rows: int  # inserted or changed
+    pages: int
+    watermark: Optional[date]  # latest stored period before this run
+    upstream_latest: Optional[date]  # latest period EIA returned
+
+
+async def ingest_prices(db: AsyncSession, frequency: str = "weekly") -> IngestResult:
+    """Upsert EIA rows at or after the stored watermark, one page at a time."""
+    watermark = await latest_period(db, frequency)
+    start = watermark.isoformat() if watermark else INGEST_BACKFILL_START
+    rows = pages = offset = 0
+    upstream_latest = None
+    while True:
+        payload = await fetch_prices(frequency, INGEST_PAGE_SIZE, offset, max_retries=3, start=start)
+        response = payload.get("response", {})
+        data = response.get("data", [])
+        pages += 1
+        observations = parse_observations(data, frequency)
+        if watermark is not None:
+            observations = [obs for obs in observations if obs["period"] >= watermark]
+        if observations:
+            newest = max(obs["period"] for obs in observations)
+            upstream_latest = max(upstream_latest, newest) if upstream_latest else newest
+        rows += await upsert_observations(db, observations)
+        offset += len(data)
+        if not data or offset >= int(response.get("total") or 0):
+            break
+    await db.commit()
+    return IngestResult(rows, pages, watermark, upstream_latest)
@@ -1,40 +1,109 @@
 # --- Owner API: Spot Prices & Historical Data ---
 
 from fastapi import APIRouter
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, Field
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
+from sqlalchemy.engine import Engine
 import os
-import stripe
+import sys
 import httpx
 import asyncio
-from typing import Optional, List
-from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, List
+from datetime import date, datetime, timedelta
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from database import get_db, engine, Base, User, PriceAlert, Order
+from database import get_db, get_engine, dispose_engine, AsyncSessionLocal, Base, User, PriceAlert, Order
+from eia import EIA_API_KEY, cache_stats as eia_cache_stats, get_cached_prices, close_eia_client, price_cache
+from price_store import has_observations, query_observations, query_series, filter_rows, PRODUCT_CODES
+from price_store import latest_period as stored_latest_period
+from regions import area_regions, index_payload, normalize_region
+from user_cache import get_cached_user, cache_user, user_cache
+from passwords import verify_password, get_password_hash, get_pwd_context
+from bulk import BULK_MAX_ITEMS, create_batch
+from http_cache import cached_response, invalidate_after_ingest, latest_period, render, rendered_cache, respond
+from pagination import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, fetch_page, ndjson_response, page_response
+from scheduler import scheduler, INGEST_SCHEDULER_ENABLED
+from realtime import STREAM_MAX_SUBSCRIBERS, evaluate_and_push, hub, stream_events
+from order_book import match_after_ingest, order_books
+from notifications import dispatcher, enqueue_alerts
+from payments import close_stripe, create_intent, get_stripe, intent_cache
+from ratelimit import RateLimiter, remote_address
+from shared_store import close_store
+from metrics import METRICS_ENABLED, MetricsMiddleware, instrument_engine, monitor_loop_lag, register_cache, registry, request_id
 
 # --- Load .env ---
 load_dotenv()
 # --- Config ---
 SUPABASE_PASSWORD = os.getenv('SUPABASE_PASSWORD', 'A0000000l123')
 JWT_SECRET = os.getenv('JWT_SECRET', 'supersecret')
-STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', 'sk_test')
-EIA_API_KEY = os.getenv('EIA_API_KEY', 'G19nzdqrKjjAkYvnZt4KuKesf5eti3AhoHE7NSyR')
-print(f"EIA_API_KEY loaded: {EIA_API_KEY[:10]}..." if EIA_API_KEY else "EIA_API_KEY not found")
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+# Lifetime of the single-purpose token an EventSource passes as /stream?token=
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv('STREAM_TOKEN_EXPIRE_SECONDS', '60'))
+# Accept the signed 'role' claim in access tokens for owner-only checks. A role
+# change then takes effect when the user's current token expires.
+TRUST_ROLE_CLAIMS = os.getenv('TRUST_ROLE_CLAIMS', 'true').lower() in ['true', '1', 'yes']
 ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', 'http://localhost:3000,http://localhost:5173').split(',')
-
-stripe.api_key = STRIPE_SECRET_KEY
+# Where price endpoints read from: 'eia', 'store' (local price_observations) or
+# 'auto' (store once it has been populated by ingest.py, EIA until then)
+PRICE_SOURCE = os.getenv('PRICE_SOURCE', 'auto').lower()
+# Answer store reads from the memory-mapped price snapshot while it is as current
+# as the store (see snapshot.py). Off by default on serverless, where importing
+# NumPy would slow every cold start and the snapshot file is not kept up to date.
+SNAPSHOT_READS = os.getenv(
+    'SNAPSHOT_READS', 'false' if os.getenv('SERVERLESS', 'false').lower() == 'true' else 'true'
+).lower() in ['true', '1', 'yes']
+
+async def alert_and_notify(db: AsyncSession, frequency: str, result) -> None:
+    fired = await evaluate_and_push(db, frequency, result)
+    # Delivered by the notification dispatcher (see notifications.py)
+    await enqueue_alerts(db, fired)
+
+async def write_price_snapshot(db: AsyncSession, frequency: str, result) -> None:
+    # Imported here so NumPy stays off the import path of main (see snapshot.py)
+    from snapshot import write_after_ingest
+    await write_after_ingest(db, frequency, result)
+
+async def refit_forecasts(db: AsyncSession, frequency: str, result) -> None:
+    # Nothing to refit until the first /api/owner/forecast request imports forecast
+    forecast = sys.modules.get("forecast")
+    if forecast is not None:
+        await forecast.refit_after_ingest(db, frequency, result)
+
+# Evaluate price alerts, push new prices/alerts to /stream clients, queue
+# alert notifications, fill crossed orders, rewrite the price snapshot, update
+# forecasts and drop rendered price responses whenever the scheduler ingests
+# new periods
+scheduler.add_listener(alert_and_notify)
+scheduler.add_listener(match_after_ingest)
+scheduler.add_listener(write_price_snapshot)
+scheduler.add_listener(refit_forecasts)
+scheduler.add_listener(invalidate_after_ingest)
+
+# Statement timings, cache hit ratios and per-request timing (see metrics.py)
+instrument_engine(Engine)
+register_cache("eia_prices", price_cache.stats)
+register_cache("rendered_responses", rendered_cache.stats)
+register_cache("users", user_cache.stats)
+register_cache("aggregates", lambda: aggregate_stats())
+register_cache("payment_intents", intent_cache.stats)
+
+# --- Lazily loaded dependencies ---
+# Stripe, python-jose and NumPy (analytics) are imported on first use, and the
+# DB engine, CryptContext and EIA client are built on first use, so a cold
+# serverless container only pays for what its first request needs. The
+# long-running server warms them in the lifespan instead (get_stripe is in
+# payments.py).
+
+def aggregate_stats() -> dict:
+    # Empty until the first /prices/ohlc request imports analytics
+    analytics = sys.modules.get("analytics")
+    return analytics.aggregate_cache.stats() if analytics else {}
 
 # Check if running in serverless environment (checked at runtime, not import time)
 def is_serverless():
@@ -43,10 +112,12 @@ def is_serverless():
 # --- Lifespan ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if not EIA_API_KEY:
+        print("EIA_API_KEY not found")
     # Startup - Create tables (skip in serverless)
     if not is_serverless():
         try:
-            async with engine.begin() as conn:
+            async with get_engine().begin() as conn:
                 await conn.run_sync(Base.metadata.create_all)
             print("Successfully connected to database and created tables!")
         except Exception as e:
@@ -57,21 +128,52 @@ async def lifespan(app: FastAPI):
     else:
         print("Running in serverless mode - skipping database initialization")
     
+    # Keep the local price store fresh off the request path; serverless
+    # deployments run `python scheduler.py --once` from cron instead
+    if INGEST_SCHEDULER_ENABLED and not is_serverless():
+        scheduler.start()
+    if not is_serverless():
+        # Serverless deployments deliver from `python scheduler.py --once` instead
+        dispatcher.start()
+        # Pay for lazily built dependencies now rather than on the first request
+        get_pwd_context()
+        get_stripe()
+        if SNAPSHOT_READS:
+            from snapshot import map_snapshots
+            map_snapshots()
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    
     yield
     
     # Shutdown
+    lag_monitor.cancel()
+    hub.close()
+    await scheduler.stop()
+    await dispatcher.stop()
+    close_stripe()
+    await close_eia_client()
+    await close_store()
     if not is_serverless():
-        await engine.dispose()
+        await dispose_engine()
 
 # --- App ---
-# Create app without lifespan initially
-app = FastAPI()
+# Mangum runs the app with lifespan="off" on Vercel (see api/index.py)
+app = FastAPI(lifespan=lifespan)
 
 
-# Rate limiting
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# Rate limiting: token buckets in the shared store (see ratelimit.py)
+def rate_limit_key(request: Request) -> str:
+    # Per user when the request carries a valid token, per client IP otherwise.
+    # The auth dependencies have already run, so their decoded claims are reused.
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            return f"user:{token_claims(request, authorization[7:])['user_id']}"
+        except HTTPException:
+            pass
+    return f"ip:{remote_address(request)}"
+
+limiter = RateLimiter(key_func=rate_limit_key)
 
 # CORS
 app.add_middleware(
@@ -79,94 +181,176 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "X-Request-ID"]
 )
+# Outermost, so latency includes CORS and rate limiting
+app.add_middleware(MetricsMiddleware, root_app=app)
 
-# Security
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+# Security (password hashing runs off the event loop, see passwords.py)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 # --- Owner API: Spot Prices & Historical Data ---
-# East Coast PADD codes (EIA): PADD 1 = East Coast
-EAST_COAST_PADD = "PADD 1"
-EAST_COAST_STATES = [
-    "CT", "DE", "FL", "GA", "ME", "MD", "MA", "NH", "NJ", "NY", "NC", "PA", "RI", "SC", "VT", "VA"
-]
+# Owners default to East Coast (PADD 1) prices
+OWNER_DEFAULT_REGION = "East Coast"
 
 owner_router = APIRouter(prefix="/api/owner", tags=["owner"])
 
-def filter_east_coast_prices(data):
-    # EIA data: filter by area_name or state abbreviation
-    east_coast = [row for row in data if (
-        row.get("area-name", "").startswith("East Coast") or
-        row.get("area-code", "") == EAST_COAST_PADD or
-        row.get("area-name", "") in EAST_COAST_STATES or
-        row.get("area-code", "") in EAST_COAST_STATES
-    )]
-    return east_coast if east_coast else data  # fallback to all if empty
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
+def filter_region_prices(data, region: Optional[str] = OWNER_DEFAULT_REGION):
+    # Memoized area -> region lookup per row (see regions.py)
+    key = normalize_region(region)
+    if key is None:
+        return data
+    filtered = [row for row in data if key in area_regions(row.get("duoarea", ""), row.get("area-name", ""))]
+    return filtered if filtered else data  # fallback to all if empty
+
+async def use_price_store(db: AsyncSession, frequency: str) -> bool:
+    if PRICE_SOURCE == 'eia':
+        return False
+    if PRICE_SOURCE == 'store':
+        return True
+    return await has_observations(db, frequency)
+
+async def current_snapshot(db: AsyncSession, frequency: str):
+    """The mapped price snapshot if it holds the store's latest period, else None."""
+    if not SNAPSHOT_READS:
+        return None
+    # Imported here so NumPy stays off the import path of main (see snapshot.py)
+    from snapshot import get_snapshot
+    prices = get_snapshot(frequency)
+    if prices is None or prices.latest != await stored_latest_period(db, frequency):
+        return None
+    return prices
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, scope: Optional[str] = None) -> dict:
+    """Verify `token` and return its claims. Access tokens carry no scope; a
+    scoped token (e.g. 'stream') is only accepted where that scope is asked for."""
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        user_id: str = payload.get("user_id")
-        if user_id is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    if payload.get("user_id") is None or payload.get("scope") != scope:
+        raise credentials_exception()
+    return payload
+
+def token_claims(request: Request, token: str) -> dict:
+    """decode_token() for the request's bearer token, decoded once per request."""
+    claims = getattr(request.state, "claims", None)
+    if claims is None:
+        claims = request.state.claims = decode_token(token)
+    return claims
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
+    return await user_from_claims(token_claims(request, token), db)
+
+async def user_from_claims(payload: dict, db: AsyncSession) -> User:
     try:
-        user_id_int = int(user_id)
+        user_id_int = int(payload["user_id"])
     except ValueError:
-        raise credentials_exception
+        raise credentials_exception()
+
+    # Served from the in-process user cache; only a miss queries PostgreSQL
+    exp = payload.get("exp")
+    user = get_cached_user(user_id_int, exp)
+    if user is not None:
+        return user
     stmt = select(User).where(User.id == user_id_int)
     result = await db.execute(stmt)
     user = result.scalar_one_or_none()
     if not user:
-        raise credentials_exception
+        raise credentials_exception()
+    cache_user(user_id_int, exp, user)
     return user
 
+async def require_owner(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> dict:
+    """Owner-only guard. Trusts the signed role claim when present, so no DB lookup is needed;
+    tokens issued before role claims existed fall back to get_current_user."""
+    payload = token_claims(request, token)
+    role = payload.get("role") if TRUST_ROLE_CLAIMS else None
+    if role is None:
+        role = (await get_current_user(request, token, db)).role
+    if role != "owner":
+        raise HTTPException(status_code=403, detail="Only truck stop owners can access this endpoint.")
+    return payload
+
 @owner_router.get("/spot-prices")
 @limiter.limit("30/minute")
-async def get_owner_spot_prices(request: Request, current_user: User = Depends(get_current_user)):
-    if current_user.role != "owner":
-        raise HTTPException(status_code=403, detail="Only truck stop owners can access this endpoint.")
-    url = f"https://api.eia.gov/v2/petroleum/pri/gnd/data/?api_key={EIA_API_KEY}&frequency=weekly&data[0]=value&sort[0][column]=period&sort[0][direction]=desc&length=20"
+async def get_owner_spot_prices(request: Request, region: str = OWNER_DEFAULT_REGION, owner: dict = Depends(require_owner), db: AsyncSession = Depends(get_db)):
+    key = ("spot-prices", normalize_region(region))
+    cached = cached_response(request, key)
+    if cached is not None:
+        return cached
     try:
-        timeout = httpx.Timeout(connect=5.0, read=15.0, write=5.0, pool=5.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.json().get("response", {}).get("data", [])
-            filtered = filter_east_coast_prices(data)
-            return {"data": filtered}
+        if await use_price_store(db, "weekly"):
+            data = await query_observations(db, "weekly", limit=20)
+        else:
+            payload = await get_cached_prices("weekly", 20)
+            data = payload.get("response", {}).get("data", [])
+        filtered = filter_region_prices(data, region)
+        return respond(request, render(key, {"data": filtered}, latest_period(filtered)))
     except Exception as e:
-        print(f"Error in /api/owner/spot-prices: {e}")
+        print(f"[{request_id()}] Error in /api/owner/spot-prices: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch spot prices.")
 
 @owner_router.get("/historical")
 @limiter.limit("30/minute")
-async def get_owner_historical(request: Request, current_user: User = Depends(get_current_user)):
-    if current_user.role != "owner":
-        raise HTTPException(status_code=403, detail="Only truck stop owners can access this endpoint.")
-    url = f"https://api.eia.gov/v2/petroleum/pri/gnd/data/?api_key={EIA_API_KEY}&frequency=daily&data[0]=value&sort[0][column]=period&sort[0][direction]=desc&length=14"
+async def get_owner_historical(request: Request, region: str = OWNER_DEFAULT_REGION, owner: dict = Depends(require_owner), db: AsyncSession = Depends(get_db)):
+    key = ("historical", normalize_region(region))
+    cached = cached_response(request, key)
+    if cached is not None:
+        return cached
     try:
-        timeout = httpx.Timeout(connect=5.0, read=15.0, write=5.0, pool=5.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.json().get("response", {}).get("data", [])
-            filtered = filter_east_coast_prices(data)
-            # Return last 7 days
-            filtered = sorted(filtered, key=lambda x: x.get("period", ""), reverse=True)[:7]
-            return {"data": filtered}
+        if await use_price_store(db, "daily"):
+            data = await query_observations(db, "daily", limit=14)
+        else:
+            payload = await get_cached_prices("daily", 14)
+            data = payload.get("response", {}).get("data", [])
+        filtered = filter_region_prices(data, region)
+        # Return last 7 days
+        filtered = sorted(filtered, key=lambda x: x.get("period", ""), reverse=True)[:7]
+        return respond(request, render(key, {"data": filtered}, latest_period(filtered)))
     except Exception as e:
-        print(f"Error in /api/owner/historical: {e}")
+        print(f"[{request_id()}] Error in /api/owner/historical: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch historical prices.")
 
+@owner_router.get("/forecast")
+@limiter.limit("30/minute")
+async def get_owner_forecast(
+    request: Request,
+    product: str = Query('Diesel', max_length=50),
+    area: Optional[str] = Query(None, max_length=100),
+    owner: dict = Depends(require_owner),
+    db: AsyncSession = Depends(get_db)
+):
+    """Next weeks' projected prices and abnormal-move flags for one area, or every
+    area of the product. Served from precomputed model outputs (see forecast.py)."""
+    product_code = PRODUCT_CODES.get(product, product)
+    key = ("forecast", product_code, area.strip().lower() if area else None)
+    cached = cached_response(request, key)
+    if cached is not None:
+        return cached
+
+    import forecast
+
+    try:
+        model = await forecast.refresh(await use_price_store(db, "weekly"))
+    except (httpx.HTTPStatusError, httpx.RequestError):
+        raise HTTPException(status_code=503, detail="EIA service temporarily unavailable. Please try again in a few minutes.")
+    series = model.series(product_code, area)
+    if not series:
+        raise HTTPException(status_code=404, detail="No prices found for this product and area")
+    fitted_through = model.fitted_through.isoformat()
+    content = {"product": product, "horizon": model.horizon, "fitted_through": fitted_through, "series": series}
+    return respond(request, render(key, content, fitted_through))
+
 # Register owner router
 app.include_router(owner_router)
 
@@ -221,50 +405,65 @@ class OrderOut(BaseModel):
     status: str
     created_at: datetime
 
+class BulkIn(BaseModel):
+    # Items are validated individually so one bad item doesn't reject the batch
+    items: List[Any] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkAlertResult(BaseModel):
+    index: int
+    ok: bool
+    item: Optional[AlertOut] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+
+class BulkAlertsOut(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkAlertResult]
+
+class BulkOrderResult(BaseModel):
+    index: int
+    ok: bool
+    item: Optional[OrderOut] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+
+class BulkOrdersOut(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkOrderResult]
+
 class PaymentIntentRequest(BaseModel):
     amount: int = Field(..., gt=0, description="Amount in cents")
+    order_id: Optional[int] = Field(None, description="Order being paid for; repeats return the same intent")
 
-# --- Utils ---
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+def alert_out(alert: PriceAlert) -> AlertOut:
+    return AlertOut(
+        id=str(alert.id),
+        product=alert.product,
+        area=alert.area,
+        threshold=alert.threshold,
+        created_at=alert.created_at
+    )
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def order_out(order: Order) -> OrderOut:
+    return OrderOut(
+        id=str(order.id),
+        product=order.product,
+        area=order.area,
+        quantity=order.quantity,
+        target_price=order.target_price,
+        location=order.location,
+        status=order.status,
+        created_at=order.created_at
+    )
 
+# --- Utils ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
+    from jose import jwt
     return jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        user_id: str = payload.get("user_id")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    # Query user from PostgreSQL
-    try:
-        user_id_int = int(user_id)
-    except ValueError:
-        raise credentials_exception
-        
-    stmt = select(User).where(User.id == user_id_int)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        raise credentials_exception
-    return user
-
 # --- Auth Endpoints ---
 @app.post('/auth/register', response_model=UserOut)
 @limiter.limit("5/minute")
@@ -279,7 +478,7 @@ async def register(request: Request, user: UserIn, db: AsyncSession = Depends(ge
     new_user = User(
         name=user.name,
         email=user.email,
-        password=get_password_hash(user.password),
+        password=await get_password_hash(user.password),
         role=user.role
     )
     
@@ -296,7 +495,7 @@ async def register(request: Request, user: UserIn, db: AsyncSession = Depends(ge
 
 # --- Helper function to create login response ---
 def create_login_response(user: User) -> Token:
-    access_token = create_access_token({"user_id": str(user.id)})
+    access_token = create_access_token({"user_id": str(user.id), "role": user.role})
     return Token(
         access_token=access_token,
         token_type="bearer",
@@ -313,7 +512,7 @@ async def authenticate_user(email: str, password: str, db: AsyncSession) -> User
     result = await db.execute(stmt)
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(password, user.password):
+    if not user or not await verify_password(password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -335,24 +534,44 @@ async def login_json(request: Request, login_data: LoginRequest, db: AsyncSessio
 # --- Price Endpoint ---
 @app.get('/prices')
 @limiter.limit("30/minute")
-async def get_prices(request: Request, current_user: User = Depends(get_current_user)):
+async def get_prices(
+    request: Request,
+    product: Optional[str] = None,
+    region: Optional[str] = None,
+    area: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Serialized, compressed and ETagged once per distinct response (http_cache.py);
+    # a fresh entry answers here, with a 304 if the client's copy is current
+    key = ("prices", product, normalize_region(region), area.lower() if area else None, start, end)
+    cached = cached_response(request, key)
+    if cached is not None:
+        return cached
+    if await use_price_store(db, "weekly"):
+        prices = await current_snapshot(db, "weekly")
+        if prices is not None:
+            data = prices.query_rows(product, area, start, end, limit=1000, region=region)
+        else:
+            data = await query_observations(db, "weekly", product, area, start, end, limit=1000, region=region)
+        content = {"response": {"frequency": "weekly", "total": len(data), "data": data}}
+        return respond(request, render(key, content, latest_period(data)))
     try:
-        url = f"https://api.eia.gov/v2/petroleum/pri/gnd/data/?api_key={EIA_API_KEY}&frequency=weekly&data[0]=value&sort[0][column]=period&sort[0][direction]=desc&length=1000"
-        
-        # Retry logic with exponential backoff
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                timeout = httpx.Timeout(connect=5.0, read=15.0, write=5.0, pool=5.0)
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    resp = await client.get(url)
-                    resp.raise_for_status()
-                    return resp.json()
-            except (httpx.HTTPStatusError, httpx.RequestError) as e:
-                if attempt == max_retries - 1:
-                    raise e
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                
+        # Server-side cache in front of the shared pooled client; falls back to
+        # the last good payload when EIA returns 429/5xx or is unreachable
+        payload = await get_cached_prices("weekly", 1000, max_retries=3)
+        if not (product or normalize_region(region) or area or start or end):
+            data = payload.get("response", {}).get("data", [])
+            # Upstream bytes go out untouched (see eia.PricePayload)
+            return respond(request, render(key, payload, latest_period(data), getattr(payload, "raw", None)))
+        # Region/product buckets are built once per payload; the rest is a dict lookup
+        data = index_payload(payload).lookup(region, product)
+        if area or start or end:
+            data = filter_rows(data, None, area, start, end)
+        content = {"response": {**payload.get("response", {}), "total": len(data), "data": data}}
+        return respond(request, render(key, content, latest_period(data)))
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 429:
             raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
@@ -360,9 +579,98 @@ async def get_prices(request: Request, current_user: User = Depends(get_current_
     except httpx.RequestError:
         raise HTTPException(status_code=503, detail="EIA service temporarily unavailable. Please try again in a few minutes.")
     except Exception as e:
-        print(f"Unexpected error in get_prices: {e}")
+        print(f"[{request_id()}] Unexpected error in get_prices: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# --- Price Aggregates ---
+@app.get('/prices/ohlc')
+@limiter.limit("30/minute")
+async def get_price_ohlc(
+    request: Request,
+    product: str = Query('Diesel', max_length=50),
+    area: str = Query('U.S.', max_length=100),
+    bucket: str = Query('month', pattern='^(week|month|quarter)$'),
+    window: int = Query(4, ge=2, le=104),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Weekly prices for one product and area as OHLC buckets, rolling mean/volatility and summary stats."""
+    product_code = PRODUCT_CODES.get(product, product)
+    response_key = ("ohlc", product_code, area.lower(), bucket, window, start, end)
+    cached = cached_response(request, response_key)
+    if cached is not None:
+        return cached
+    if await use_price_store(db, "weekly"):
+        prices = await current_snapshot(db, "weekly")
+        if prices is not None:
+            periods, values = prices.series_values(product_code, area, start, end)
+        else:
+            periods, values = await query_series(db, "weekly", product_code, area, start, end)
+    else:
+        try:
+            payload = await get_cached_prices("weekly", 1000, max_retries=3)
+        except (httpx.HTTPStatusError, httpx.RequestError):
+            raise HTTPException(status_code=503, detail="EIA service temporarily unavailable. Please try again in a few minutes.")
+        rows = filter_rows(payload.get("response", {}).get("data", []), product_code, area, start, end)
+        rows.sort(key=lambda row: row["period"])
+        periods = [date.fromisoformat(row["period"]) for row in rows]
+        values = [float(row["value"]) for row in rows]
+    if not periods:
+        raise HTTPException(status_code=404, detail="No prices found for this product and area")
+
+    from analytics import aggregate_cache, summarize
+
+    # Keyed by the data's extent too, so a new period produces a new entry
+    key = (product_code, area.lower(), bucket, window, start, end, periods[-1], len(periods))
+    async def compute():
+        return summarize(periods, values, bucket, window)
+    summary = await aggregate_cache.get_or_fetch(key, compute)
+    content = {"product": product, "area": area, "bucket": bucket, "window": window, **summary}
+    return respond(request, render(response_key, content, periods[-1].isoformat()))
+
+@app.get('/prices/export')
+@limiter.limit("10/minute")
+async def export_prices(
+    request: Request,
+    frequency: str = Query('weekly', pattern='^(weekly|daily)$'),
+    format: str = Query('csv', pattern='^(csv|parquet|snapshot)$'),
+    product: Optional[str] = Query(None, max_length=50),
+    area: Optional[str] = Query(None, max_length=100),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Bulk download of price history as CSV, Parquet (if pyarrow is installed) or the
+    columnar snapshot format itself (see snapshot.py)."""
+    import snapshot
+
+    if await use_price_store(db, frequency):
+        prices = await snapshot.ensure_snapshot(frequency)
+    else:
+        try:
+            payload = await get_cached_prices(frequency, 5000, max_retries=3)
+        except (httpx.HTTPStatusError, httpx.RequestError):
+            raise HTTPException(status_code=503, detail="EIA service temporarily unavailable. Please try again in a few minutes.")
+        prices = snapshot.PriceSnapshot.from_payload(payload, frequency)
+    prices = prices.subset(product, area, start, end)
+
+    filename = f"prices-{frequency}"
+    if format == 'csv':
+        return StreamingResponse(prices.iter_csv(), media_type="text/csv",
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'})
+    if format == 'parquet':
+        try:
+            body = await asyncio.to_thread(prices.to_parquet)
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export is not available on this server")
+        return Response(body, media_type="application/vnd.apache.parquet",
+                        headers={"Content-Disposition": f'attachment; filename="{filename}.parquet"'})
+    return Response(prices.to_bytes(), media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.snap"'})
+
 # --- Alerts ---
 @app.post('/alerts', response_model=AlertOut)
 async def create_alert(alert: AlertIn, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
@@ -378,27 +686,32 @@ async def create_alert(alert: AlertIn, current_user: User = Depends(get_current_
     await db.commit()
     await db.refresh(new_alert)
     
-    return AlertOut(
-        id=str(new_alert.id),
-        product=new_alert.product,
-        area=new_alert.area,
-        threshold=new_alert.threshold,
-        created_at=new_alert.created_at
-    )
+    return alert_out(new_alert)
+
+@app.post('/alerts/bulk', response_model=BulkAlertsOut)
+async def create_alerts_bulk(batch: BulkIn, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Create many alerts in one transaction; invalid items are reported per index."""
+    def to_row(alert: AlertIn) -> dict:
+        return {"user_id": current_user.id, "product": alert.product, "area": alert.area,
+                "threshold": alert.threshold, "active": True}
+    return await create_batch(db, batch.items, AlertIn, PriceAlert, to_row, alert_out)
 
 @app.get('/alerts', response_model=List[AlertOut])
-async def get_alerts(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def get_alerts(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query('json', pattern='^(json|ndjson)$'),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Active alerts, newest first. Pass the X-Next-Cursor header back as `cursor`
+    for the next page; `format=ndjson` streams every remaining alert instead."""
     stmt = select(PriceAlert).where(PriceAlert.user_id == current_user.id, PriceAlert.active == True)
-    result = await db.execute(stmt)
-    alerts = result.scalars().all()
-    
-    return [AlertOut(
-        id=str(alert.id),
-        product=alert.product,
-        area=alert.area,
-        threshold=alert.threshold,
-        created_at=alert.created_at
-    ) for alert in alerts]
+    if format == 'ndjson':
+        return ndjson_response(stmt, PriceAlert, current_user.id, cursor, alert_out)
+    alerts, next_cursor = await fetch_page(db, stmt, PriceAlert, current_user.id, cursor, limit)
+    return page_response(request, AlertOut, [alert_out(alert) for alert in alerts], next_cursor)
 
 @app.delete('/alerts/{alert_id}')
 async def delete_alert(alert_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
@@ -435,52 +748,130 @@ async def place_order(order: OrderIn, current_user: User = Depends(get_current_u
     db.add(new_order)
     await db.commit()
     await db.refresh(new_order)
+    order_books.add(new_order.id, new_order.product, new_order.area, new_order.target_price)
     
-    return OrderOut(
-        id=str(new_order.id),
-        product=new_order.product,
-        area=new_order.area,
-        quantity=new_order.quantity,
-        target_price=new_order.target_price,
-        location=new_order.location,
-        status=new_order.status,
-        created_at=new_order.created_at
-    )
+    return order_out(new_order)
+
+@app.post('/orders/bulk', response_model=BulkOrdersOut)
+async def place_orders_bulk(batch: BulkIn, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Place many orders in one transaction; invalid items are reported per index."""
+    def to_row(order: OrderIn) -> dict:
+        return {"user_id": current_user.id, "product": order.product, "area": order.area,
+                "quantity": order.quantity, "target_price": order.target_price,
+                "location": order.location, "status": "pending"}
+    created = await create_batch(db, batch.items, OrderIn, Order, to_row, order_out)
+    for result in created["results"]:
+        if result["ok"]:
+            item = result["item"]
+            order_books.add(int(item.id), item.product, item.area, item.target_price)
+    return created
 
 @app.get('/orders', response_model=List[OrderOut])
-async def get_orders(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    stmt = select(Order).where(Order.user_id == current_user.id).order_by(Order.created_at.desc())
-    result = await db.execute(stmt)
-    orders = result.scalars().all()
-    
-    return [OrderOut(
-        id=str(order.id),
-        product=order.product,
-        area=order.area,
-        quantity=order.quantity,
-        target_price=order.target_price,
-        location=order.location,
-        status=order.status,
-        created_at=order.created_at
-    ) for order in orders]
+async def get_orders(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query('json', pattern='^(json|ndjson)$'),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Orders, newest first. Pass the X-Next-Cursor header back as `cursor` for
+    the next page; `format=ndjson` streams every remaining order instead."""
+    stmt = select(Order).where(Order.user_id == current_user.id)
+    if format == 'ndjson':
+        return ndjson_response(stmt, Order, current_user.id, cursor, order_out)
+    orders, next_cursor = await fetch_page(db, stmt, Order, current_user.id, cursor, limit)
+    return page_response(request, OrderOut, [order_out(order) for order in orders], next_cursor)
+
+@app.delete('/orders/{order_id}')
+async def cancel_order(order_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    try:
+        order_id_int = int(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid order ID")
+
+    # Only pending orders can be cancelled; a filled one stays completed
+    stmt = update(Order).where(
+        Order.id == order_id_int,
+        Order.user_id == current_user.id,
+        Order.status == "pending"
+    ).values(status="cancelled").returning(Order.product, Order.area, Order.target_price)
+
+    cancelled = (await db.execute(stmt)).first()
+    await db.commit()
+
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    order_books.remove(order_id_int, *cancelled)
+    return {"message": "Order cancelled"}
+
+# --- Real-time Updates ---
+@app.post('/stream/token')
+async def create_stream_token(current_user: User = Depends(get_current_user)):
+    """A token for one /stream connection. EventSource cannot set headers, so it
+    goes in the query string, where it may be logged; it is therefore only
+    accepted by /stream and expires after STREAM_TOKEN_EXPIRE_SECONDS."""
+    token = create_access_token({"user_id": str(current_user.id), "scope": "stream"},
+                                timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS))
+    return {"token": token, "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+@app.get('/stream')
+async def stream_updates(
+    request: Request,
+    product: Optional[str] = Query(None, max_length=50),
+    region: Optional[str] = Query(None, max_length=100),
+    token: Optional[str] = None
+):
+    """Server-Sent Events: new price observations ('price') matching product/region and
+    the caller's fired alerts ('alert'). Authenticated by an Authorization header or by
+    a stream token from POST /stream/token as ?token= (access tokens are not accepted there)."""
+    if token:
+        payload = decode_token(token, scope="stream")
+    else:
+        bearer = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not bearer:
+            raise credentials_exception()
+        payload = decode_token(bearer)
+    # A short-lived session: the stream itself must not hold a pooled connection
+    async with AsyncSessionLocal() as db:
+        user = await user_from_claims(payload, db)
+    if hub.subscribers >= STREAM_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many live connections. Please try again shortly.")
+    subscription = hub.subscribe(product, region, user.id)
+    return StreamingResponse(
+        stream_events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # --- Stripe Payment Intent ---
 @app.post('/payments/create-intent')
 async def create_payment_intent(
     payment_request: PaymentIntentRequest,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
+    # Retries of the same request get the same intent (see payments.py)
+    if payment_request.order_id is not None:
+        order_status = await db.scalar(select(Order.status).where(
+            Order.id == payment_request.order_id,
+            Order.user_id == current_user.id
+        ))
+        if order_status is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order_status == "cancelled":
+            raise HTTPException(status_code=400, detail="Order is cancelled")
+    stripe = get_stripe()
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=payment_request.amount,
-            currency='usd',
-            metadata={
-                'user_id': str(current_user.id),
-                'user_email': current_user.email
-            }
+        intent = await create_intent(
+            current_user.id,
+            current_user.email,
+            payment_request.amount,
+            order_id=payment_request.order_id,
+            client_key=request.headers.get("idempotency-key")
         )
-        
-        return {"client_secret": intent.client_secret}
+        return {"client_secret": intent["client_secret"]}
     except stripe.error.StripeError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -489,12 +880,21 @@ async def create_payment_intent(
 async def health_check():
     try:
         # Check PostgreSQL connection
-        async with engine.begin() as conn:
+        async with get_engine().begin() as conn:
             await conn.execute(select(1))
-        return {"status": "healthy", "database": "connected"}
+        return {"status": "healthy", "database": "connected", "ingest": scheduler.status(), "eia": eia_cache_stats(),
+                "stream": hub.stats(), "orders": order_books.stats(), "notifications": dispatcher.stats()}
     except Exception:
         raise HTTPException(status_code=503, detail="Database unavailable")
 
+# --- Metrics ---
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition for this process (see metrics.py)."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,335 @@
+"""
+Prometheus metrics and per-request timing.
+
+Counters, gauges and histograms live in one in-process registry and are
+rendered in the Prometheus text format by /metrics. What is recorded:
+
+- http_request_duration_seconds per method, route template and status
+- eia_request_duration_seconds per upstream attempt, by status code, plus
+  eia_retries_total
+- db_query_duration_seconds per statement kind, via SQLAlchemy cursor events
+- password_hash_duration_seconds for hashing and verification
+- cache hits/misses and hit ratio for the in-process caches, read at scrape time
+- event_loop_lag_seconds, sampled by a background task
+
+Each request also gets an id (the caller's X-Request-ID, or a new one, echoed
+back on the response) and a RequestTiming in a context variable. EIA, DB and
+hashing time are added to it as they happen. Requests slower than
+TIMING_LOG_MIN_MS get one JSON timing line on the 'oil_tracker.timing'
+logger, so a slow /prices call can be split into upstream, database and CPU
+time.
+
+Metrics are per process; with several workers, scrape each one.
+"""
+import abc
+import asyncio
+import logging
+import os
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from sqlalchemy import event
+
+# --- Config ---
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ['true', '1', 'yes']
+TIMING_LOG_ENABLED = os.getenv('TIMING_LOG', 'true').lower() in ['true', '1', 'yes']
+# Requests faster than this are left out of the timing log (they still count in
+# /metrics); 0 logs every request
+TIMING_LOG_MIN_MS = float(os.getenv('TIMING_LOG_MIN_MS', '500'))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> List[str]:
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, *labels: str, value: float):
+        # Counters copied from another component's running totals (see register_cache)
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; observe() is a bisect and two additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (+Inf last), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, *labels: str, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Run `collect` before each render, to copy stats kept elsewhere into gauges."""
+        self._collectors.append(collect)
+
+    def render(self) -> bytes:
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = Registry()
+
+http_latency = registry.add(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")))
+eia_latency = registry.add(Histogram(
+    "eia_request_duration_seconds", "EIA API request latency per attempt.", ("status",)))
+eia_retries = registry.add(Counter("eia_retries_total", "EIA API requests retried after a failure."))
+db_latency = registry.add(Histogram(
+    "db_query_duration_seconds", "Database statement execution time.", ("operation",), DB_BUCKETS))
+hash_latency = registry.add(Histogram(
+    "password_hash_duration_seconds", "Password hashing/verification time, including pool wait.", ("operation",)))
+cache_hits = registry.add(Counter("cache_hits_total", "In-process cache hits (fresh and stale).", ("cache",)))
+cache_misses = registry.add(Counter("cache_misses_total", "In-process cache misses.", ("cache",)))
+cache_hit_ratio = registry.add(Gauge("cache_hit_ratio", "Hits / (hits + misses) since start.", ("cache",)))
+loop_lag = registry.add(Histogram(
+    "event_loop_lag_seconds", "Delay of a scheduled event-loop wakeup past its deadline.", buckets=LAG_BUCKETS))
+loop_lag_last = registry.add(Gauge("event_loop_lag_last_seconds", "Most recent event-loop lag sample."))
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Export a TTLCache-style stats() dict (hits, stale_hits, misses) as cache metrics."""
+
+    def collect():
+        data = stats()
+        hits = data.get("hits", 0) + data.get("stale_hits", 0)
+        misses = data.get("misses", 0)
+        cache_hits.set(name, value=hits)
+        cache_misses.set(name, value=misses)
+        cache_hit_ratio.set(name, value=hits / (hits + misses) if hits + misses else 0.0)
+
+    registry.add_collector(collect)
+
+
+# --- Per-request timing ---
+class RequestTiming:
+    __slots__ = ("request_id", "eia", "db", "db_queries", "hashing")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.eia = 0.0
+        self.db = 0.0
+        self.db_queries = 0
+        self.hashing = 0.0
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+timing_log = logging.getLogger("oil_tracker.timing")
+if not timing_log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_log.addHandler(_handler)
+    timing_log.setLevel(logging.INFO)
+    timing_log.propagate = False
+
+
+def request_id() -> Optional[str]:
+    timing = current_timing.get()
+    return timing.request_id if timing is not None else None
+
+
+def observe_eia(status: str, seconds: float):
+    eia_latency.observe(status, value=seconds)
+    timing = current_timing.get()
+    if timing is not None:
+        timing.eia += seconds
+
+
+def observe_hash(operation: str, seconds: float):
+    hash_latency.observe(operation, value=seconds)
+    timing = current_timing.get()
+    if timing is not None:
+        timing.hashing += seconds
+
+
+def instrument_engine(engine):
+    """Time every statement on `engine` (sync or the sync_engine of an AsyncEngine)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        db_latency.observe(statement.lstrip()[:6].upper().rstrip(), value=seconds)
+        timing = current_timing.get()
+        if timing is not None:
+            timing.db += seconds
+            timing.db_queries += 1
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Sleep `interval` seconds at a time and record how late each wakeup is."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(value=lag)
+        loop_lag_last.set(value=lag)
+
+
+# --- ASGI middleware ---
+def _route_templates(app) -> Dict[Callable, str]:
+    return {route.endpoint: route.path for route in getattr(app, "routes", ()) if hasattr(route, "endpoint")}
+
+
+class MetricsMiddleware:
+    """Times each HTTP request, labels it with its route template (so /orders?cursor=...
+    is one series) and writes the timing log line. Raw ASGI rather than
+    BaseHTTPMiddleware, so streaming responses (/stream, NDJSON exports) pass
+    straight through; their duration is measured to the end of the body."""
+
+    def __init__(self, app, root_app=None):
+        self.app = app
+        self.root_app = root_app
+        self._templates: Optional[Dict[Callable, str]] = None
+
+    def route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._templates is None or endpoint not in self._templates:
+            self._templates = _route_templates(self.root_app or scope.get("app"))
+            # Remember endpoints that are not app routes too, so they rebuild once
+            self._templates.setdefault(endpoint, "unmatched")
+        return self._templates[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                rid = value.decode("latin-1")[:64]
+                break
+        timing = RequestTiming(rid or uuid.uuid4().hex)
+        token = current_timing.set(timing)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", timing.request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timing.reset(token)
+            elapsed = time.perf_counter() - started
+            route = self.route_label(scope)
+            http_latency.observe(scope["method"], route, str(status_code), value=elapsed)
+            if TIMING_LOG_ENABLED and elapsed * 1000 >= TIMING_LOG_MIN_MS:
+                timing_log.info(orjson.dumps({
+                    "request_id": timing.request_id,
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "eia_ms": round(timing.eia * 1000, 2),
+                    "db_ms": round(timing.db * 1000, 2),
+                    "db_queries": timing.db_queries,
+                    "hash_ms": round(timing.hashing * 1000, 2),
+                }).decode())
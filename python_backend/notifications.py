@@ -0,0 +1,474 @@
+"""
+Alert notifications: a persistent outbox, per-user digests and pluggable delivery channels.
+
+When alerts fire, enqueue() writes one notification_outbox row per
+notification per configured channel (NOTIFY_CHANNELS: 'email', 'webhook').
+Rows are unique per (dedupe_key, channel), so enqueueing the same firing twice
+is a no-op. The table is the queue, so nothing is lost if the process restarts
+between an alert firing and its delivery.
+
+The NotificationDispatcher claims due pending rows in batches. A guarded UPDATE
+moves each claimed row's next_attempt_at NOTIFY_LEASE seconds ahead. Other
+workers and processes then skip those rows, and rows claimed by a worker that
+died are claimed again once the lease runs out. Claimed rows are grouped into
+one digest per (user, channel) and put on a bounded asyncio.Queue, which
+NOTIFY_CONCURRENCY worker tasks drain, so at most that many deliveries are in
+flight. Outcomes are written back in batches: a delivered digest marks its
+rows sent. A failed delivery is retried with exponential backoff, from
+NOTIFY_RETRY_BASE up to NOTIFY_RETRY_MAX seconds. After NOTIFY_MAX_ATTEMPTS
+failures the rows are marked failed with the last error. Delivery is at least
+once.
+
+Channels implement `async send(digest)` and raise on failure. EmailChannel
+speaks SMTP with smtplib on its own thread pool. WebhookChannel POSTs JSON with
+httpx and signs the body with NOTIFY_WEBHOOK_SECRET when it is set. Other
+channels can be added with register_channel().
+
+The long-running server runs the dispatcher in its lifespan. Serverless
+deployments deliver from `python scheduler.py --once`, which calls drain().
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import httpx
+import orjson
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, NotificationOutbox, User
+from metrics import Counter, registry
+from scheduler import backoff_delay
+
+if TYPE_CHECKING:
+    from alert_engine import FiredAlert
+
+NOTIFY_CHANNELS = [name.strip() for name in os.getenv('NOTIFY_CHANNELS', '').split(',') if name.strip()]
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', '20'))
+NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '1000'))
+NOTIFY_POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '10'))
+NOTIFY_LEASE = float(os.getenv('NOTIFY_LEASE', '300'))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '8'))
+NOTIFY_RETRY_BASE = float(os.getenv('NOTIFY_RETRY_BASE', '30'))
+NOTIFY_RETRY_MAX = float(os.getenv('NOTIFY_RETRY_MAX', '3600'))
+NOTIFY_TIMEOUT = float(os.getenv('NOTIFY_TIMEOUT', '10'))
+NOTIFY_FROM = os.getenv('NOTIFY_FROM', 'alerts@localhost')
+NOTIFY_WEBHOOK_URL = os.getenv('NOTIFY_WEBHOOK_URL', '')
+NOTIFY_WEBHOOK_SECRET = os.getenv('NOTIFY_WEBHOOK_SECRET', '')
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '25'))
+SMTP_USER = os.getenv('SMTP_USER', '')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'false').lower() in ['true', '1', 'yes']
+# Rows per INSERT when enqueueing, and ids per UPDATE when recording outcomes
+OUTBOX_WRITE_CHUNK = 1000
+
+notifications_sent = registry.add(Counter(
+    "notifications_sent_total", "Notifications delivered.", ("channel",)))
+notification_failures = registry.add(Counter(
+    "notification_delivery_failures_total", "Digest deliveries that failed (retried or given up).", ("channel",)))
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Digest(NamedTuple):
+    """Every claimed notification for one user on one channel."""
+    channel: str
+    user_id: int
+    email: Optional[str]
+    name: Optional[str]
+    ids: List[int]
+    attempts: int  # the most failed attempts among the rows
+    notifications: List[dict]
+
+    @property
+    def subject(self) -> str:
+        if len(self.notifications) == 1:
+            return self.notifications[0]["title"]
+        return f"{len(self.notifications)} price alerts"
+
+
+# --- Channels ---
+class EmailChannel:
+    """One SMTP message per digest. smtplib blocks, so it runs on a private thread pool."""
+
+    name = "email"
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, sender: str = NOTIFY_FROM,
+                 user: str = SMTP_USER, password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS,
+                 timeout: float = NOTIFY_TIMEOUT, threads: int = NOTIFY_CONCURRENCY):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def message(self, digest: Digest) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = digest.email
+        message["Subject"] = digest.subject
+        greeting = f"Hi {digest.name},\n\n" if digest.name else ""
+        message.set_content(greeting + "\n".join(n["text"] for n in digest.notifications) + "\n")
+        return message
+
+    def _send(self, message: EmailMessage):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+            smtp.send_message(message)
+
+    async def send(self, digest: Digest):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="smtp")
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._send, self.message(digest))
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class WebhookChannel:
+    """POST each digest as JSON to one endpoint, over a pooled keep-alive client."""
+
+    name = "webhook"
+
+    def __init__(self, url: str = NOTIFY_WEBHOOK_URL, secret: str = NOTIFY_WEBHOOK_SECRET,
+                 timeout: float = NOTIFY_TIMEOUT, connections: int = NOTIFY_CONCURRENCY):
+        self.url = url
+        self.secret = secret.encode()
+        self.timeout = timeout
+        self.connections = connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def send(self, digest: Digest):
+        if not self.url:
+            raise RuntimeError("NOTIFY_WEBHOOK_URL is not set")
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(
+                max_connections=self.connections, max_keepalive_connections=self.connections))
+        body = orjson.dumps({"user_id": digest.user_id, "email": digest.email, "ids": digest.ids,
+                             "notifications": digest.notifications})
+        headers = {"content-type": "application/json"}
+        if self.secret:
+            headers["x-signature"] = "sha256=" + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        response = await self._client.post(self.url, content=body, headers=headers)
+        response.raise_for_status()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+CHANNEL_TYPES = {"email": EmailChannel, "webhook": WebhookChannel}
+_channels: Dict[str, object] = {}
+
+
+def register_channel(channel):
+    """Deliver notifications through `channel` (anything with a name, send() and close())."""
+    _channels[channel.name] = channel
+
+
+def get_channels() -> Dict[str, object]:
+    """The registered channels, plus one of each built-in type named in NOTIFY_CHANNELS."""
+    for name in NOTIFY_CHANNELS:
+        if name not in _channels:
+            if name in CHANNEL_TYPES:
+                _channels[name] = CHANNEL_TYPES[name]()
+            else:
+                print(f"Unknown notification channel in NOTIFY_CHANNELS: {name}")
+                _channels[name] = None
+    return {name: channel for name, channel in _channels.items() if channel is not None}
+
+
+# --- Outbox ---
+def alert_notification(alert: "FiredAlert") -> Tuple[int, str, dict]:
+    period = alert.period.isoformat()
+    return alert.user_id, f"alert:{alert.alert_id}:{period}", {
+        "type": "price_alert",
+        "alert_id": alert.alert_id,
+        "product": alert.product,
+        "area": alert.area,
+        "threshold": alert.threshold,
+        "period": period,
+        "price": alert.price,
+        "title": f"{alert.product} at ${alert.price:.3f} in {alert.area}",
+        "text": f"{alert.product} in {alert.area}: ${alert.price:.3f}/gal for the week of {period} "
+                f"(your alert: ${alert.threshold:.3f})",
+    }
+
+
+async def enqueue(db: AsyncSession, notifications: Iterable[Tuple[int, str, dict]],
+                  channels: Optional[Iterable[str]] = None) -> int:
+    """Write (user id, dedupe key, payload) notifications to the outbox and commit.
+
+    Returns how many rows were new; keys already in the outbox are skipped.
+    """
+    names = list(channels if channels is not None else get_channels())
+    if not names:
+        return 0
+    now = utcnow()
+    rows = [
+        {"user_id": user_id, "channel": name, "dedupe_key": key, "payload": orjson.dumps(payload).decode(),
+         "status": "pending", "attempts": 0, "next_attempt_at": now}
+        for user_id, key, payload in notifications for name in names
+    ]
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(NotificationOutbox).on_conflict_do_nothing(index_elements=["dedupe_key", "channel"])
+    added = 0
+    for i in range(0, len(rows), OUTBOX_WRITE_CHUNK):
+        # One cached statement, sent as multi-row INSERTs by SQLAlchemy's insertmanyvalues
+        result = await db.execute(stmt.returning(NotificationOutbox.id), rows[i:i + OUTBOX_WRITE_CHUNK])
+        added += len(result.all())
+    await db.commit()
+    if added:
+        dispatcher.wake()
+    return added
+
+
+async def enqueue_alerts(db: AsyncSession, fired: List["FiredAlert"]) -> int:
+    if not fired:
+        return 0
+    return await enqueue(db, [alert_notification(alert) for alert in fired])
+
+
+# --- Dispatch ---
+class NotificationDispatcher:
+    def __init__(self, channels: Optional[Dict[str, object]] = None, concurrency: int = NOTIFY_CONCURRENCY,
+                 batch_size: int = NOTIFY_BATCH_SIZE, session_factory=AsyncSessionLocal):
+        self._channels = channels
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+        self.queue: Optional[asyncio.Queue] = None
+        self.sent = 0
+        self.failed = 0
+        self._claimer: Optional[asyncio.Task] = None
+        self._workers: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._finished: Optional[asyncio.Event] = None
+        self._sent_ids: List[int] = []
+        self._failures: List[Tuple[Digest, str, bool]] = []
+
+    @property
+    def channels(self) -> Dict[str, object]:
+        return self._channels if self._channels is not None else get_channels()
+
+    @property
+    def running(self) -> bool:
+        return self._claimer is not None and not self._claimer.done()
+
+    def wake(self):
+        """Claim now rather than at the next poll (called after enqueue)."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def claim(self) -> List[Digest]:
+        """Lease every due row of the users owning the oldest batch_size due rows, as digests."""
+        now = utcnow()
+        due = (NotificationOutbox.status == "pending", NotificationOutbox.next_attempt_at <= now)
+        async with self.session_factory() as db:
+            user_ids = set((await db.scalars(
+                select(NotificationOutbox.user_id).where(*due).order_by(NotificationOutbox.id).limit(self.batch_size)
+            )).all())
+            if not user_ids:
+                return []
+            # A row another worker claimed in the meantime no longer passes the guard
+            rows = (await db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.user_id.in_(user_ids), *due)
+                .values(next_attempt_at=now + timedelta(seconds=NOTIFY_LEASE))
+                .returning(NotificationOutbox.id, NotificationOutbox.user_id, NotificationOutbox.channel,
+                           NotificationOutbox.payload, NotificationOutbox.attempts)
+            )).all()
+            await db.commit()
+            result = await db.execute(select(User.id, User.email, User.name).where(User.id.in_(user_ids)))
+            users = {user.id: user for user in result}
+
+        groups: Dict[Tuple[int, str], list] = {}
+        for row in sorted(rows, key=lambda r: r.id):
+            groups.setdefault((row.user_id, row.channel), []).append(row)
+        digests = []
+        for (user_id, channel), group in groups.items():
+            user = users.get(user_id)
+            digests.append(Digest(
+                channel=channel,
+                user_id=user_id,
+                email=user.email if user else None,
+                name=user.name if user else None,
+                ids=[row.id for row in group],
+                attempts=max(row.attempts or 0 for row in group),
+                notifications=[orjson.loads(row.payload) for row in group],
+            ))
+        return digests
+
+    async def deliver(self, digest: Digest) -> bool:
+        channel = self.channels.get(digest.channel)
+        if channel is None or digest.email is None:
+            # Nothing to retry: the channel was removed from config, or the user was deleted
+            reason = "user not found" if channel else f"no '{digest.channel}' channel configured"
+            await self._record_failure(digest, reason, give_up=True)
+            return False
+        try:
+            await channel.send(digest)
+        except Exception as e:
+            notification_failures.inc(digest.channel)
+            await self._record_failure(digest, f"{type(e).__name__}: {e}")
+            return False
+        notifications_sent.inc(digest.channel, amount=len(digest.ids))
+        self.sent += len(digest.ids)
+        self._sent_ids.extend(digest.ids)
+        self._finished.set()
+        return True
+
+    async def _record_failure(self, digest: Digest, error: str, give_up: bool = False):
+        give_up = give_up or digest.attempts + 1 >= NOTIFY_MAX_ATTEMPTS
+        if give_up:
+            self.failed += len(digest.ids)
+            print(f"Giving up on {len(digest.ids)} {digest.channel} notification(s) "
+                  f"for user {digest.user_id}: {error}")
+        self._failures.append((digest, error[:1000], give_up))
+        self._finished.set()
+
+    async def _flush(self):
+        """Write buffered outcomes, one transaction for everything that finished meanwhile."""
+        async with self._flush_lock:
+            ids, self._sent_ids = self._sent_ids, []
+            failures, self._failures = self._failures, []
+            if not ids and not failures:
+                return
+            now = utcnow()
+            try:
+                async with self.session_factory() as db:
+                    for i in range(0, len(ids), OUTBOX_WRITE_CHUNK):
+                        await db.execute(
+                            update(NotificationOutbox)
+                            .where(NotificationOutbox.id.in_(ids[i:i + OUTBOX_WRITE_CHUNK]))
+                            .values(status="sent", sent_at=now, attempts=NotificationOutbox.attempts + 1,
+                                    last_error=None)
+                        )
+                    for digest, error, give_up in failures:
+                        delay = backoff_delay(digest.attempts + 1, NOTIFY_RETRY_BASE, NOTIFY_RETRY_MAX)
+                        await db.execute(
+                            update(NotificationOutbox)
+                            .where(NotificationOutbox.id.in_(digest.ids))
+                            .values(status="failed" if give_up else "pending",
+                                    next_attempt_at=now + timedelta(seconds=delay),
+                                    attempts=NotificationOutbox.attempts + 1, last_error=error)
+                        )
+                    await db.commit()
+            except Exception as e:
+                # The rows stay leased and are delivered again once the lease runs out
+                print(f"Recording notification outcomes failed: {e}")
+
+    async def _flush_loop(self):
+        # Workers only buffer outcomes, so they never wait on the database
+        while True:
+            await self._finished.wait()
+            self._finished.clear()
+            await self._flush()
+
+    async def _work(self):
+        while True:
+            digest = await self.queue.get()
+            try:
+                await self.deliver(digest)
+            except Exception as e:
+                print(f"Notification delivery to user {digest.user_id} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _claim_loop(self):
+        while True:
+            self._wake.clear()
+            try:
+                digests = await self.claim()
+            except Exception as e:
+                print(f"Claiming notifications failed: {e}")
+                digests = []
+            for digest in digests:
+                await self.queue.put(digest)
+            if sum(len(digest.ids) for digest in digests) < self.batch_size:
+                # Caught up: sleep until enqueue() wakes us, or retries come due
+                try:
+                    await asyncio.wait_for(self._wake.wait(), NOTIFY_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _start_workers(self):
+        self.queue = asyncio.Queue(self.concurrency * 2)
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._finished = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def _stop_workers(self, timeout: float = NOTIFY_TIMEOUT):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Waits for a flush in progress, then writes the rest
+        await self._flush()
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        for channel in self.channels.values():
+            await channel.close()
+
+    def start(self):
+        """Deliver in the background until stop(); rows left from before a restart are picked up first."""
+        if self.running:
+            return
+        self._start_workers()
+        self._claimer = asyncio.create_task(self._claim_loop())
+
+    async def stop(self):
+        if self._claimer is None:
+            return
+        self._claimer.cancel()
+        await asyncio.gather(self._claimer, return_exceptions=True)
+        self._claimer = None
+        await self._stop_workers()
+
+    async def drain(self) -> int:
+        """Deliver every notification that is due now, then return how many were sent (for cron)."""
+        sent = self.sent
+        self._start_workers()
+        try:
+            while digests := await self.claim():
+                for digest in digests:
+                    await self.queue.put(digest)
+        finally:
+            await self._stop_workers(timeout=None)
+        return self.sent - sent
+
+    def stats(self) -> dict:
+        return {"running": self.running, "channels": sorted(self.channels), "sent": self.sent,
+                "failed": self.failed, "queued": self.queue.qsize() if self.queue is not None else 0}
+
+
+dispatcher = NotificationDispatcher()
@@ -0,0 +1,228 @@
+"""
+Order matching: complete pending orders when the market reaches their target.
+
+A pending Order is a buy at or below target_price. Pending orders are held in
+memory in one OrderBook per (product, area): (target price, order id) pairs
+sorted ascending. Every order a price p crosses has target >= p, so they are
+the tail of the book. One bisect finds them and one slice removes
+them, which is O(log n + k) per observation. Placing an order inserts it by
+bisect, and cancelling removes it the same way.
+
+After each weekly ingest the new observations are applied in period order, so
+an order fills at the first period that crosses it. The fills are written by
+UPDATE ... WHERE id IN (...) AND status = 'pending' in one transaction.
+
+Books are loaded from the database on the first match, not at startup. Before
+each match, orders placed by other workers are picked up by id watermark. The
+books are rebuilt in full every ORDER_BOOK_REBUILD_INTERVAL seconds, to catch
+orders whose inserts committed out of id order. The status guard on the UPDATE
+means an order cancelled by another worker is never completed; its stale book
+entry is simply dropped.
+"""
+import os
+import time
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Order, PriceObservation
+from price_store import PRODUCT_CODES
+
+# Orders match against the weekly series, like alerts
+ORDER_MATCH_FREQUENCY = "weekly"
+# Rows fetched per round trip when loading pending orders
+ORDER_LOAD_CHUNK = 50000
+# Order ids per UPDATE statement
+ORDER_UPDATE_CHUNK = int(os.getenv('ORDER_UPDATE_CHUNK', '5000'))
+ORDER_BOOK_REBUILD_INTERVAL = float(os.getenv('ORDER_BOOK_REBUILD_INTERVAL', '86400'))
+
+BookKey = Tuple[str, str]
+
+
+class Fill(NamedTuple):
+    order_id: int
+    product: str
+    area: str
+    period: date
+    price: float
+
+
+def book_key(product: str, area: str) -> BookKey:
+    return product, area.strip().lower()
+
+
+class OrderBook:
+    """Pending orders for one (product, area) as (target, order id), sorted."""
+
+    __slots__ = ("entries",)
+
+    def __init__(self, entries: Optional[List[Tuple[float, int]]] = None):
+        self.entries = entries if entries is not None else []
+
+    @classmethod
+    def build(cls, pairs: Iterable[Tuple[float, int]]) -> "OrderBook":
+        """Book from (target, order id) pairs in any order."""
+        return cls(sorted(pairs))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, order_id: int, target: float):
+        insort(self.entries, (target, order_id))
+
+    def remove(self, order_id: int, target: float) -> bool:
+        entry = (target, order_id)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+            return True
+        return False
+
+    def take_crossed(self, price: float) -> List[int]:
+        """Remove and return every order with target >= price."""
+        # (price,) sorts before every (price, id), so i is the first target >= price
+        i = bisect_left(self.entries, (price,))
+        if i == len(self.entries):
+            return []
+        crossed = [order_id for _, order_id in self.entries[i:]]
+        del self.entries[i:]
+        return crossed
+
+
+class OrderBooks:
+    """All books in this process, plus the bookkeeping to keep them in step with the DB."""
+
+    def __init__(self, rebuild_interval: float = ORDER_BOOK_REBUILD_INTERVAL):
+        self.rebuild_interval = rebuild_interval
+        self.books: Dict[BookKey, OrderBook] = {}
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.max_id = 0
+        self.filled = 0
+
+    def __len__(self):
+        return sum(len(book) for book in self.books.values())
+
+    def add(self, order_id: int, product: str, area: str, target: float):
+        # Before the first load there is nothing to keep in step; the load reads it
+        if not self.loaded:
+            return
+        key = book_key(product, area)
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = OrderBook()
+        book.add(order_id, target)
+        self.max_id = max(self.max_id, order_id)
+
+    def remove(self, order_id: int, product: str, area: str, target: float) -> bool:
+        book = self.books.get(book_key(product, area))
+        return book is not None and book.remove(order_id, target)
+
+    def match(self, product: str, area_keys: Iterable[str], price: float) -> List[int]:
+        """Take every order in the (product, area) books that `price` crosses."""
+        crossed: List[int] = []
+        for area in set(area_keys):
+            book = self.books.get((product, area))
+            if book:
+                crossed.extend(book.take_crossed(price))
+        return crossed
+
+    async def load(self, db: AsyncSession, after_id: int = 0) -> int:
+        """Read pending orders with id > after_id; after_id=0 rebuilds every book."""
+        stmt = select(Order.id, Order.product, Order.area, Order.target_price).where(
+            Order.status == "pending", Order.id > after_id)
+        pairs: Dict[BookKey, List[Tuple[float, int]]] = {}
+        count = 0
+        result = await db.stream(stmt.execution_options(yield_per=ORDER_LOAD_CHUNK))
+        async for order_id, product, area, target in result:
+            pairs.setdefault(book_key(product, area), []).append((target, order_id))
+            self.max_id = max(self.max_id, order_id)
+            count += 1
+        if after_id == 0:
+            self.books = {key: OrderBook.build(rows) for key, rows in pairs.items()}
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+        else:
+            for (product, area), rows in pairs.items():
+                for target, order_id in rows:
+                    self.add(order_id, product, area, target)
+        return count
+
+    async def refresh(self, db: AsyncSession):
+        if not self.loaded or time.monotonic() - self.loaded_at > self.rebuild_interval:
+            self.max_id = 0
+            await self.load(db)
+        else:
+            await self.load(db, after_id=self.max_id)
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded, "books": len(self.books), "pending": len(self), "filled": self.filled}
+
+
+order_books = OrderBooks()
+
+
+async def complete_orders(db: AsyncSession, order_ids: List[int]) -> set:
+    """Mark still-pending orders completed in one transaction; returns the ids updated."""
+    completed = set()
+    for i in range(0, len(order_ids), ORDER_UPDATE_CHUNK):
+        stmt = update(Order).where(
+            Order.id.in_(order_ids[i:i + ORDER_UPDATE_CHUNK]), Order.status == "pending"
+        ).values(status="completed").returning(Order.id)
+        completed.update((await db.scalars(stmt)).all())
+    await db.commit()
+    return completed
+
+
+async def match_orders(db: AsyncSession, since: date, books: OrderBooks = order_books) -> List[Fill]:
+    """Fill pending orders against weekly observations from `since` on; returns the fills written."""
+    labels = {code: product for product, code in PRODUCT_CODES.items()}
+    stmt = select(
+        PriceObservation.product, PriceObservation.area_code, PriceObservation.area_name,
+        PriceObservation.period, PriceObservation.value,
+    ).where(
+        PriceObservation.frequency == ORDER_MATCH_FREQUENCY,
+        PriceObservation.product.in_(list(labels)),
+        PriceObservation.period >= since,
+    ).order_by(PriceObservation.period)
+    observations = (await db.execute(stmt)).all()
+    if not observations:
+        return []
+    await books.refresh(db)
+    fills: List[Fill] = []
+    for product_code, area_code, area_name, period, value in observations:
+        product = labels[product_code]
+        for order_id in books.match(product, (area_code.lower(), area_name.strip().lower()), value):
+            fills.append(Fill(order_id, product, area_name, period, value))
+    try:
+        completed = await complete_orders(db, [fill.order_id for fill in fills])
+    except Exception:
+        # The fills were already taken out of the books; reload them next time
+        books.loaded = False
+        raise
+    books.filled += len(completed)
+    return [fill for fill in fills if fill.order_id in completed]
+
+
+async def match_after_ingest(db: AsyncSession, frequency: str, result) -> List[Fill]:
+    """IngestScheduler listener: fill orders against the periods just ingested.
+
+    Only periods after the previous watermark count (or the latest period on
+    the first, backfilling sync), so an order is never filled at a price from
+    before it was placed.
+    """
+    if frequency != ORDER_MATCH_FREQUENCY:
+        return []
+    if result.watermark is not None:
+        since = result.watermark + timedelta(days=1)
+    elif result.upstream_latest is not None:
+        since = result.upstream_latest
+    else:
+        return []
+    fills = await match_orders(db, since)
+    if fills:
+        print(f"{len(fills)} order(s) filled for periods since {since.isoformat()}")
+    return fills
@@ -0,0 +1,105 @@
+"""
+Keyset pagination and NDJSON streaming for per-user list endpoints.
+
+Lists are ordered newest first on (created_at, id). Each page hands back an
+opaque cursor naming its last row, and the next page resumes strictly after
+that row's (created_at, id), so a page costs an index range scan however deep
+the client has paged. The cursor row's timestamp is looked up in SQL rather
+than round-tripped through the client, so the comparison always uses the
+column's stored representation.
+"""
+import base64
+import os
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '100'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '500'))
+STREAM_BATCH_SIZE = 500
+
+_list_adapters: Dict[Type[BaseModel], TypeAdapter] = {}
+
+
+def encode_cursor(row_id: int) -> str:
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def newest_first(stmt, model, user_id: int, cursor: Optional[str] = None):
+    """Order `stmt` by (created_at, id) descending, starting after `cursor`.
+
+    The cursor row is only looked up among `user_id`'s rows, so a cursor naming
+    another user's row matches nothing instead of revealing its position.
+    """
+    if cursor:
+        after_id = decode_cursor(cursor)
+        anchor = select(model.created_at).where(
+            model.id == after_id, model.user_id == user_id
+        ).scalar_subquery()
+        stmt = stmt.where(or_(
+            model.created_at < anchor,
+            and_(model.created_at == anchor, model.id < after_id),
+        ))
+    return stmt.order_by(model.created_at.desc(), model.id.desc())
+
+
+async def fetch_page(db: AsyncSession, stmt, model, user_id: int, cursor: Optional[str],
+                     limit: int) -> Tuple[List, Optional[str]]:
+    """One page of rows and the cursor for the next page (None on the last page)."""
+    rows = (await db.execute(newest_first(stmt, model, user_id, cursor).limit(limit + 1))).scalars().all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1].id)
+    return rows, None
+
+
+def set_page_headers(request: Request, response: Response, next_cursor: Optional[str]):
+    # Bodies stay plain JSON arrays; the next-page cursor travels in headers
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+
+def page_response(request: Request, schema: Type[BaseModel], items: List[BaseModel], next_cursor: Optional[str]) -> Response:
+    """A page as a JSON array, serialized by pydantic-core in one pass.
+
+    Returning a Response skips FastAPI's re-validation against response_model
+    and its jsonable_encoder walk, which dominate CPU for large pages; the
+    route's response_model still documents the shape.
+    """
+    adapter = _list_adapters.get(schema)
+    if adapter is None:
+        adapter = _list_adapters[schema] = TypeAdapter(List[schema])
+    response = Response(content=adapter.dump_json(items), media_type="application/json")
+    set_page_headers(request, response, next_cursor)
+    return response
+
+
+def ndjson_response(stmt, model, user_id: int, cursor: Optional[str],
+                    serialize: Callable[[object], BaseModel]) -> StreamingResponse:
+    """Stream every row from `cursor` onward as newline-delimited JSON.
+
+    Uses its own session so the export is not tied to the request's session
+    lifetime, and fetches in batches so memory stays flat for large accounts.
+    """
+    stmt = newest_first(stmt, model, user_id, cursor).execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    async def body():
+        async with AsyncSessionLocal() as db:
+            result = await db.stream_scalars(stmt)
+            async for batch in result.partitions():
+                yield "".join(serialize(row).model_dump_json() + "\n" for row in batch).encode()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
@@ -0,0 +1,86 @@
+"""
+Password hashing off the event loop.
+
+Argon2 and bcrypt take tens to hundreds of milliseconds of CPU per call.
+Both release the GIL while hashing, so they run in a small dedicated thread
+pool instead of blocking uvicorn's event loop. A semaphore bounds how many
+hashes may be running or queued; beyond that, callers wait briefly and then
+get a 503 rather than piling up unbounded work during a login storm.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from metrics import observe_hash
+
+# --- Config ---
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hashes allowed to wait for a worker before new requests are turned away
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '32'))
+PASSWORD_HASH_WAIT = float(os.getenv('PASSWORD_HASH_WAIT', '5'))
+# Cost parameters for new hashes; existing hashes verify with their own parameters
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', '65536'))  # KiB
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', '4'))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+_pwd_context = None
+
+
+def get_pwd_context():
+    """The CryptContext, built (and passlib imported) on first use."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+
+        _pwd_context = CryptContext(
+            schemes=["argon2", "bcrypt"],
+            deprecated="auto",
+            argon2__time_cost=ARGON2_TIME_COST,
+            argon2__memory_cost=ARGON2_MEMORY_COST,
+            argon2__parallelism=ARGON2_PARALLELISM,
+            bcrypt__rounds=BCRYPT_ROUNDS,
+        )
+    return _pwd_context
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_slots() -> asyncio.Semaphore:
+    # asyncio primitives belong to one loop; rebuild if Mangum hands us a new one
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+        _slots_loop = loop
+    return _slots
+
+
+async def run_in_hash_pool(fn: Callable[..., T], *args) -> T:
+    slots = _get_slots()
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=PASSWORD_HASH_WAIT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many sign-in requests. Please try again shortly.")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        slots.release()
+        observe_hash(fn.__name__, time.perf_counter() - started)
+
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    return await run_in_hash_pool(get_pwd_context().verify, plain, hashed)
+
+
+async def get_password_hash(password: str) -> str:
+    return await run_in_hash_pool(get_pwd_context().hash, password)
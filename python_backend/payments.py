@@ -0,0 +1,108 @@
+"""
+Stripe payment intents, created off the event loop and at most once per user and order.
+
+stripe-python (7.x) is synchronous. Calling it inside an async handler would
+stall the event loop for every request during each Stripe round trip, so
+calls run on a dedicated pool of STRIPE_MAX_CONCURRENCY threads instead. The
+library's requests-based HTTP client keeps one Session per thread, so the
+pool's threads reuse their keep-alive connections to the Stripe API.
+
+When the request names an order or carries an Idempotency-Key header, the
+intent is created with an idempotency key derived from the user, that order
+or header, and the amount. A retried request is then answered in one of
+three ways:
+- Concurrent duplicates share one in-flight call.
+- Repeats within PAYMENT_INTENT_CACHE_TTL are answered from an in-process
+  cache, without another upstream call.
+- Anything else reaches Stripe with the same key, and Stripe returns the
+  original intent. That covers other workers and repeats after the cache
+  entry expires, because Stripe keeps keys for 24 hours.
+The library's own network retries (STRIPE_MAX_NETWORK_RETRIES) send the same
+key, so they are safe too. Without an order or header there is nothing to
+tell a retry from a second payment, so each such request creates a new intent.
+"""
+import asyncio
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from cache import SingleFlight, TTLCache
+
+STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', 'sk_test')
+# Point at a local stub in development and benchmarks (default: api.stripe.com)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')
+STRIPE_MAX_CONCURRENCY = int(os.getenv('STRIPE_MAX_CONCURRENCY', '16'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', '30'))
+PAYMENT_INTENT_CACHE_TTL = float(os.getenv('PAYMENT_INTENT_CACHE_TTL', '600'))
+PAYMENT_INTENT_CACHE_MAX_ENTRIES = int(os.getenv('PAYMENT_INTENT_CACHE_MAX_ENTRIES', '10000'))
+
+intent_cache = TTLCache(maxsize=PAYMENT_INTENT_CACHE_MAX_ENTRIES, ttl=PAYMENT_INTENT_CACHE_TTL)
+intent_flight = SingleFlight()
+
+# Imported and configured on first use, like the other heavy dependencies (see main.py)
+_stripe = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_stripe():
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = STRIPE_SECRET_KEY
+        if STRIPE_API_BASE:
+            stripe.api_base = STRIPE_API_BASE
+        stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+        stripe.default_http_client = stripe.http_client.RequestsClient(timeout=STRIPE_TIMEOUT)
+        _stripe = stripe
+    return _stripe
+
+
+async def run_stripe(fn, *args, **kwargs):
+    """Run a blocking stripe-python call on the Stripe thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(STRIPE_MAX_CONCURRENCY, thread_name_prefix="stripe")
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def close_stripe():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def idempotency_key(user_id: int, amount: int, order_id: Optional[int] = None,
+                    client_key: Optional[str] = None) -> Optional[str]:
+    """Key for this user's intent for the order or client key, or None if neither is given."""
+    if order_id is not None:
+        scope = f"order:{order_id}"
+    elif client_key:
+        scope = f"client:{client_key}"
+    else:
+        return None
+    digest = hashlib.sha256(f"{user_id}:{scope}:{amount}:usd".encode()).hexdigest()
+    return f"pi-{user_id}-{digest[:40]}"
+
+
+async def create_intent(user_id: int, email: str, amount: int, order_id: Optional[int] = None,
+                        client_key: Optional[str] = None) -> dict:
+    """Return {'id', 'client_secret'} of the intent for this user, order and amount."""
+    key = idempotency_key(user_id, amount, order_id, client_key)
+    metadata = {'user_id': str(user_id), 'user_email': email}
+    if order_id is not None:
+        metadata['order_id'] = str(order_id)
+
+    async def create() -> dict:
+        stripe = get_stripe()
+        options = {'idempotency_key': key} if key else {}
+        intent = await run_stripe(stripe.PaymentIntent.create, amount=amount, currency='usd',
+                                  metadata=metadata, **options)
+        return {"id": intent.id, "client_secret": intent.client_secret}
+
+    if key is None:
+        return await create()
+    return await intent_cache.get_or_fetch(key, lambda: intent_flight.do(key, create))
@@ -0,0 +1,210 @@
+"""
+Local price-history store backed by the price_observations table.
+
+Rows are kept in the same shape EIA returns them in so endpoints can answer
+from the database without the client noticing the difference.
+"""
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import PriceObservation
+from regions import codes_by_region, normalize_region
+
+# Keep multi-row INSERTs well under SQLite's bound-parameter limit
+UPSERT_CHUNK_SIZE = 1000
+# The EIA series that stands for each product the app exposes
+PRODUCT_CODES = {"Diesel": "EPD2D", "Gasoline": "EPMR"}
+
+# Frequencies already known to have stored rows; the store never empties
+_populated: set = set()
+# Region -> stored area codes; rebuilt lazily after each ingest
+_region_codes: Optional[dict] = None
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards in user input (use with escape="\\")."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def area_matches(area: str):
+    """Area code or name, exactly and ignoring case (as filter_rows does)."""
+    return or_(PriceObservation.area_code == area.upper(),
+               func.lower(PriceObservation.area_name) == area.strip().lower())
+
+
+def parse_observations(rows: Iterable[dict], frequency: str) -> List[dict]:
+    """Convert EIA data rows into PriceObservation column dicts, skipping unusable rows."""
+    observations = []
+    for row in rows:
+        try:
+            period = date.fromisoformat(row["period"])
+            value = float(row["value"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        observations.append({
+            "series": row.get("series") or f"{row.get('product', '')}_{row.get('duoarea', '')}",
+            "frequency": frequency,
+            "area_code": row.get("duoarea", ""),
+            "area_name": row.get("area-name", ""),
+            "product": row.get("product", ""),
+            "product_name": row.get("product-name", ""),
+            "period": period,
+            "value": value,
+        })
+    return observations
+
+
+def observation_row(obs: PriceObservation) -> dict:
+    """Render a stored observation in EIA's row format."""
+    return {
+        "period": obs.period.isoformat(),
+        "duoarea": obs.area_code,
+        "area-name": obs.area_name,
+        "product": obs.product,
+        "product-name": obs.product_name,
+        "series": obs.series,
+        "value": obs.value,
+    }
+
+
+async def latest_period(db: AsyncSession, frequency: str) -> Optional[date]:
+    stmt = select(func.max(PriceObservation.period)).where(PriceObservation.frequency == frequency)
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def upsert_observations(db: AsyncSession, observations: List[dict]) -> int:
+    """
+    Insert or update observations on (series, frequency, period). Caller commits.
+
+    Returns the number of rows inserted or changed; re-sent rows that match
+    what is stored are left alone and not counted.
+    """
+    if not observations:
+        return 0
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    written = 0
+    for i in range(0, len(observations), UPSERT_CHUNK_SIZE):
+        stmt = insert(PriceObservation).values(observations[i:i + UPSERT_CHUNK_SIZE])
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["series", "frequency", "period"],
+            set_={"value": excluded.value, "area_name": excluded.area_name,
+                  "product_name": excluded.product_name},
+            where=or_(PriceObservation.value.is_distinct_from(excluded.value),
+                      PriceObservation.area_name.is_distinct_from(excluded.area_name),
+                      PriceObservation.product_name.is_distinct_from(excluded.product_name)),
+        ).returning(PriceObservation.id)
+        written += len((await db.execute(stmt)).all())
+    global _region_codes
+    _populated.add(observations[0]["frequency"])
+    if written:
+        _region_codes = None
+    return written
+
+
+async def has_observations(db: AsyncSession, frequency: str) -> bool:
+    if frequency in _populated:
+        return True
+    stmt = select(PriceObservation.id).where(PriceObservation.frequency == frequency).limit(1)
+    if (await db.execute(stmt)).first() is not None:
+        _populated.add(frequency)
+        return True
+    return False
+
+
+async def region_area_codes(db: AsyncSession, region: str) -> List[str]:
+    """Stored area codes belonging to `region`."""
+    global _region_codes
+    if _region_codes is None:
+        stmt = select(PriceObservation.area_code, PriceObservation.area_name).distinct()
+        _region_codes = codes_by_region((await db.execute(stmt)).all())
+    return _region_codes.get(region, [])
+
+
+async def query_observations(
+    db: AsyncSession,
+    frequency: str = "weekly",
+    product: Optional[str] = None,
+    area: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 1000,
+    region: Optional[str] = None,
+) -> List[dict]:
+    """Newest-first stored rows, filtered by product (code or name), area (code or name),
+    dashboard region and date range."""
+    stmt = select(PriceObservation).where(PriceObservation.frequency == frequency)
+    region = normalize_region(region)
+    if region:
+        codes = await region_area_codes(db, region)
+        if not codes:
+            return []
+        stmt = stmt.where(PriceObservation.area_code.in_(codes))
+    if product:
+        stmt = stmt.where(or_(PriceObservation.product == product,
+                              PriceObservation.product_name.ilike(f"%{escape_like(product)}%", escape="\\")))
+    if area:
+        stmt = stmt.where(area_matches(area))
+    if start:
+        stmt = stmt.where(PriceObservation.period >= start)
+    if end:
+        stmt = stmt.where(PriceObservation.period <= end)
+    stmt = stmt.order_by(PriceObservation.period.desc(), PriceObservation.id).limit(limit)
+    result = await db.execute(stmt)
+    return [observation_row(obs) for obs in result.scalars().all()]
+
+
+async def query_series(
+    db: AsyncSession,
+    frequency: str,
+    product_code: str,
+    area: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> Tuple[List[date], List[float]]:
+    """Oldest-first (periods, values) of one product in one area (code or name)."""
+    stmt = select(PriceObservation.period, PriceObservation.value).where(
+        PriceObservation.frequency == frequency,
+        PriceObservation.product == product_code,
+        area_matches(area),
+    )
+    if start:
+        stmt = stmt.where(PriceObservation.period >= start)
+    if end:
+        stmt = stmt.where(PriceObservation.period <= end)
+    rows = (await db.execute(stmt.order_by(PriceObservation.period))).all()
+    return [row.period for row in rows], [row.value for row in rows]
+
+
+def filter_rows(
+    rows: List[dict],
+    product: Optional[str] = None,
+    area: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> List[dict]:
+    """Apply query_observations' filters to raw EIA rows."""
+    product_lower = product.lower() if product else None
+    area_lower = area.lower() if area else None
+    start_iso = start.isoformat() if start else None
+    end_iso = end.isoformat() if end else None
+    filtered = []
+    for row in rows:
+        if product_lower and not (row.get("product") == product or
+                                  product_lower in row.get("product-name", "").lower()):
+            continue
+        if area_lower and not (row.get("duoarea", "").lower() == area_lower or
+                               row.get("area-name", "").lower() == area_lower):
+            continue
+        period = row.get("period", "")
+        if start_iso and period < start_iso:
+            continue
+        if end_iso and period > end_iso:
+            continue
+        filtered.append(row)
+    return filtered
@@ -0,0 +1,195 @@
+"""
+Real-time push of new price observations and fired alerts over Server-Sent Events.
+
+The ingest scheduler is the only producer: after each sync that wrote rows,
+its listener publishes the new observations and any alerts they fired to an
+in-process BroadcastHub. The hub serializes each event once and fans the
+bytes out to per-client bounded queues, indexed by (product, region) so a
+publish only touches matching subscribers. A client whose queue is full is
+dropped rather than allowed to back up the producer or grow memory; it gets a
+final 'dropped' event and can reconnect (and re-fetch /prices) when it is
+ready.
+
+Push requires the long-running server (the scheduler does not run under
+SERVERLESS), and one hub serves one process.
+"""
+import asyncio
+import os
+from datetime import timedelta
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from price_store import query_observations
+from regions import PRODUCT_LABELS, area_regions, normalize_region, product_keys
+
+if TYPE_CHECKING:
+    from alert_engine import FiredAlert
+
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '256'))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', '10000'))
+# Most observation rows pushed for one sync
+STREAM_MAX_ROWS = 5000
+
+FilterKey = Tuple[Optional[str], Optional[str]]
+
+
+def sse_message(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+class Subscription:
+    """One connected client: its hub, filters and bounded outgoing queue."""
+
+    __slots__ = ("hub", "product", "region", "user_id", "queue", "dropped")
+
+    def __init__(self, hub: "BroadcastHub", product: Optional[str], region: Optional[str],
+                 user_id: Optional[int], maxsize: int):
+        self.hub = hub
+        self.product = product
+        self.region = region
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+
+class BroadcastHub:
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._by_filter: Dict[FilterKey, Set[Subscription]] = {}
+        self._by_user: Dict[int, Set[Subscription]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(subs) for subs in self._by_filter.values())
+
+    def subscribe(self, product: Optional[str] = None, region: Optional[str] = None,
+                  user_id: Optional[int] = None) -> Subscription:
+        """Register a client. `product` is a label or EIA code, `region` a dashboard
+        region ('National' or None for all); alerts go to `user_id` only."""
+        if product:
+            product = PRODUCT_LABELS.get(product.lower(), product)
+        sub = Subscription(self, product or None, normalize_region(region), user_id, self.queue_size)
+        self._by_filter.setdefault((sub.product, sub.region), set()).add(sub)
+        if user_id is not None:
+            self._by_user.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        for index, key in ((self._by_filter, (sub.product, sub.region)), (self._by_user, sub.user_id)):
+            subs = index.get(key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del index[key]
+
+    def _deliver(self, subs: Iterable[Subscription], message: bytes):
+        for sub in list(subs):
+            try:
+                sub.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: Subscription):
+        # Free the backlog and leave only the end-of-stream marker for the reader
+        self.unsubscribe(sub)
+        sub.dropped = True
+        self.dropped += 1
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def publish_price(self, row: dict):
+        """Push one EIA-shaped observation row to every subscriber whose filters match."""
+        products = (None,) + product_keys(row)
+        regions = (None,) + tuple(area_regions(row.get("duoarea", ""), row.get("area-name", "")))
+        message = sse_message("price", row)
+        self.published += 1
+        for product in products:
+            for region in regions:
+                subs = self._by_filter.get((product, region))
+                if subs:
+                    self._deliver(subs, message)
+
+    def publish_alert(self, fired: "FiredAlert"):
+        """Push a fired alert to its owner's connections."""
+        subs = self._by_user.get(fired.user_id)
+        self.published += 1
+        if subs:
+            data = {**fired._asdict(), "period": fired.period.isoformat()}
+            self._deliver(subs, sse_message("alert", data))
+
+    def close(self):
+        """End every stream (shutdown)."""
+        for subs in list(self._by_filter.values()):
+            for sub in list(subs):
+                self.unsubscribe(sub)
+                if sub.queue.full():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+hub = BroadcastHub()
+
+
+async def stream_events(sub: Subscription, heartbeat: float = STREAM_HEARTBEAT) -> AsyncIterator[bytes]:
+    """SSE body for one subscription; ends when the client is dropped or the hub closes."""
+    try:
+        yield b"retry: 5000\n\n"
+        while True:
+            try:
+                # Drain a backlog without the task wait_for wraps every get in
+                message = sub.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                try:
+                    message = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+            if message is None:
+                if sub.dropped:
+                    yield sse_message("dropped", {"reason": "slow consumer"})
+                return
+            yield message
+    finally:
+        sub.hub.unsubscribe(sub)
+
+
+async def new_observations(db: AsyncSession, frequency: str, result) -> List[dict]:
+    """Rows written by this sync: periods after the previous watermark, or only the
+    latest period on the first (backfill) sync."""
+    if result.watermark is not None:
+        start = result.watermark + timedelta(days=1)
+    elif result.upstream_latest is not None:
+        start = result.upstream_latest
+    else:
+        return []
+    return await query_observations(db, frequency, start=start, limit=STREAM_MAX_ROWS)
+
+
+async def evaluate_and_push(db: AsyncSession, frequency: str, result) -> List["FiredAlert"]:
+    """IngestScheduler listener: evaluate alerts, then push new prices and fired alerts."""
+    # Imported here so NumPy stays out of the serverless cold start
+    from alert_engine import evaluate_after_ingest
+
+    fired = await evaluate_after_ingest(db, frequency, result)
+    if hub.subscribers:
+        for row in reversed(await new_observations(db, frequency, result)):
+            hub.publish_price(row)
+        for alert in fired:
+            hub.publish_alert(alert)
+    return fired
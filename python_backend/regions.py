@@ -0,0 +1,138 @@
+"""
+Region and product lookup for EIA price rows.
+
+Each distinct EIA area (duoarea code + area name) is resolved to the
+dashboard regions it belongs to once and memoized. Payloads are then bucketed
+once into a RegionIndex so every /prices filter is a dict lookup instead of a
+scan with string matching per row.
+"""
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from cache import TTLCache
+
+NATIONAL = "national"
+
+# EIA duoarea codes per dashboard region
+REGION_AREA_CODES: Dict[str, FrozenSet[str]] = {
+    "east coast": frozenset({"R10", "R1X", "R1Y", "R1Z", "SFL", "SMA", "SNY", "Y35NY", "YBOS", "YMIA"}),
+    "midwest": frozenset({"R20", "SMN", "SOH", "YCLE", "YORD"}),
+    "southeast": frozenset({"R30", "SFL", "YMIA"}),
+    "texas": frozenset({"R30", "STX", "Y44HO"}),
+    "california": frozenset({"R50", "SCA", "Y05LA", "Y05SF"}),
+    "west coast": frozenset({"R50", "SCA", "SWA", "Y05LA", "Y05SF", "Y48SE"}),
+    "rocky mountain": frozenset({"R40", "SCO", "YDEN"}),
+}
+
+# Area-name phrases per region, for areas not in the code table (whole-word match)
+REGION_AREA_NAMES: Dict[str, Tuple[str, ...]] = {
+    "east coast": ("east coast", "padd 1", "padd 1a", "padd 1b", "padd 1c", "new england",
+                   "central atlantic", "lower atlantic"),
+    "midwest": ("midwest", "padd 2", "great lakes", "northern plains"),
+    "southeast": ("gulf coast", "padd 3", "southeast", "south"),
+    "texas": ("texas", "gulf coast", "padd 3"),
+    "california": ("california", "west coast", "padd 5"),
+    "west coast": ("west coast", "padd 5", "california", "washington", "oregon"),
+    "rocky mountain": ("rocky mountain", "padd 4", "colorado", "utah", "wyoming"),
+}
+
+# East Coast state abbreviations, which some EIA rows use as the area
+EAST_COAST_STATES = frozenset({
+    "CT", "DE", "FL", "GA", "ME", "MD", "MA", "NH", "NJ", "NY", "NC", "PA", "RI", "SC", "VT", "VA"
+})
+
+REGIONS = tuple(REGION_AREA_CODES)
+PRODUCT_LABELS = {"diesel": "Diesel", "gasoline": "Gasoline"}
+
+_NAME_PATTERNS = {
+    region: re.compile(r"\b(" + "|".join(re.escape(name) for name in names) + r")\b")
+    for region, names in REGION_AREA_NAMES.items()
+}
+_area_regions: Dict[Tuple[str, str], FrozenSet[str]] = {}
+
+
+def normalize_region(region: Optional[str]) -> Optional[str]:
+    """Lower-cased region key, or None for no region filter ('National' or empty)."""
+    if not region:
+        return None
+    key = region.strip().lower()
+    return None if key == NATIONAL else key
+
+
+def area_regions(area_code: str, area_name: str) -> FrozenSet[str]:
+    """Regions an EIA area belongs to (memoized per distinct area)."""
+    key = (area_code, area_name)
+    regions = _area_regions.get(key)
+    if regions is None:
+        code = area_code.upper()
+        name = area_name.lower()
+        regions = frozenset(
+            region for region in REGIONS
+            if code in REGION_AREA_CODES[region] or _NAME_PATTERNS[region].search(name)
+        )
+        if code in EAST_COAST_STATES or area_name.upper() in EAST_COAST_STATES:
+            regions = regions | {"east coast"}
+        _area_regions[key] = regions
+    return regions
+
+
+def product_keys(row: dict) -> Tuple[str, ...]:
+    """Keys a row can be filtered by: its EIA product code and app product label."""
+    code = row.get("product", "")
+    name = row.get("product-name", "").lower()
+    if "diesel" in name:
+        return (code, "Diesel")
+    if "gasoline" in name:
+        return (code, "Gasoline")
+    return (code,)
+
+
+def codes_by_region(areas: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """Map each region to the area codes (from `areas`) that belong to it."""
+    result: Dict[str, List[str]] = {}
+    for area_code, area_name in areas:
+        for region in area_regions(area_code, area_name):
+            result.setdefault(region, []).append(area_code)
+    return result
+
+
+class RegionIndex:
+    """EIA rows bucketed by (region, product); either part may be None for 'any'."""
+
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.buckets: Dict[Tuple[Optional[str], Optional[str]], List[dict]] = {}
+        for row in rows:
+            regions = area_regions(row.get("duoarea", ""), row.get("area-name", ""))
+            products = product_keys(row)
+            for region in regions:
+                self.buckets.setdefault((region, None), []).append(row)
+                for product in products:
+                    self.buckets.setdefault((region, product), []).append(row)
+            for product in products:
+                self.buckets.setdefault((None, product), []).append(row)
+
+    def lookup(self, region: Optional[str] = None, product: Optional[str] = None) -> List[dict]:
+        region = normalize_region(region)
+        if product:
+            product = PRODUCT_LABELS.get(product.lower(), product)
+        else:
+            product = None
+        if region is None and product is None:
+            return self.rows
+        return self.buckets.get((region, product), [])
+
+
+# Indexes for recently served payloads, keyed by payload identity. The payload
+# is kept in the entry so its id() cannot be reused while the entry lives.
+_payload_indexes = TTLCache(maxsize=16, ttl=86400.0)
+
+
+def index_payload(payload: dict) -> RegionIndex:
+    """RegionIndex for an EIA payload, built once per distinct payload object."""
+    entry = _payload_indexes.get_entry(id(payload))
+    if entry is not None and entry.value[0] is payload:
+        return entry.value[1]
+    index = RegionIndex(payload.get("response", {}).get("data", []))
+    _payload_indexes.set(id(payload), (payload, index))
+    return index
@@ -0,0 +1,191 @@
+"""
+Background EIA ingestion scheduler.
+
+Keeps the local price store fresh independently of user traffic so price
+endpoints never wait on EIA. Started from the app lifespan on long-running
+servers; serverless deployments run it from cron instead:
+
+    python scheduler.py --once                 # one incremental sync, then exit
+    python scheduler.py --frequency weekly     # run the polling loop in the foreground
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, Base, dispose_engine, get_engine
+from eia import close_eia_client
+from ingest import IngestResult, ingest_prices
+
+# --- Config ---
+INGEST_SCHEDULER_ENABLED = os.getenv('INGEST_SCHEDULER', 'true').lower() in ['true', '1', 'yes']
+INGEST_INTERVALS = {
+    "weekly": float(os.getenv('INGEST_WEEKLY_INTERVAL', '3600')),
+    "daily": float(os.getenv('INGEST_DAILY_INTERVAL', '900')),
+}
+INGEST_BACKOFF_BASE = float(os.getenv('INGEST_BACKOFF_BASE', '30'))
+INGEST_BACKOFF_MAX = float(os.getenv('INGEST_BACKOFF_MAX', '1800'))
+
+
+def backoff_delay(failures: int, base: float = INGEST_BACKOFF_BASE, cap: float = INGEST_BACKOFF_MAX) -> float:
+    """Exponential backoff with jitter, so replicas don't retry EIA in lockstep."""
+    delay = min(cap, base * 2 ** max(0, failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class IngestMetrics:
+    def __init__(self):
+        self.rows_ingested = 0
+        self.syncs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_rows = 0
+        self.last_duration = 0.0
+        self.last_success_at: Optional[float] = None
+        self.latest_period: Optional[date] = None
+        self.lag_days: Optional[int] = None
+
+    def record_success(self, result: IngestResult, duration: float):
+        self.syncs += 1
+        self.consecutive_failures = 0
+        self.rows_ingested += result.rows
+        self.last_rows = result.rows
+        self.last_duration = duration
+        self.last_success_at = time.time()
+        if result.upstream_latest:
+            self.latest_period = result.upstream_latest
+        # How far the store was behind EIA when this sync started
+        if result.upstream_latest and result.watermark:
+            self.lag_days = (result.upstream_latest - result.watermark).days
+
+    def record_failure(self, duration: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_duration = duration
+
+    def as_dict(self) -> dict:
+        return {
+            "rows_ingested": self.rows_ingested,
+            "syncs": self.syncs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_rows": self.last_rows,
+            "last_fetch_seconds": round(self.last_duration, 3),
+            "seconds_since_success": round(time.time() - self.last_success_at, 1) if self.last_success_at else None,
+            "latest_period": self.latest_period.isoformat() if self.latest_period else None,
+            "lag_days": self.lag_days,
+        }
+
+
+class IngestScheduler:
+    def __init__(self, intervals: Optional[Dict[str, float]] = None, session_factory=AsyncSessionLocal):
+        self.intervals = intervals or INGEST_INTERVALS
+        self.session_factory = session_factory
+        self.metrics = {frequency: IngestMetrics() for frequency in self.intervals}
+        self.listeners: List[Callable[[AsyncSession, str, IngestResult], Awaitable[None]]] = []
+        self._tasks: list = []
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def add_listener(self, callback: Callable[[AsyncSession, str, IngestResult], Awaitable[None]]):
+        """Register `callback(db, frequency, result)`, awaited after each sync that wrote rows."""
+        self.listeners.append(callback)
+
+    async def sync(self, frequency: str) -> IngestResult:
+        metrics = self.metrics.setdefault(frequency, IngestMetrics())
+        started = time.perf_counter()
+        async with self.session_factory() as db:
+            try:
+                result = await ingest_prices(db, frequency)
+            except Exception:
+                metrics.record_failure(time.perf_counter() - started)
+                raise
+            metrics.record_success(result, time.perf_counter() - started)
+            if result.rows:
+                for callback in self.listeners:
+                    try:
+                        await callback(db, frequency, result)
+                    except Exception as e:
+                        print(f"Ingest listener {callback.__name__} failed: {e}")
+        return result
+
+    async def _run(self, frequency: str):
+        interval = self.intervals[frequency]
+        while True:
+            try:
+                result = await self.sync(frequency)
+                print(f"Ingested {result.rows} {frequency} price observations in {result.pages} page(s)")
+                delay = interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures = self.metrics[frequency].consecutive_failures
+                delay = min(interval, backoff_delay(failures))
+                print(f"EIA {frequency} ingest failed ({failures} in a row), retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self.running:
+            return
+        self._tasks = [asyncio.create_task(self._run(frequency)) for frequency in self.intervals]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self) -> dict:
+        return {"running": self.running, **{f: m.as_dict() for f, m in self.metrics.items()}}
+
+
+scheduler = IngestScheduler()
+
+
+async def main(args):
+    from alert_engine import evaluate_after_ingest
+    from notifications import dispatcher, enqueue_alerts
+    from order_book import match_after_ingest
+    from snapshot import write_after_ingest
+
+    async def alert_and_notify(db, frequency, result):
+        await enqueue_alerts(db, await evaluate_after_ingest(db, frequency, result))
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    frequencies = args.frequency or list(INGEST_INTERVALS)
+    runner = IngestScheduler({f: INGEST_INTERVALS[f] for f in frequencies})
+    runner.add_listener(alert_and_notify)
+    runner.add_listener(match_after_ingest)
+    runner.add_listener(write_after_ingest)
+    try:
+        if args.once:
+            for frequency in frequencies:
+                result = await runner.sync(frequency)
+                print(f"Ingested {result.rows} {frequency} price observations in {result.pages} page(s)")
+            # Includes notifications left over from earlier runs that are due for a retry
+            print(f"Sent {await dispatcher.drain()} notification(s)")
+        else:
+            runner.start()
+            dispatcher.start()
+            await asyncio.gather(*runner._tasks)
+    finally:
+        await runner.stop()
+        await dispatcher.stop()
+        await close_eia_client()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync EIA price series into the local database")
+    parser.add_argument("--once", action="store_true", help="run a single incremental sync and exit (for cron)")
+    parser.add_argument("--frequency", action="append", choices=list(INGEST_INTERVALS),
+                        help="series frequency to sync (repeatable, default: all)")
+    asyncio.run(main(parser.parse_args()))
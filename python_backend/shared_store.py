@@ -0,0 +1,177 @@
+"""
+Storage shared by every worker: rate-limit token buckets and the EIA response cache.
+
+SHARED_STORE_URL picks the backend. Unset (or 'memory://') keeps state in
+process memory, which is exact for a single worker. A 'redis://' or
+'rediss://' URL uses Redis or any server that speaks its protocol (Valkey,
+KeyDB, Upstash). Then N uvicorn workers or serverless instances enforce one
+limit and share one warm EIA cache instead of N cold ones. The redis package
+is only imported when such a URL is configured.
+
+A Redis outage never takes requests down with it. Limits fail open and the
+shared cache tier is skipped. A warning is printed at most once a minute.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# --- Config ---
+SHARED_STORE_URL = os.getenv('SHARED_STORE_URL', '')
+SHARED_STORE_PREFIX = os.getenv('SHARED_STORE_PREFIX', 'oiltracker:')
+SHARED_STORE_TIMEOUT = float(os.getenv('SHARED_STORE_TIMEOUT', '0.5'))
+# Token buckets kept by the in-memory backend before the least recently used go
+MEMORY_BUCKETS_MAX = 100_000
+
+# Refill, spend and report the wait in one round trip. TIME makes every worker
+# use the server's clock, so their own clock skew does not matter.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+def refill(tokens: float, last: float, now: float, rate: float, capacity: float) -> float:
+    return min(capacity, tokens + max(0.0, now - last) * rate)
+
+
+class MemoryStore:
+    """Per-process backend."""
+
+    shared = False
+
+    def __init__(self, max_buckets: int = MEMORY_BUCKETS_MAX):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._values: dict = {}
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Spend `cost` tokens from the bucket at `key` (refilled at `rate`/s up to
+        `capacity`). Returns 0 when allowed, else the seconds until it would be."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (capacity, now))
+        tokens = refill(tokens, last, now, rate, capacity)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value, expires = self._values.get(key, (None, 0.0))
+        if value is not None and expires < time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._values[key] = (value, time.monotonic() + ttl)
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    """Backend on a redis.asyncio client (or a compatible one such as fakeredis)."""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = SHARED_STORE_PREFIX, timeout: float = SHARED_STORE_TIMEOUT):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+        self._take = client.register_script(TOKEN_BUCKET_LUA)
+        self._warned_at = 0.0
+        self.errors = 0
+
+    def _failed(self, op: str, e: Exception):
+        self.errors += 1
+        now = time.monotonic()
+        if now - self._warned_at > 60:
+            self._warned_at = now
+            print(f"Shared store {op} failed, continuing without it: {e!r}")
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        try:
+            wait = await asyncio.wait_for(
+                self._take(keys=[self.prefix + key], args=[rate, capacity, cost]), self.timeout)
+            return float(wait)
+        except Exception as e:
+            self._failed("rate limit", e)
+            return 0.0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return await asyncio.wait_for(self.client.get(self.prefix + key), self.timeout)
+        except Exception as e:
+            self._failed("read", e)
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        try:
+            await asyncio.wait_for(self.client.set(self.prefix + key, value, px=int(ttl * 1000)), self.timeout)
+        except Exception as e:
+            self._failed("write", e)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_store = None
+_store_loop: Optional[asyncio.AbstractEventLoop] = None
+_store_fixed = False
+
+
+def get_store():
+    """The configured store, built on first use. A Redis client belongs to one
+    event loop, so it is rebuilt if Mangum hands us a new one (as in eia.py)."""
+    global _store, _store_loop
+    if _store_fixed:
+        return _store
+    if not SHARED_STORE_URL.startswith(("redis://", "rediss://", "unix://")):
+        if _store is None:
+            _store = MemoryStore()
+        return _store
+    loop = asyncio.get_running_loop()
+    if _store is None or _store_loop is not loop:
+        import redis.asyncio as redis
+
+        _store = RedisStore(redis.from_url(SHARED_STORE_URL))
+        _store_loop = loop
+    return _store
+
+
+def set_store(store):
+    """Use `store` from now on (benchmarks, or a custom backend)."""
+    global _store, _store_fixed
+    _store = store
+    _store_fixed = store is not None
+
+
+async def close_store():
+    global _store, _store_loop
+    if _store is not None and not _store_fixed:
+        await _store.close()
+        _store = None
+        _store_loop = None
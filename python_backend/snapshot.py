@@ -0,0 +1,492 @@
+"""
+Columnar snapshot of the stored price history, memory-mapped on load.
+
+There is one file per frequency, SNAPSHOT_DIR/prices-<frequency>.snap. Rows
+are sorted by (series, period). Each column is a raw little-endian array:
+
+    offsets int64    series i is rows offsets[i]:offsets[i+1]
+    period  int32    days since 1970-01-01
+    value   float64
+
+Series, products and areas are dictionary-encoded in a JSON header in front
+of the columns. Each series is (id, product index, area index), and the
+products and areas are (code, name) lists. That comes to 12 bytes per
+observation, against several hundred for a parsed EIA row dict.
+
+Loading reads the header and np.memmap's the columns. It costs milliseconds,
+and the pages are shared by every worker through the OS page cache. The
+file is rebuilt from the price store after each ingest. It is written to a
+temp file and renamed over the old one, so a reader never sees a partial
+file, and a mapping of the old file stays valid until the next load.
+
+The API maps the snapshots at startup. The store-backed /prices and
+/prices/ohlc reads are served from the snapshot when its latest period
+matches the store's and from the database otherwise.
+
+Run `python snapshot.py` to rebuild the snapshots from the store, e.g. from
+cron next to `scheduler.py --once`.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import struct
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import SingleFlight
+from database import AsyncSessionLocal, PriceObservation
+from price_store import PRODUCT_CODES, parse_observations
+from regions import PRODUCT_LABELS, codes_by_region, normalize_region
+
+# Serverless functions can only write to the temp directory
+SERVERLESS = os.getenv('SERVERLESS', 'false').lower() == 'true'
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', tempfile.gettempdir() if SERVERLESS else 'snapshots')
+SNAPSHOT_MAGIC = b"PXSNAP1\n"
+# Column data starts on a multiple of this, so memory-mapped arrays are aligned
+SNAPSHOT_ALIGN = 64
+# Rows fetched per round trip when building from the store
+SNAPSHOT_LOAD_CHUNK = 50000
+FREQUENCIES = ("weekly", "daily")
+CSV_HEADER = b"period,series,product,product_name,area_code,area_name,value\n"
+
+_EPOCH = date(1970, 1, 1)
+COLUMNS = (("offsets", "<i8"), ("period", "<i4"), ("value", "<f8"))
+
+
+def _pad(n: int) -> int:
+    return -n % SNAPSHOT_ALIGN
+
+
+class PriceSnapshot:
+    """One frequency's price history, column-wise."""
+
+    def __init__(self, frequency: str, products: List[Tuple[str, str]], areas: List[Tuple[str, str]],
+                 series: List[Tuple[str, int, int]], offsets: np.ndarray, period: np.ndarray, value: np.ndarray,
+                 built_at: Optional[float] = None):
+        self.frequency = frequency
+        self.products = products
+        self.areas = areas
+        self.series_ids = [s[0] for s in series]
+        self.series_product = np.array([s[1] for s in series], dtype=np.int32)
+        self.series_area = np.array([s[2] for s in series], dtype=np.int32)
+        self.offsets = offsets
+        self.period = period
+        self.value = value
+        self.built_at = built_at if built_at is not None else time.time()
+
+    def __len__(self):
+        return len(self.value)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.period.nbytes + self.value.nbytes
+
+    @property
+    def latest(self) -> Optional[date]:
+        if not len(self):
+            return None
+        # Each series is sorted, so its last row is its latest period
+        ends = self.offsets[1:][np.diff(self.offsets) > 0] - 1
+        return _EPOCH + timedelta(days=int(self.period[ends].max()))
+
+    def series_rows(self) -> np.ndarray:
+        """Series index of every row."""
+        return np.repeat(np.arange(len(self.series_ids), dtype=np.int32), np.diff(self.offsets))
+
+    @classmethod
+    def from_observations(cls, observations: Iterable[dict], frequency: str) -> "PriceSnapshot":
+        """Build from PriceObservation column dicts (see price_store.parse_observations)."""
+        products: Dict[str, int] = {}
+        areas: Dict[str, int] = {}
+        product_names, area_names = [], []
+        series: Dict[str, int] = {}
+        series_rows: List[Tuple[str, int, int]] = []
+        index, days, values = [], [], []
+        for obs in observations:
+            code = obs["product"]
+            p = products.get(code)
+            if p is None:
+                p = products[code] = len(products)
+                product_names.append(obs["product_name"])
+            a = areas.get(obs["area_code"])
+            if a is None:
+                a = areas[obs["area_code"]] = len(areas)
+                area_names.append(obs["area_name"])
+            s = series.get(obs["series"])
+            if s is None:
+                s = series[obs["series"]] = len(series)
+                series_rows.append((obs["series"], p, a))
+            index.append(s)
+            days.append(obs["period"].toordinal())
+            values.append(obs["value"])
+        index = np.array(index, dtype=np.int32)
+        days = np.array(days, dtype=np.int32) - _EPOCH.toordinal()
+        order = np.lexsort((days, index))
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(index, minlength=len(series)), out=offsets[1:])
+        return cls(
+            frequency, list(zip(products, product_names)), list(zip(areas, area_names)), series_rows,
+            offsets, days[order], np.array(values, dtype=np.float64)[order],
+        )
+
+    @classmethod
+    def from_payload(cls, payload: dict, frequency: str) -> "PriceSnapshot":
+        """Build from an EIA response payload."""
+        return cls.from_observations(parse_observations(payload.get("response", {}).get("data", []), frequency),
+                                     frequency)
+
+    def merge(self, observations: Iterable[dict]) -> "PriceSnapshot":
+        """A new snapshot with `observations` added; they replace rows with the same (series, period)."""
+        new = PriceSnapshot.from_observations(observations, self.frequency)
+        products = {code: i for i, (code, _) in enumerate(self.products)}
+        areas = {code: i for i, (code, _) in enumerate(self.areas)}
+        product_list, area_list = list(self.products), list(self.areas)
+        for code, name in new.products:
+            if code not in products:
+                products[code] = len(product_list)
+                product_list.append((code, name))
+        for code, name in new.areas:
+            if code not in areas:
+                areas[code] = len(area_list)
+                area_list.append((code, name))
+        series = {sid: i for i, sid in enumerate(self.series_ids)}
+        series_list = list(zip(self.series_ids, self.series_product.tolist(), self.series_area.tolist()))
+        mapped = np.empty(len(new.series_ids), dtype=np.int32)
+        for i, sid in enumerate(new.series_ids):
+            if sid not in series:
+                series[sid] = len(series_list)
+                series_list.append((sid, products[new.products[new.series_product[i]][0]],
+                                    areas[new.areas[new.series_area[i]][0]]))
+            mapped[i] = series[sid]
+
+        index = np.concatenate((self.series_rows(), mapped[new.series_rows()]))
+        days = np.concatenate((self.period, new.period))
+        values = np.concatenate((self.value, new.value))
+        newer = np.concatenate((np.zeros(len(self), dtype=np.int8), np.ones(len(new), dtype=np.int8)))
+        # Sort by (series, period) with the new row first, then keep the first of each pair
+        order = np.lexsort((-newer, days, index))
+        index, days, values = index[order], days[order], values[order]
+        first = np.ones(len(index), dtype=bool)
+        first[1:] = (index[1:] != index[:-1]) | (days[1:] != days[:-1])
+        index, days, values = index[first], days[first], values[first]
+        offsets = np.zeros(len(series_list) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(index, minlength=len(series_list)), out=offsets[1:])
+        return PriceSnapshot(self.frequency, product_list, area_list, series_list, offsets, days, values)
+
+    # --- Serialization ---
+
+    def to_bytes(self) -> bytes:
+        columns = [(name, np.ascontiguousarray(getattr(self, name), dtype=dtype)) for name, dtype in COLUMNS]
+        header = {
+            "frequency": self.frequency,
+            "built_at": self.built_at,
+            "products": self.products,
+            "areas": self.areas,
+            "series": [[sid, int(p), int(a)] for sid, p, a in
+                       zip(self.series_ids, self.series_product.tolist(), self.series_area.tolist())],
+            "columns": {},
+        }
+        # Column offsets are relative to the (aligned) end of the header
+        position = 0
+        for name, array in columns:
+            header["columns"][name] = [array.dtype.str, position, len(array)]
+            position += array.nbytes + _pad(array.nbytes)
+        encoded = orjson.dumps(header)
+        prefix = len(SNAPSHOT_MAGIC) + 4 + len(encoded)
+        parts = [SNAPSHOT_MAGIC, struct.pack("<I", len(encoded)), encoded, b"\0" * _pad(prefix)]
+        for name, array in columns:
+            parts.append(array.tobytes())
+            parts.append(b"\0" * _pad(array.nbytes))
+        return b"".join(parts)
+
+    def save(self, path: str):
+        """Write atomically: a temp file in the same directory, renamed over `path`."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.to_bytes())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _header(buf: bytes) -> Tuple[dict, int]:
+        if buf[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("Not a price snapshot")
+        (length,) = struct.unpack("<I", buf[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 4])
+        end = len(SNAPSHOT_MAGIC) + 4 + length
+        return orjson.loads(buf[len(SNAPSHOT_MAGIC) + 4:end]), end + _pad(end)
+
+    @classmethod
+    def _from_header(cls, header: dict, columns: dict) -> "PriceSnapshot":
+        return cls(header["frequency"], [tuple(p) for p in header["products"]], [tuple(a) for a in header["areas"]],
+                   [tuple(s) for s in header["series"]], columns["offsets"], columns["period"], columns["value"],
+                   header["built_at"])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PriceSnapshot":
+        header, start = cls._header(data)
+        columns = {name: np.frombuffer(data, dtype=dtype, count=count, offset=start + offset)
+                   for name, (dtype, offset, count) in header["columns"].items()}
+        return cls._from_header(header, columns)
+
+    @classmethod
+    def load(cls, path: str) -> "PriceSnapshot":
+        """Memory-map a snapshot file; only the header is read up front."""
+        with open(path, "rb") as f:
+            prefix = f.read(len(SNAPSHOT_MAGIC) + 4)
+            (length,) = struct.unpack("<I", prefix[len(SNAPSHOT_MAGIC):])
+            header, start = cls._header(prefix + f.read(length))
+        columns = {}
+        for name, (dtype, offset, count) in header["columns"].items():
+            # np.memmap cannot map zero bytes
+            columns[name] = (np.memmap(path, dtype=dtype, mode="r", offset=start + offset, shape=(count,))
+                             if count else np.empty(0, dtype=dtype))
+        return cls._from_header(header, columns)
+
+    # --- Queries and exports ---
+
+    def subset(self, product: Optional[str] = None, area: Optional[str] = None,
+               start: Optional[date] = None, end: Optional[date] = None) -> "PriceSnapshot":
+        """Series matching product (label, code or name, any case) and area (code or name),
+        rows within [start, end]."""
+        if not (product or area or start or end):
+            return self
+        keep = np.ones(len(self.series_ids), dtype=bool)
+        if product:
+            label = PRODUCT_LABELS.get(product.strip().lower(), product)
+            wanted_code = PRODUCT_CODES.get(label, label).upper()
+            wanted = [i for i, (code, name) in enumerate(self.products)
+                      if code.upper() == wanted_code or name.lower() == product.strip().lower()]
+            keep &= np.isin(self.series_product, wanted)
+        if area:
+            wanted = [i for i, (code, name) in enumerate(self.areas)
+                      if code == area.upper() or name.lower() == area.strip().lower()]
+            keep &= np.isin(self.series_area, wanted)
+        lo = start.toordinal() - _EPOCH.toordinal() if start else None
+        hi = end.toordinal() - _EPOCH.toordinal() if end else None
+        series, periods, values, counts = [], [], [], []
+        for i in np.flatnonzero(keep).tolist():
+            first, last = int(self.offsets[i]), int(self.offsets[i + 1])
+            days = self.period[first:last]
+            a = int(np.searchsorted(days, lo, "left")) if lo is not None else 0
+            b = int(np.searchsorted(days, hi, "right")) if hi is not None else len(days)
+            series.append((self.series_ids[i], int(self.series_product[i]), int(self.series_area[i])))
+            periods.append(days[a:b])
+            values.append(self.value[first + a:first + b])
+            counts.append(b - a)
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return PriceSnapshot(
+            self.frequency, self.products, self.areas, series, offsets,
+            np.concatenate(periods) if periods else np.empty(0, dtype=np.int32),
+            np.concatenate(values) if values else np.empty(0, dtype=np.float64),
+            self.built_at,
+        )
+
+    def _series_matching(self, products: List[int], area: Optional[str], region: Optional[str]) -> np.ndarray:
+        """Indices of the series of `products` in `area` (code or name) and `region`."""
+        keep = np.isin(self.series_product, products)
+        if area:
+            wanted = [i for i, (code, name) in enumerate(self.areas)
+                      if code == area.upper() or name.lower() == area.strip().lower()]
+            keep &= np.isin(self.series_area, wanted)
+        region = normalize_region(region)
+        if region:
+            codes = set(codes_by_region(self.areas).get(region, []))
+            keep &= np.isin(self.series_area, [i for i, (code, _) in enumerate(self.areas) if code in codes])
+        return np.flatnonzero(keep)
+
+    def _gather(self, series: np.ndarray, start: Optional[date], end: Optional[date]):
+        """(series index, period, value) of every row of `series` within [start, end]."""
+        lo = start.toordinal() - _EPOCH.toordinal() if start else None
+        hi = end.toordinal() - _EPOCH.toordinal() if end else None
+        index, periods, values = [], [], []
+        for i in series.tolist():
+            first, last = int(self.offsets[i]), int(self.offsets[i + 1])
+            days = self.period[first:last]
+            a = int(np.searchsorted(days, lo, "left")) if lo is not None else 0
+            b = int(np.searchsorted(days, hi, "right")) if hi is not None else len(days)
+            index.append(np.full(b - a, i, dtype=np.int32))
+            periods.append(days[a:b])
+            values.append(self.value[first + a:first + b])
+        if not index:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0)
+        return np.concatenate(index), np.concatenate(periods), np.concatenate(values)
+
+    def query_rows(self, product: Optional[str] = None, area: Optional[str] = None,
+                   start: Optional[date] = None, end: Optional[date] = None, limit: int = 1000,
+                   region: Optional[str] = None) -> List[dict]:
+        """Newest-first rows in EIA's format, filtered like price_store.query_observations."""
+        products = [i for i, (code, name) in enumerate(self.products)
+                    if not product or code == product or product.lower() in name.lower()]
+        index, periods, values = self._gather(self._series_matching(products, area, region), start, end)
+        # Newest period first; the stable sort keeps series order within a period
+        order = np.argsort(-periods, kind="stable")[:limit]
+        days = np.datetime_as_string(periods[order].astype("datetime64[D]")).tolist()
+        rows = []
+        for i, period, value in zip(index[order].tolist(), days, values[order].tolist()):
+            product_code, product_name = self.products[self.series_product[i]]
+            area_code, area_name = self.areas[self.series_area[i]]
+            rows.append({"period": period, "duoarea": area_code, "area-name": area_name, "product": product_code,
+                         "product-name": product_name, "series": self.series_ids[i], "value": value})
+        return rows
+
+    def series_values(self, product_code: str, area: str, start: Optional[date] = None,
+                      end: Optional[date] = None) -> Tuple[List[date], List[float]]:
+        """Oldest-first (periods, values) of one product in one area, like price_store.query_series."""
+        products = [i for i, (code, _) in enumerate(self.products) if code == product_code]
+        _, periods, values = self._gather(self._series_matching(products, area, None), start, end)
+        order = np.argsort(periods, kind="stable")
+        return ([_EPOCH + timedelta(days=day) for day in periods[order].tolist()], values[order].tolist())
+
+    def iter_csv(self) -> Iterator[bytes]:
+        """CSV, one chunk per series."""
+        yield CSV_HEADER
+        for i, sid in enumerate(self.series_ids):
+            (product, product_name) = self.products[self.series_product[i]]
+            (area_code, area_name) = self.areas[self.series_area[i]]
+            fields = io.StringIO()
+            csv.writer(fields, lineterminator="").writerow((sid, product, product_name, area_code, area_name))
+            middle = f",{fields.getvalue()},"
+            first, last = int(self.offsets[i]), int(self.offsets[i + 1])
+            periods = np.datetime_as_string(self.period[first:last].astype("datetime64[D]")).tolist()
+            values = self.value[first:last].tolist()
+            yield "".join(f"{period}{middle}{value!r}\n" for period, value in zip(periods, values)).encode()
+
+    def to_parquet(self) -> bytes:
+        """Parquet with dictionary-encoded product and area columns. Needs pyarrow."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.series_rows()
+        product_rows = self.series_product[rows]
+        area_rows = self.series_area[rows]
+        table = pa.table({
+            "period": pa.array(self.period.astype("datetime64[D]")),
+            "series": pa.DictionaryArray.from_arrays(rows, self.series_ids),
+            "product": pa.DictionaryArray.from_arrays(product_rows, [code for code, _ in self.products]),
+            "product_name": pa.DictionaryArray.from_arrays(product_rows, [name for _, name in self.products]),
+            "area_code": pa.DictionaryArray.from_arrays(area_rows, [code for code, _ in self.areas]),
+            "area_name": pa.DictionaryArray.from_arrays(area_rows, [name for _, name in self.areas]),
+            "value": pa.array(np.asarray(self.value)),
+        })
+        buf = io.BytesIO()
+        pq.write_table(table, buf)
+        return buf.getvalue()
+
+
+# --- Files ---
+
+_snapshots: Dict[str, Tuple[tuple, PriceSnapshot]] = {}
+snapshot_flight = SingleFlight()
+
+
+def snapshot_path(frequency: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"prices-{frequency}.snap")
+
+
+def map_snapshots():
+    """Map the snapshot files present at startup, so the first request does not pay for it."""
+    for frequency in FREQUENCIES:
+        try:
+            get_snapshot(frequency)
+        except (OSError, ValueError) as e:
+            print(f"Could not map the {frequency} price snapshot: {e}")
+
+
+def get_snapshot(frequency: str) -> Optional[PriceSnapshot]:
+    """The snapshot file for `frequency`, mapped once and remapped when the file is replaced."""
+    path = snapshot_path(frequency)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+    loaded = _snapshots.get(frequency)
+    if loaded is None or loaded[0] != identity:
+        loaded = _snapshots[frequency] = (identity, PriceSnapshot.load(path))
+    return loaded[1]
+
+
+async def build_snapshot(db: AsyncSession, frequency: str, base: Optional[PriceSnapshot] = None,
+                         since: Optional[date] = None) -> PriceSnapshot:
+    """Snapshot the stored observations of `frequency` and write it to SNAPSHOT_DIR.
+
+    With `base` and `since`, only periods from `since` on are read and merged
+    into `base`; otherwise the whole history is read.
+    """
+    stmt = select(
+        PriceObservation.series, PriceObservation.product, PriceObservation.product_name,
+        PriceObservation.area_code, PriceObservation.area_name, PriceObservation.period, PriceObservation.value,
+    ).where(PriceObservation.frequency == frequency)
+    if base is not None and since is not None:
+        stmt = stmt.where(PriceObservation.period >= since)
+    result = await db.stream(stmt.execution_options(yield_per=SNAPSHOT_LOAD_CHUNK))
+    observations = [row._asdict() async for row in result]
+    if base is not None and since is not None:
+        snapshot = base.merge(observations)
+    else:
+        snapshot = PriceSnapshot.from_observations(observations, frequency)
+    await asyncio.to_thread(snapshot.save, snapshot_path(frequency))
+    return snapshot
+
+
+async def rebuild_snapshot(frequency: str, base: Optional[PriceSnapshot] = None,
+                           since: Optional[date] = None) -> PriceSnapshot:
+    """build_snapshot, shared by concurrent callers through snapshot_flight.
+
+    The build reads the store through a session of its own, so callers that
+    join it do not depend on the session of whichever caller started it.
+    """
+    async def build():
+        async with AsyncSessionLocal() as db:
+            return await build_snapshot(db, frequency, base, since)
+
+    return await snapshot_flight.do(frequency, build)
+
+
+async def ensure_snapshot(frequency: str) -> PriceSnapshot:
+    """The current snapshot, built from the store first if there is none yet."""
+    snapshot = get_snapshot(frequency)
+    if snapshot is None:
+        await rebuild_snapshot(frequency)
+        snapshot = get_snapshot(frequency)
+    return snapshot
+
+
+async def write_after_ingest(db: AsyncSession, frequency: str, result) -> None:
+    """IngestScheduler listener: rewrite the frequency's snapshot with the new periods.
+
+    Ingest re-fetches from the previous watermark on, so reading the store
+    from there picks up the new periods and any revisions.
+    """
+    snapshot = await rebuild_snapshot(frequency, get_snapshot(frequency), result.watermark)
+    print(f"Wrote {frequency} price snapshot: {len(snapshot)} rows, {len(snapshot.series_ids)} series")
+
+
+async def main(args):
+    from database import dispose_engine
+
+    try:
+        for frequency in args.frequency or FREQUENCIES:
+            async with AsyncSessionLocal() as db:
+                snapshot = await build_snapshot(db, frequency)
+            print(f"{snapshot_path(frequency)}: {len(snapshot)} rows, {len(snapshot.series_ids)} series, "
+                  f"through {snapshot.latest}")
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the columnar price snapshots from the local store")
+    parser.add_argument("--frequency", action="append", choices=FREQUENCIES,
+                        help="frequency to snapshot (repeatable, default: all)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,45 @@
+"""
+Shared setup for the test suite.
+
+Tests run the backend against the same throwaway SQLite database and stub EIA
+server as the benchmarks (see benchmarks/harness.py). Backend modules read
+their config at import, so tests import them inside the test, after the
+`eia_stub` fixture has set the environment.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "benchmarks"))
+
+from harness import app_environment  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def eia_stub():
+    """The running stub EIA server's config (hits, error_rate, latency)."""
+    with app_environment() as stub:
+        yield stub
+
+
+@pytest.fixture
+def run():
+    """asyncio.run for tests that use the database outside the app's lifespan:
+    creates the tables first and, afterwards, disposes of the engine and the
+    EIA client, which are bound to the loop."""
+    def run(coro):
+        async def main():
+            from database import Base, dispose_engine, get_engine
+            from eia import close_eia_client
+            try:
+                async with get_engine().begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                return await coro
+            finally:
+                await close_eia_client()
+                await dispose_engine()
+        return asyncio.run(main())
+    return run
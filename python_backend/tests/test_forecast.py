@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+
+def weekly(area_code, first, weeks, value=3.0):
+    return [{"product": "EPD2D", "area_code": area_code, "area_name": area_code,
+             "period": first + timedelta(weeks=w), "value": value + 0.01 * w} for w in range(weeks)]
+
+
+def test_resume_from_waits_for_lagging_series():
+    from forecast import Forecaster
+
+    model = Forecaster()
+    model.update(weekly("NUS", date(2024, 1, 1), 10) + weekly("R10", date(2024, 1, 1), 8))
+    assert model.resume_from() == date(2024, 2, 19) + timedelta(days=1)
+
+
+def test_resume_from_skips_stale_series():
+    from forecast import Forecaster
+
+    model = Forecaster()
+    # R10 stopped publishing long ago
+    model.update(weekly("R10", date(2020, 1, 6), 4) + weekly("NUS", date(2024, 1, 1), 10))
+    assert model.resume_from() == date(2024, 3, 4) + timedelta(days=1)
+
+    # It is picked up again should it come back
+    back = date(2024, 3, 4) + timedelta(weeks=1)
+    assert model.update(weekly("R10", back, 1) + weekly("NUS", back, 1)) == 2
+    assert model.series("EPD2D", "r10")[0]["last_period"] == back.isoformat()
@@ -0,0 +1,92 @@
+from datetime import date
+
+from sqlalchemy import func, select, update
+
+from stub_eia import END_PERIOD, ROWS_PER_PERIOD
+
+
+def test_weekly_and_daily_rows_of_one_series_are_kept_apart(run, monkeypatch):
+    import ingest
+    from database import AsyncSessionLocal, PriceObservation
+
+    # EIA (and the stub) use the same series id for both frequencies
+    monkeypatch.setattr(ingest, "INGEST_BACKFILL_START", "2024-12-02")
+    series = "EMM_EPD2D_PTE_NUS_DPG"
+
+    async def ingest_both():
+        async with AsyncSessionLocal() as db:
+            await ingest.ingest_prices(db, "weekly")
+            await ingest.ingest_prices(db, "daily")
+            counts = dict((await db.execute(
+                select(PriceObservation.frequency, func.count())
+                .where(PriceObservation.period >= date(2024, 12, 2))
+                .group_by(PriceObservation.frequency)
+            )).all())
+            on_end_period = (await db.scalars(
+                select(PriceObservation.frequency)
+                .where(PriceObservation.series == series, PriceObservation.period == END_PERIOD)
+            )).all()
+        return counts, on_end_period
+
+    counts, on_end_period = run(ingest_both())
+    days = (END_PERIOD - date(2024, 12, 2)).days + 1
+    assert counts == {"weekly": (days // 7 + 1) * ROWS_PER_PERIOD, "daily": days * ROWS_PER_PERIOD}
+    assert sorted(on_end_period) == ["daily", "weekly"]
+
+
+def test_filters_treat_like_wildcards_literally(run):
+    from database import AsyncSessionLocal
+    from price_store import query_observations, upsert_observations
+
+    rows = [{"series": "TEST_EPD2D_NUS", "frequency": "weekly", "area_code": "NUS", "area_name": "U.S.",
+             "product": "EPD2D", "product_name": "No 2 Diesel", "period": date(2020, 1, 6), "value": 3.0}]
+
+    async def query(**filters):
+        async with AsyncSessionLocal() as db:
+            return await query_observations(db, end=date(2020, 1, 6), **filters)
+
+    async def queries():
+        async with AsyncSessionLocal() as db:
+            await upsert_observations(db, rows)
+            await db.commit()
+        return [len(await query(**filters)) for filters in (
+            {"area": "u.s."}, {"area": "nus"}, {"product": "diesel"},
+            {"area": "%"}, {"area": "U_S_"}, {"product": "%"}, {"product": "No_2"},
+        )]
+
+    assert run(queries()) == [1, 1, 1, 0, 0, 0, 0]
+
+
+def test_resync_counts_only_changed_rows(run, monkeypatch):
+    import ingest
+    from database import AsyncSessionLocal, PriceObservation
+    from scheduler import IngestScheduler
+
+    monkeypatch.setattr(ingest, "INGEST_BACKFILL_START", "2024-12-02")
+    scheduler = IngestScheduler({"weekly": 60})
+    fired = []
+
+    async def listener(db, frequency, result):
+        fired.append(result.rows)
+
+    scheduler.add_listener(listener)
+
+    async def syncs():
+        await scheduler.sync("weekly")
+        fired.clear()
+        unchanged = await scheduler.sync("weekly")
+        async with AsyncSessionLocal() as db:
+            # As if EIA revised one price in the watermark week
+            await db.execute(
+                update(PriceObservation)
+                .where(PriceObservation.frequency == "weekly", PriceObservation.period == unchanged.watermark,
+                       PriceObservation.series == "EMM_EPD2D_PTE_NUS_DPG")
+                .values(value=PriceObservation.value + 1)
+            )
+            await db.commit()
+        revised = await scheduler.sync("weekly")
+        return unchanged.rows, revised.rows
+
+    assert run(syncs()) == (0, 1)
+    assert fired == [1]
+    assert scheduler.metrics["weekly"].last_rows == 1
@@ -0,0 +1,137 @@
+import asyncio
+from datetime import timedelta
+
+import httpx
+from sqlalchemy import select, update
+
+from harness import app_server, login
+from stub_notify import running_webhook
+
+
+def notification(i):
+    return {"title": f"Alert {i}", "text": f"Diesel crossed your threshold ({i})"}
+
+
+class RecordingChannel:
+    name = "webhook"
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.digests = []
+
+    async def send(self, digest):
+        self.digests.append(digest)
+        if self.error:
+            raise self.error
+
+    async def close(self):
+        pass
+
+
+async def add_user(email):
+    from database import AsyncSessionLocal, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(name="Test", email=email, password="x", role="owner")
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def outbox_rows(user_id):
+    from database import AsyncSessionLocal, NotificationOutbox
+
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(
+            select(NotificationOutbox).where(NotificationOutbox.user_id == user_id).order_by(NotificationOutbox.id)
+        )).all()
+
+
+def test_queued_notification_is_delivered_by_the_server():
+    import notifications
+    from database import AsyncSessionLocal, User
+
+    async def run():
+        async with app_server() as base_url, httpx.AsyncClient(base_url=base_url) as client:
+            await login(client, "notify@example.com")
+            async with AsyncSessionLocal() as db:
+                user_id = await db.scalar(select(User.id).where(User.email == "notify@example.com"))
+                assert await notifications.enqueue(db, [(user_id, "test:served", notification(1))],
+                                                   channels=["webhook"]) == 1
+            # Delivered by the dispatcher the lifespan started, not by this test
+            while not (rows := await outbox_rows(user_id)) or rows[0].status != "sent":
+                await asyncio.sleep(0.05)
+            return rows
+
+    with running_webhook() as (url, webhook):
+        notifications.register_channel(notifications.WebhookChannel(url=url))
+        try:
+            rows = asyncio.run(asyncio.wait_for(run(), 30))
+        finally:
+            notifications._channels.pop("webhook")
+    assert webhook.ids[rows[0].id] == 1
+
+
+def test_enqueue_skips_duplicates(run):
+    from database import AsyncSessionLocal
+    from notifications import enqueue
+
+    async def enqueue_twice():
+        user_id = await add_user("dedupe@example.com")
+        async with AsyncSessionLocal() as db:
+            batch = [(user_id, f"test:dedupe:{i}", notification(i)) for i in range(3)]
+            return (await enqueue(db, batch, channels=["webhook"]),
+                    await enqueue(db, batch, channels=["webhook", "email"]))
+
+    assert run(enqueue_twice()) == (3, 3)
+
+
+def test_user_gets_one_digest(run):
+    from database import AsyncSessionLocal
+    from notifications import NotificationDispatcher, enqueue
+
+    channel = RecordingChannel()
+
+    async def deliver():
+        user_id = await add_user("digest@example.com")
+        async with AsyncSessionLocal() as db:
+            await enqueue(db, [(user_id, f"test:digest:{i}", notification(i)) for i in range(3)], channels=["webhook"])
+        await NotificationDispatcher(channels={"webhook": channel}).drain()
+        return user_id, await outbox_rows(user_id)
+
+    user_id, rows = run(deliver())
+    digests = [digest for digest in channel.digests if digest.user_id == user_id]
+    assert [len(digest.notifications) for digest in digests] == [3]
+    assert digests[0].email == "digest@example.com"
+    assert {row.status for row in rows} == {"sent"}
+
+
+def test_failed_delivery_is_retried_then_given_up(run):
+    import notifications
+    from database import AsyncSessionLocal, NotificationOutbox
+
+    channel = RecordingChannel(error=RuntimeError("upstream down"))
+    dispatcher = notifications.NotificationDispatcher(channels={"webhook": channel})
+
+    async def fail_twice():
+        user_id = await add_user("retry@example.com")
+        async with AsyncSessionLocal() as db:
+            await notifications.enqueue(db, [(user_id, "test:retry", notification(1))], channels=["webhook"])
+        await dispatcher.drain()
+        (first,) = await outbox_rows(user_id)
+        # A retry is due later; make it the last attempt and due now
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(NotificationOutbox).where(NotificationOutbox.id == first.id).values(
+                attempts=notifications.NOTIFY_MAX_ATTEMPTS - 1,
+                next_attempt_at=notifications.utcnow() - timedelta(seconds=1)))
+            await db.commit()
+        await dispatcher.drain()
+        (last,) = await outbox_rows(user_id)
+        return user_id, first, last
+
+    user_id, first, last = run(fail_twice())
+    assert first.status == "pending" and first.attempts == 1
+    assert "upstream down" in first.last_error
+    assert first.next_attempt_at.replace(tzinfo=None) > notifications.utcnow().replace(tzinfo=None)
+    assert last.status == "failed" and last.attempts == notifications.NOTIFY_MAX_ATTEMPTS
+    assert len([digest for digest in channel.digests if digest.user_id == user_id]) == 2
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from harness import app_client, login
+from stub_stripe import running_stripe
+
+ORDER = {"product": "Diesel", "area": "U.S.", "quantity": 100, "target_price": 3.5}
+
+
+@pytest.fixture
+def stripe_stub(monkeypatch):
+    from payments import get_stripe, intent_cache
+
+    with running_stripe(latency=0.05) as (url, stub):
+        monkeypatch.setattr(get_stripe(), "api_base", url)
+        yield stub
+    intent_cache.clear()
+
+
+def pay(client, headers, **body):
+    return client.post("/payments/create-intent", headers=headers, json={"amount": 35000, **body})
+
+
+def test_retries_for_an_order_create_one_intent(stripe_stub):
+    from payments import intent_cache
+
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "payer@example.com", role="trucker")
+            order_id = (await client.post("/orders", headers=headers, json=ORDER)).json()["id"]
+            first = await asyncio.gather(*(pay(client, headers, order_id=order_id) for _ in range(5)))
+            again = await pay(client, headers, order_id=order_id)
+            calls = stripe_stub.requests
+            # As on another worker: Stripe replays the intent for the same key
+            intent_cache.clear()
+            other_worker = await pay(client, headers, order_id=order_id)
+            return [r.json()["client_secret"] for r in (*first, again, other_worker)], calls
+
+    secrets, calls = asyncio.run(run())
+    assert len(set(secrets)) == 1
+    assert calls == 1
+    assert stripe_stub.created == 1 and stripe_stub.replayed == 1
+
+
+def test_client_idempotency_key_is_honoured(stripe_stub):
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "keyed@example.com", role="trucker")
+            keyed = {**headers, "Idempotency-Key": "checkout-1"}
+            return [(await pay(client, keyed)).json()["client_secret"] for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first == second and stripe_stub.created == 1
+
+
+def test_payments_without_a_key_are_not_deduplicated(stripe_stub):
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "unkeyed@example.com", role="trucker")
+            return [(await pay(client, headers)).json()["client_secret"] for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first != second
+    assert stripe_stub.created == 2
+    # stripe-python still sends a random key per call so its own retries are safe
+    assert not any(key.startswith("pi-") for key in stripe_stub.responses)
+
+
+def test_unknown_order_is_rejected(stripe_stub):
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "stranger@example.com", role="trucker")
+            return (await pay(client, headers, order_id=999999)).status_code
+
+    assert asyncio.run(run()) == 404
+    assert stripe_stub.requests == 0
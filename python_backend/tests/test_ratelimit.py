@@ -0,0 +1,129 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fastapi import HTTPException, Request
+
+from harness import app_client, login
+
+
+def make_request(headers=None, host="10.0.0.1"):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "client": (host, 1234)})
+
+
+def redis_store(server):
+    from shared_store import RedisStore
+
+    return RedisStore(fakeredis.aioredis.FakeRedis(server=server))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_store(request):
+    """Stores of one backend; Redis stores made by one factory share a server."""
+    from shared_store import MemoryStore
+
+    if request.param == "memory":
+        store = MemoryStore()
+        return lambda: store
+    server = fakeredis.FakeServer()
+    return lambda: redis_store(server)
+
+
+def test_bucket_allows_a_burst_then_waits(make_store):
+    async def run():
+        store = make_store()
+        waits = [await store.take("bucket", rate=1.0, capacity=3) for _ in range(4)]
+        other = await store.take("other", rate=1.0, capacity=3)
+        return waits, other
+
+    waits, other = asyncio.run(run())
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 0.9 < waits[3] <= 1.0
+    assert other == 0.0
+
+
+def test_redis_bucket_is_shared_between_workers():
+    server = fakeredis.FakeServer()
+
+    async def run():
+        workers = [redis_store(server), redis_store(server)]
+        return [await workers[i % 2].take("shared", rate=0.1, capacity=4) for i in range(6)]
+
+    waits = asyncio.run(run())
+    assert waits[:4] == [0.0] * 4 and all(wait > 0 for wait in waits[4:])
+
+
+def test_redis_outage_fails_open():
+    server = fakeredis.FakeServer()
+    server.connected = False
+
+    async def run():
+        store = redis_store(server)
+        return [await store.take("down", rate=0.1, capacity=1) for _ in range(3)], store.errors
+
+    waits, errors = asyncio.run(run())
+    assert waits == [0.0] * 3 and errors == 3
+
+
+def test_limiter_rejects_with_retry_after(make_store):
+    from ratelimit import RateLimiter
+
+    limiter = RateLimiter(store=make_store(), enabled=True)
+
+    @limiter.limit("2/minute")
+    async def endpoint(request: Request):
+        return "ok"
+
+    async def run():
+        request = make_request()
+        results = [await endpoint(request=request) for _ in range(2)]
+        with pytest.raises(HTTPException) as rejected:
+            await endpoint(request=request)
+        return results, rejected.value
+
+    results, rejected = asyncio.run(run())
+    assert results == ["ok", "ok"]
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "30"
+
+
+def test_rate_limit_key_reuses_decoded_claims(monkeypatch):
+    import main
+
+    token = main.create_access_token({"user_id": "42"})
+    decoded = []
+    decode_token = main.decode_token
+    monkeypatch.setattr(main, "decode_token", lambda *args: decoded.append(args) or decode_token(*args))
+
+    request = make_request({"Authorization": f"Bearer {token}"})
+    assert main.token_claims(request, token)["user_id"] == "42"
+    assert main.rate_limit_key(request) == "user:42"
+    assert len(decoded) == 1
+
+    assert main.rate_limit_key(make_request({"Authorization": "Bearer not-a-token"})) == "ip:10.0.0.1"
+    assert main.rate_limit_key(make_request()) == "ip:10.0.0.1"
+
+
+def test_endpoint_limits_each_user_separately(monkeypatch):
+    import main
+    from shared_store import MemoryStore, set_store
+
+    async def run():
+        async with app_client() as client:
+            first = await login(client, "limited@example.com")
+            second = await login(client, "unlimited@example.com")
+            # app_client turns the limiter off so benchmarks measure the app
+            monkeypatch.setattr(main.limiter, "enabled", True)
+            set_store(MemoryStore())
+            try:
+                spent = [(await client.get("/api/owner/spot-prices", headers=first)).status_code for _ in range(31)]
+                other = await client.get("/api/owner/spot-prices", headers=second)
+            finally:
+                set_store(None)
+            return spent, other
+
+    spent, other = asyncio.run(run())
+    assert spent[:30] == [200] * 30
+    assert spent[30] == 429
+    assert other.status_code == 200
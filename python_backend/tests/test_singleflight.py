@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from cache import SingleFlight
+
+
+def test_singleflight_shares_one_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return object()
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(100)))
+
+    results = asyncio.run(run())
+    assert calls == 1
+    assert all(r is results[0] for r in results)
+    assert flight.saved == 99
+
+
+@pytest.mark.parametrize("error_rate", [0.0, 1.0])
+def test_concurrent_price_fetches_hit_eia_once(eia_stub, error_rate):
+    import eia
+
+    async def run():
+        eia.price_cache.clear()
+        try:
+            return await asyncio.gather(
+                *(eia.get_cached_prices("weekly", 1000) for _ in range(200)),
+                return_exceptions=True,
+            )
+        finally:
+            await eia.close_eia_client()
+
+    eia_stub.latency, eia_stub.error_rate = 0.1, error_rate
+    hits, saved = eia_stub.hits, eia.cache_stats()["singleflight"]["saved"]
+    try:
+        results = asyncio.run(run())
+    finally:
+        eia_stub.latency, eia_stub.error_rate = 0.0, 0.0
+    assert eia_stub.hits - hits == 1
+    assert eia.cache_stats()["singleflight"]["saved"] - saved == 199
+    if error_rate:
+        assert all(isinstance(r, Exception) for r in results)
+    else:
+        assert all(r is results[0] for r in results)
@@ -0,0 +1,88 @@
+from datetime import date
+
+import pytest
+
+FILTERS = [
+    {},
+    {"product": "Diesel"},
+    {"product": "EPMR", "region": "west coast"},
+    {"area": "padd 1a", "start": date(2024, 12, 16)},
+    {"product": "Gasoline", "area": "NUS", "end": date(2024, 12, 20)},
+    {"region": "nowhere"},
+]
+
+
+@pytest.fixture
+def weekly_prices(run, monkeypatch):
+    """Stored weekly stub prices since December 2024 and a snapshot built from them."""
+    import ingest
+    import snapshot
+    from database import AsyncSessionLocal
+
+    monkeypatch.setattr(ingest, "INGEST_BACKFILL_START", "2024-12-02")
+
+    async def load():
+        async with AsyncSessionLocal() as db:
+            await ingest.ingest_prices(db, "weekly")
+        return await snapshot.rebuild_snapshot("weekly")
+
+    return run(load())
+
+
+def by_period_and_series(rows):
+    return sorted(rows, key=lambda row: (row["period"], row["series"]))
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_snapshot_rows_match_the_store(run, weekly_prices, filters):
+    from database import AsyncSessionLocal
+    from price_store import query_observations
+
+    async def stored():
+        async with AsyncSessionLocal() as db:
+            return await query_observations(db, "weekly", **filters)
+
+    expected = run(stored())
+    assert by_period_and_series(weekly_prices.query_rows(**filters)) == by_period_and_series(expected)
+
+
+@pytest.mark.parametrize("area", ["U.S.", "r10", "Nowhere"])
+def test_snapshot_series_match_the_store(run, weekly_prices, area):
+    from database import AsyncSessionLocal
+    from price_store import query_series
+
+    async def stored():
+        async with AsyncSessionLocal() as db:
+            return await query_series(db, "weekly", "EPD2D", area)
+
+    assert weekly_prices.series_values("EPD2D", area) == run(stored())
+
+
+def test_product_is_resolved_like_other_endpoints(weekly_prices):
+    diesel = weekly_prices.subset("diesel")
+    assert len(diesel.series_ids) > 0
+    assert {weekly_prices.products[p][0] for p in diesel.series_product.tolist()} == {"EPD2D"}
+
+
+def test_price_endpoints_read_a_current_snapshot(weekly_prices, monkeypatch):
+    import asyncio
+
+    import main
+    from harness import app_client, login
+
+    async def unused(*args, **kwargs):
+        raise AssertionError("read the store instead of the snapshot")
+
+    monkeypatch.setattr(main, "query_observations", unused)
+    monkeypatch.setattr(main, "query_series", unused)
+
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "snapshot@example.com")
+            prices = await client.get("/prices", headers=headers, params={"product": "Diesel", "area": "U.S."})
+            ohlc = await client.get("/prices/ohlc", headers=headers, params={"bucket": "week"})
+            return prices, ohlc
+
+    prices, ohlc = asyncio.run(run())
+    assert prices.status_code == 200 and ohlc.status_code == 200, (prices.text, ohlc.text)
+    assert prices.json()["response"]["data"] == weekly_prices.query_rows("Diesel", "U.S.")
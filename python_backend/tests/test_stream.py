@@ -0,0 +1,110 @@
+import asyncio
+
+import httpx
+import orjson
+
+from harness import app_client, app_server, login
+from stub_eia import make_rows
+
+
+def price_rows(product):
+    return [row for row in make_rows(40) if row["product"] == product]
+
+
+def test_hub_delivers_to_matching_subscribers_only():
+    from realtime import BroadcastHub
+
+    async def run():
+        hub = BroadcastHub()
+        diesel = hub.subscribe("diesel")
+        gasoline = hub.subscribe("Gasoline")
+        everything = hub.subscribe()
+        hub.publish_price(price_rows("EPD2D")[0])
+        return diesel.queue.qsize(), gasoline.queue.qsize(), everything.queue.qsize()
+
+    assert asyncio.run(run()) == (1, 0, 1)
+
+
+def test_slow_subscriber_is_dropped():
+    from realtime import BroadcastHub, stream_events
+
+    async def run():
+        hub = BroadcastHub(queue_size=2)
+        slow = hub.subscribe()
+        for row in price_rows("EPD2D")[:3]:
+            hub.publish_price(row)
+        messages = [message async for message in stream_events(slow, heartbeat=1)]
+        return slow, hub, messages
+
+    slow, hub, messages = asyncio.run(run())
+    assert slow.dropped and hub.dropped == 1 and hub.subscribers == 0
+    assert messages[-1].startswith(b"event: dropped")
+
+
+def test_many_subscribers_are_released():
+    from realtime import BroadcastHub, stream_events
+
+    rows = price_rows("EPD2D")[:10]
+
+    async def consume(sub):
+        return [message async for message in stream_events(sub, heartbeat=1)]
+
+    async def run():
+        hub = BroadcastHub(queue_size=4)
+        subs = [hub.subscribe("Diesel" if i % 2 else None) for i in range(3000)]
+        slow, leaving, fast = subs[::10], subs[1::10], [sub for i, sub in enumerate(subs) if i % 10 > 1]
+        readers = [asyncio.create_task(consume(sub)) for sub in fast]
+        gone = [asyncio.create_task(consume(sub)) for sub in leaving]
+        for row in rows:
+            hub.publish_price(row)
+            await asyncio.sleep(0.01)
+        # Clients that disconnect mid-stream
+        for task in gone:
+            task.cancel()
+        await asyncio.gather(*gone, return_exceptions=True)
+        connected = hub.subscribers
+        hub.close()
+        received = await asyncio.gather(*readers)
+        ends = [(await consume(sub))[-1] for sub in slow]
+        return hub, slow, connected, received, ends
+
+    hub, slow, connected, received, ends = asyncio.run(run())
+    assert connected == 2400
+    assert all(sub.dropped for sub in slow) and hub.dropped == len(slow)
+    assert all(end.startswith(b"event: dropped") for end in ends)
+    assert all(len(messages) == len(rows) + 1 for messages in received)
+    assert hub.subscribers == 0
+
+
+def test_stream_pushes_prices_over_http():
+    from realtime import hub
+
+    async def run():
+        async with app_server() as base_url, httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            headers = await login(client, "stream@example.com")
+            token = (await client.post("/stream/token", headers=headers)).json()["token"]
+            async with client.stream("GET", "/stream", params={"token": token, "product": "Diesel"}) as resp:
+                assert resp.status_code == 200
+                hub.publish_price(price_rows("EPMR")[0])
+                hub.publish_price(price_rows("EPD2D")[0])
+                async for line in resp.aiter_lines():
+                    if line.startswith("data: "):
+                        return orjson.loads(line[6:])
+
+    row = asyncio.run(asyncio.wait_for(run(), 30))
+    assert row["product"] == "EPD2D"
+
+
+def test_stream_tokens_are_scoped():
+    async def run():
+        async with app_client() as client:
+            headers = await login(client, "scoped@example.com")
+            access_token = headers["Authorization"].split()[1]
+            stream_token = (await client.post("/stream/token", headers=headers)).json()["token"]
+            return (
+                (await client.get("/stream")).status_code,
+                (await client.get("/stream", params={"token": access_token})).status_code,
+                (await client.get("/orders", headers={"Authorization": f"Bearer {stream_token}"})).status_code,
+            )
+
+    assert asyncio.run(run()) == (401, 401, 401)
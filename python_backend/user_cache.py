@@ -0,0 +1,38 @@
+"""
+In-process cache of authenticated users, so get_current_user does not query
+the users table on every request.
+
+Entries are keyed by (user id, token exp) and live for USER_CACHE_TTL
+seconds. Any UPDATE or DELETE of a User row through the ORM drops that user's
+entries immediately.
+"""
+import os
+from typing import Optional
+
+from sqlalchemy import event
+
+from cache import TTLCache
+from database import User
+
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL)
+
+
+def get_cached_user(user_id: int, exp) -> Optional[User]:
+    return user_cache.get((user_id, exp))
+
+
+def cache_user(user_id: int, exp, user: User):
+    user_cache.set((user_id, exp), user)
+
+
+def invalidate_user(user_id: int):
+    user_cache.invalidate_matching(lambda key: key[0] == user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)